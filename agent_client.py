@@ -0,0 +1,66 @@
+# Thin client for a daemon started with `python main.py --serve`. Imports
+# only the stdlib and config, so a prompt costs a socket round trip instead of
+# a full interpreter, SDK and client start-up.
+#
+#   python agent_client.py "fix the calculator" [--session=NAME] [--socket=PATH] [--verbose]
+#   python agent_client.py --stats | --stop
+import json
+import os
+import socket
+import sys
+from config import DAEMON_SOCKET, WORKING_DIR
+
+
+def send(message, socket_path=DAEMON_SOCKET):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as reply:
+            return json.loads(reply.readline())
+
+
+def _flag_value(name):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def main():
+    socket_path = _flag_value("socket") or DAEMON_SOCKET
+    verbose = "--verbose" in sys.argv
+    prompt = " ".join(arg for arg in sys.argv[1:] if not arg.startswith("--"))
+    if "--stats" in sys.argv or "--stop" in sys.argv:
+        message = {"command": "stats" if "--stats" in sys.argv else "stop"}
+    elif prompt:
+        message = {
+            "prompt": prompt,
+            "working_directory": os.path.abspath(_flag_value("working-directory") or WORKING_DIR),
+            "session": _flag_value("session"),
+            "verbose": verbose,
+        }
+    else:
+        print('Usage: python agent_client.py "your prompt here" [--session=NAME] [--socket=PATH] [--working-directory=DIR] [--verbose]')
+        print("       python agent_client.py --stats | --stop")
+        sys.exit(1)
+
+    try:
+        reply = send(message, socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"Error: no agent daemon listening on {socket_path}; start one with `python main.py --serve`.")
+        sys.exit(1)
+
+    if "command" in message or verbose:
+        print(json.dumps(reply, indent=2))
+    if reply.get("status") == "ok" and "response" in reply:
+        print(f"\n--> Agent... : {reply['response']}")
+    elif reply.get("status") == "max_iters":
+        print("Agent: I couldn't resolve the request within the maximum number of allowed steps.")
+    elif reply.get("status") != "ok":
+        print(f"Error: {reply.get('error', reply.get('status'))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
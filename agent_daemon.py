@@ -0,0 +1,161 @@
+# `python main.py --serve`: one long-lived process answering prompts from
+# agent_client.py over a Unix socket, so the SDK import, the model client and
+# its connections and the read caches (tool_cache, search indexes, line
+# indexes) are set up once and shared by every session. Each model turn still
+# gets its own tool pool, so calls abandoned after TOOL_TIMEOUT can never
+# take up the threads other sessions need.
+#
+# Each connection carries one JSON request line and gets one JSON reply line:
+#   {"prompt": "...", "working_directory": "/abs/dir", "session": "name"}
+#   {"command": "stats"} / {"command": "stop"}
+import json
+import os
+import socketserver
+import threading
+import time
+from google.genai import types
+import change_journal
+import read_ahead
+from batch import run_turns
+from config import WORKING_DIR
+from history import HistoryManager
+from tool_budget import session_stats
+from tool_cache import tool_cache
+from tracing import span
+
+
+class _Conversation:
+    def __init__(self, messages, working_directory, session=None):
+        self.messages = messages
+        self.working_directory = working_directory
+        self.session = session
+        self.history = HistoryManager()
+        self.lock = threading.Lock()
+
+
+class AgentDaemon:
+    """Runs agent sessions for clients; see the module comment for the protocol.
+
+    Requests without a session name are one-off conversations. Named sessions
+    keep their history between requests, in a session log (see session.py) so
+    they also survive a daemon restart, and run one request at a time.
+    """
+
+    def __init__(self, client, request, socket_path, verbose=False, session_dir=None):
+        self.client = client
+        self.request = request
+        self.socket_path = socket_path
+        self.verbose = verbose
+        self.session_dir = session_dir
+        self.started = time.time()
+        self.stats = {"requests": 0, "active": 0, "errors": 0}
+        self._conversations = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _conversation(self, name, working_directory):
+        if not name:
+            return _Conversation([], working_directory)
+        with self._lock:
+            conversation = self._conversations.get(name)
+            if conversation is None:
+                from session import Session
+
+                session = Session.open(name, working_directory=working_directory, session_dir=self.session_dir)
+                conversation = _Conversation(session.messages, working_directory, session)
+                self._conversations[name] = conversation
+            return conversation
+
+    def run(self, message):
+        prompt = message.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            return {"status": "error", "error": "request has no prompt"}
+        working_directory = message.get("working_directory") or os.path.abspath(WORKING_DIR)
+        if not os.path.isdir(working_directory):
+            return {"status": "error", "error": f"working directory {working_directory} does not exist"}
+        change_journal.watch(working_directory)
+        try:
+            conversation = self._conversation(message.get("session"), working_directory)
+        except ValueError as e:
+            return {"status": "error", "error": str(e)}
+        with conversation.lock, span("daemon_request", session=message.get("session")):
+            notice = conversation.session.take_notice() if conversation.session else []
+            conversation.messages.append(types.Content(role="user", parts=[*notice, types.Part(text=prompt)]))
+            return run_turns(
+                self.client, conversation.messages, self.request, conversation.history,
+                conversation.working_directory, message.get("verbose", self.verbose),
+            )
+
+    def handle(self, message):
+        command = message.get("command", "run")
+        if command == "stats":
+            with self._lock:
+                sessions = len(self._conversations)
+            return {
+                "status": "ok",
+                "uptime_s": round(time.time() - self.started, 3),
+                "sessions": sessions,
+                "daemon": dict(self.stats),
+                "model": self.client.stats() if hasattr(self.client, "stats") else {},
+                "tool_cache": tool_cache.stats(),
+                "tool_output": dict(session_stats),
+                "read_ahead": read_ahead.buffer.stats() if read_ahead.buffer else None,
+            }
+        if command == "stop":
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+            return {"status": "ok"}
+        if command != "run":
+            return {"status": "error", "error": f"unknown command {command!r}"}
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["active"] += 1
+        try:
+            result = self.run(message)
+        finally:
+            with self._lock:
+                self.stats["active"] -= 1
+        if result.get("status") == "error":
+            with self._lock:
+                self.stats["errors"] += 1
+        return result
+
+    def serve_forever(self, ready=None):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # left over from a daemon that did not shut down cleanly
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("expected a JSON object")
+                    reply = daemon.handle(message)
+                except ValueError as e:
+                    reply = {"status": "error", "error": f"invalid request: {e}"}
+                self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+        old_umask = os.umask(0o077)  # only this user may connect
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        if ready is not None:
+            ready.set()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            with self._lock:
+                for conversation in self._conversations.values():
+                    conversation.session.close()
+                self._conversations.clear()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from google.genai import types
+from config import MAX_ITERS
+from func_calling import ToolDispatcher
+from history import HistoryManager
+from tool_cache import tool_cache
+from tracing import span
+from request_config import as_request_config, is_cache_error
+
+
+def _merge_text_parts(parts):
+    # Streaming splits text into many small parts; store them as one.
+    merged = []
+    for part in parts:
+        if (
+            merged
+            and part.text is not None
+            and merged[-1].text is not None
+            and not part.thought
+            and not merged[-1].thought
+            and not part.thought_signature
+        ):
+            merged[-1] = types.Part(text=merged[-1].text + part.text, thought_signature=merged[-1].thought_signature)
+        else:
+            merged.append(part)
+    return merged
+
+
+async def generate_content_stream(client, messages, verbose, request, history=None):
+    request = as_request_config(client, request)
+    contents = history.compact(messages) if history else messages
+    if verbose and history:
+        print("History tokens saved:", history.tokens_saved)
+    parts = []
+    usage_metadata = None
+    started_text = False
+    with ToolDispatcher(verbose, reads=history.reads if history else None, timeline=history.timeline if history else None) as dispatcher:
+        with span("model_call", model=request.model, messages=len(contents), stream=True, cached_prefix=bool(request.cache_name)) as model_span:
+            start = time.perf_counter()
+            try:
+                stream = await client.aio.models.generate_content_stream(
+                    model=request.model,
+                    contents=contents,
+                    config=request.config,
+                )
+            except Exception as e:
+                if not request.cache_name or not is_cache_error(e):
+                    raise
+                request.drop_cache()
+                model_span.set(cache_fallback=True)
+                stream = await client.aio.models.generate_content_stream(
+                    model=request.model,
+                    contents=contents,
+                    config=request.config,
+                )
+            async for chunk in stream:
+                if not parts:
+                    model_span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 3))
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+                if not chunk.candidates or not chunk.candidates[0].content:
+                    continue
+                for part in chunk.candidates[0].content.parts or []:
+                    parts.append(part)
+                    if part.function_call:
+                        # Function call parts arrive whole, so they can start
+                        # running while the rest of the candidate streams in.
+                        dispatcher.submit(part.function_call)
+                    elif part.text and not part.thought:
+                        if not started_text:
+                            print("\n--> Agent... : ", end="")
+                            started_text = True
+                        print(part.text, end="", flush=True)
+            if usage_metadata:
+                model_span.set(
+                    prompt_tokens=usage_metadata.prompt_token_count,
+                    response_tokens=usage_metadata.candidates_token_count,
+                    cached_tokens=usage_metadata.cached_content_token_count,
+                    function_calls=sum(1 for part in parts if part.function_call),
+                )
+        if started_text:
+            print()
+
+        if verbose and usage_metadata:
+            print("Prompt tokens:", usage_metadata.prompt_token_count)
+            print("Response tokens:", usage_metadata.candidates_token_count)
+
+        if not parts:
+            print("No llm response...")
+            return None
+        messages.append(types.Content(role="model", parts=_merge_text_parts(parts)))
+
+        function_call_results = await asyncio.to_thread(dispatcher.collect)
+
+    if not function_call_results:
+        return "".join(part.text or "" for part in parts if not part.thought)
+
+    function_responses = []
+    for function_call_result in function_call_results:
+        if (
+            not function_call_result.parts
+            or not function_call_result.parts[0].function_response
+        ):
+            raise Exception("empty function call result")
+        if verbose:
+            print(f"-> {function_call_result.parts[0].function_response.response}")
+        function_responses.append(function_call_result.parts[0])
+    messages.append(types.Content(parts=function_responses))
+    return None
+
+
+async def main_async(client, user_prompt, verbose, request, session=None):
+    messages = session.messages if session else []
+    history = HistoryManager()
+    print("AI Agent activated (streaming). Type 'exit' to end the session.")
+    first_prompt = True
+    while True:
+        if not first_prompt:
+            user_prompt = await asyncio.to_thread(input, "--> You... : ")
+        first_prompt = False
+        if verbose:
+            print(f"\nUser prompt: {user_prompt}\n")
+        if user_prompt.lower() == 'exit':
+            break
+        notice = session.take_notice() if session else []
+        messages.append(types.Content(role="user", parts=[*notice, types.Part(text=user_prompt)]))
+        with span("turn", stream=True) as turn_span:
+            for iteration in range(MAX_ITERS):
+                turn_span.set(iterations=iteration + 1)
+                try:
+                    final_response = await generate_content_stream(client, messages, verbose, request, history)
+                except Exception as e:
+                    print(f"Error in generate_content_stream: {e}")
+                    break
+                if final_response is not None:
+                    print("----------------------------------------------\n")
+                    break
+            else:
+                print("Agent: I couldn't resolve the request within the maximum number of allowed steps.")
+    if verbose:
+        print("Tool cache:", tool_cache.stats())
+        print("Re-reads:", history.reads.stats)
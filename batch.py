@@ -0,0 +1,165 @@
+# --batch mode: runs one independent agent session per line of a JSONL file.
+#
+# Input lines are {"prompt": "...", "id": "optional"}; output lines repeat the
+# id and prompt with the final response, status, timing and token usage.
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.genai import types
+import change_journal
+from config import MAX_ITERS, WORKING_DIR, BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE
+from history import HistoryManager
+from llm_client import RateLimiter, RateLimitedClient
+from tracing import percentiles, span
+
+
+def load_prompts(path):
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"prompt": record}
+            record.setdefault("id", str(line_number))
+            prompts.append(record)
+    return prompts
+
+
+class _UsageCounter:
+    # Per-session view of a shared client that adds up token usage.
+    def __init__(self, client):
+        self._client = client
+        self.models = self
+        self.model_calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+
+    def generate_content(self, **kwargs):
+        response = self._client.models.generate_content(**kwargs)
+        self.model_calls += 1
+        if response is not None and response.usage_metadata is not None:
+            self.prompt_tokens += response.usage_metadata.prompt_token_count or 0
+            self.response_tokens += response.usage_metadata.candidates_token_count or 0
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def run_turns(client, messages, request, history, working_directory, verbose=False):
+    # Runs the model/tool loop on `messages` until the model answers; also
+    # used by the daemon. Returns the status, response and usage.
+    from main import generate_content
+
+    counter = _UsageCounter(client)
+    result = {}
+    start = time.perf_counter()
+    try:
+        for iteration in range(MAX_ITERS):
+            response = generate_content(counter, messages, verbose, request, history, working_directory)
+            if response and not response.function_calls:
+                result["status"] = "ok"
+                result["response"] = "".join(part.text or "" for part in response.candidates[0].content.parts)
+                break
+        else:
+            result["status"] = "max_iters"
+        result["iterations"] = iteration + 1
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_s"] = round(time.perf_counter() - start, 3)
+    result["model_calls"] = counter.model_calls
+    result["prompt_tokens"] = counter.prompt_tokens
+    result["response_tokens"] = counter.response_tokens
+    return result
+
+
+def run_prompt(client, record, request, workdir_root, verbose=False):
+    result = {"id": record.get("id"), "prompt": record.get("prompt"), "working_directory": None}
+    try:
+        # Ids are only a readable prefix; mkdtemp keeps duplicates and ids
+        # like "../x" apart and inside workdir_root.
+        prefix = re.sub(r"[^A-Za-z0-9_.-]", "_", str(record.get("id")))[:40].lstrip(".") + "-"
+        working_directory = result["working_directory"] = tempfile.mkdtemp(prefix=prefix, dir=workdir_root)
+        shutil.copytree(WORKING_DIR, working_directory, ignore=shutil.ignore_patterns("__pycache__"), dirs_exist_ok=True)
+        if not isinstance(record.get("prompt"), str):
+            raise ValueError("record has no prompt")
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}", latency_s=0.0, model_calls=0, prompt_tokens=0, response_tokens=0)
+        return result
+    change_journal.watch(working_directory)
+    messages = [types.Content(role="user", parts=[types.Part(text=record["prompt"])])]
+    try:
+        with span("batch_session", id=record["id"]):
+            result.update(run_turns(client, messages, request, HistoryManager(), working_directory, verbose))
+    finally:
+        # One inotify instance per kept working directory would soon run out.
+        change_journal.unwatch(working_directory)
+    return result
+
+
+def run_batch(client, request, prompts_path, output_path, concurrency=BATCH_CONCURRENCY,
+              requests_per_minute=BATCH_REQUESTS_PER_MINUTE, keep_workdirs=False, verbose=False):
+    prompts = load_prompts(prompts_path)
+    if requests_per_minute:
+        client = RateLimitedClient(client, RateLimiter(requests_per_minute, burst=concurrency))
+    workdir_root = tempfile.mkdtemp(prefix="agent-batch-")
+    results = []
+    write_lock = threading.Lock()
+    start = time.perf_counter()
+    try:
+        with open(output_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(run_prompt, client, record, request, workdir_root, verbose) for record in prompts]
+            for future in as_completed(futures):
+                result = future.result()
+                working_directory = result.pop("working_directory")
+                if not keep_workdirs and working_directory:
+                    shutil.rmtree(working_directory, ignore_errors=True)
+                with write_lock:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                results.append(result)
+                print(f"[{len(results)}/{len(prompts)}] {result['id']}: {result['status']} in {result['latency_s']}s")
+    finally:
+        if not keep_workdirs:
+            shutil.rmtree(workdir_root, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, elapsed)
+    print_summary(summary, output_path, workdir_root if keep_workdirs else None)
+    return summary
+
+
+def summarize(results, elapsed):
+    latencies = [r["latency_s"] for r in results]
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    return {
+        "sessions": len(results),
+        "statuses": statuses,
+        "wall_s": round(elapsed, 3),
+        "sessions_per_min": round(len(results) / elapsed * 60, 2) if elapsed else 0.0,
+        "latency_s": percentiles(latencies) if latencies else {},
+        "model_calls": sum(r["model_calls"] for r in results),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in results),
+        "response_tokens": sum(r["response_tokens"] for r in results),
+    }
+
+
+def print_summary(summary, output_path, workdir_root=None):
+    print("----------------------------------------------")
+    print(f"Batch finished: {summary['sessions']} sessions in {summary['wall_s']}s ({summary['sessions_per_min']} sessions/min)")
+    print("Status:", ", ".join(f"{k}={v}" for k, v in sorted(summary["statuses"].items())))
+    if summary["latency_s"]:
+        p = summary["latency_s"]
+        print(f"Session latency: p50={p['p50']:.2f}s p90={p['p90']:.2f}s p99={p['p99']:.2f}s max={p['max']:.2f}s")
+    print(f"Model calls: {summary['model_calls']}, prompt tokens: {summary['prompt_tokens']}, response tokens: {summary['response_tokens']}")
+    print(f"Results written to {output_path}")
+    if workdir_root:
+        print(f"Working directories kept under {workdir_root}")
@@ -0,0 +1,104 @@
+# Replays recorded sessions through the agent loop against a copy of the
+# calculator sandbox and reports loop and tool latency. No network needed.
+#
+#   python benchmarks/bench_agent.py --runs 20
+#   python benchmarks/bench_agent.py --model-latency 0.05 --transcript my_session.jsonl
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google.genai import types
+import func_calling
+import main as agent
+from agent_instructions import SYSTEM_PROMPT
+from config import MAX_ITERS, WORKING_DIR
+from history import HistoryManager
+from llm_client import ReplayClient, load_transcript
+from request_config import RequestConfig
+from tool_cache import tool_cache
+from tracing import percentiles
+
+DEFAULT_TRANSCRIPT = os.path.join(ROOT, "benchmarks", "transcripts", "calculator_session.jsonl")
+DEFAULT_PROMPT = "Check that the calculator works and leave a note with the result."
+
+
+def run_session(responses, prompt, model_latency, iteration_times, tool_times):
+    client = ReplayClient(responses, latency=model_latency)
+    messages = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+    history = HistoryManager()
+    request = RequestConfig(client, SYSTEM_PROMPT.strip())
+    for _ in range(MAX_ITERS):
+        start = time.perf_counter()
+        response = agent.generate_content(client, messages, False, request, history)
+        iteration_times.append(time.perf_counter() - start)
+        if response and not response.function_calls:
+            return
+
+
+def timed_call_function(call_function, tool_times):
+    def wrapper(function_call_part, verbose=False, working_directory=WORKING_DIR):
+        start = time.perf_counter()
+        try:
+            return call_function(function_call_part, verbose, working_directory)
+        finally:
+            tool_times[function_call_part.name].append(time.perf_counter() - start)
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against replayed model responses.")
+    parser.add_argument("--transcript", default=DEFAULT_TRANSCRIPT)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--model-latency", type=float, default=0.0, help="seconds added to every replayed model call")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the tool cache between runs")
+    options = parser.parse_args()
+
+    responses = load_transcript(options.transcript)
+    sandbox_src = os.path.abspath(os.path.join(ROOT, WORKING_DIR))
+    iteration_times = []
+    tool_times = defaultdict(list)
+    session_times = []
+
+    original_call_function = func_calling.call_function
+    func_calling.call_function = timed_call_function(original_call_function, tool_times)
+    cwd = os.getcwd()
+    try:
+        for _ in range(options.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                # WORKING_DIR is relative, so a copy under a temp cwd keeps the
+                # real sandbox untouched by write_file calls.
+                shutil.copytree(sandbox_src, os.path.join(tmp, WORKING_DIR), ignore=shutil.ignore_patterns("__pycache__"))
+                os.chdir(tmp)
+                if not options.warm_cache:
+                    tool_cache.clear()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run_session(responses, options.prompt, options.model_latency, iteration_times, tool_times)
+                session_times.append(time.perf_counter() - start)
+                os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        func_calling.call_function = original_call_function
+
+    print(f"{options.runs} runs of {os.path.basename(options.transcript)} ({len(responses)} model calls each)")
+    print(f"{'':<20}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("session", session_times), ("iteration", iteration_times)]
+    rows += [(f"tool:{name}", times) for name, times in sorted(tool_times.items())]
+    for label, samples in rows:
+        p = percentiles(samples)
+        print(f"{label:<20}{p['n']:>6}" + "".join(f"{p[k] * 1000:>10.2f}" for k in ("p50", "p90", "p99", "max")))
+    print("tool cache:", tool_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
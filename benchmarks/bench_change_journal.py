@@ -0,0 +1,82 @@
+# Measures what the change journal costs on a large tree: start-up (initial
+# scan plus one inotify watch per directory), the per-turn drain when nothing
+# changed, and a drain after a batch of edits, for the inotify backend and
+# the mtime-polling fallback.
+#
+#   python benchmarks/bench_change_journal.py --dirs 500 --files 40 --changes 100
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from change_journal import ChangeJournal  # noqa: E402
+from functions import sandbox  # noqa: E402
+from tracing import percentiles  # noqa: E402
+
+
+def make_tree(root, dirs, files):
+    paths = []
+    for d in range(dirs):
+        directory = os.path.join(root, f"pkg{d // 50}", f"mod{d}")
+        os.makedirs(directory)
+        for f in range(files):
+            path = os.path.join(directory, f"file{f}.py")
+            with open(path, "w") as out:
+                out.write(f"VALUE = {f}\n")
+            paths.append(path)
+    return paths
+
+
+def measure(root, paths, polling, turns, changes):
+    start = time.perf_counter()
+    journal = ChangeJournal(os.path.realpath(root), polling=polling)
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    idle = []
+    for _ in range(turns):
+        sandbox.begin_turn()
+        start = time.perf_counter()
+        journal.drain()
+        idle.append((time.perf_counter() - start) * 1000)
+
+    busy = []
+    rng = random.Random(1)
+    for _ in range(turns):
+        turn = sandbox.begin_turn()
+        for path in rng.sample(paths, changes):
+            with open(path, "a") as out:
+                out.write("CHANGED = True\n")
+        start = time.perf_counter()
+        _, found, _ = journal.since(turn)
+        busy.append((time.perf_counter() - start) * 1000)
+        assert len(found["modified"]) == changes, (journal.backend, len(found["modified"]))
+    backend, watches = journal.backend, len(journal._watches)
+    journal.close()
+    return backend, watches, startup_ms, percentiles(idle), percentiles(busy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the change journal on a large tree.")
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--changes", type=int, default=100, help="files edited per turn in the busy phase")
+    parser.add_argument("--turns", type=int, default=10)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = make_tree(root, options.dirs, options.files)
+        print(f"tree: {options.dirs} directories, {len(paths)} files")
+        for polling in (False, True):
+            backend, watches, startup_ms, idle, busy = measure(root, paths, polling, options.turns, options.changes)
+            print(f"{backend:<8} start-up {startup_ms:8.1f} ms ({watches} watches) | "
+                  f"idle drain p50 {idle['p50']:7.2f} ms | "
+                  f"drain after {options.changes} edits p50 {busy['p50']:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
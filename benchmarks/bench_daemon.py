@@ -0,0 +1,78 @@
+# Compares per-request latency of the cold CLI (`python main.py PROMPT`, a new
+# process per prompt) with a daemon started once (`main.py --serve`), reached
+# through the thin client process and directly over the socket. Both replay
+# the recorded calculator session against a temporary copy of the sandbox, so
+# no network is needed and only agent overhead is measured.
+#
+#   python benchmarks/bench_daemon.py --runs 10
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent_client import send  # noqa: E402
+from tracing import percentiles  # noqa: E402
+
+TRANSCRIPT = os.path.join(ROOT, "benchmarks", "transcripts", "calculator_session.jsonl")
+PROMPT = "Check that the calculator works and leave a note with the result."
+
+
+def timed(samples, function):
+    start = time.perf_counter()
+    result = function()
+    samples.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent daemon against the cold CLI.")
+    parser.add_argument("--runs", type=int, default=10)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(os.path.join(ROOT, "calculator"), os.path.join(tmp, "calculator"))
+        socket_path = os.path.join(tmp, "agent.sock")
+        cli = [sys.executable, os.path.join(ROOT, "main.py"), PROMPT, f"--replay={TRANSCRIPT}"]
+        client = [sys.executable, os.path.join(ROOT, "agent_client.py"), PROMPT, f"--socket={socket_path}"]
+
+        cold = []
+        for _ in range(options.runs):
+            timed(cold, lambda: subprocess.run(cli, cwd=tmp, capture_output=True, check=True))
+
+        start = time.perf_counter()
+        daemon = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py"), "--serve", f"--socket={socket_path}", f"--replay={TRANSCRIPT}"],
+            cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            while not os.path.exists(socket_path):
+                if daemon.poll() is not None:
+                    sys.exit("daemon exited during start-up")
+                time.sleep(0.01)
+            startup_ms = (time.perf_counter() - start) * 1000
+            via_client, via_socket = [], []
+            for _ in range(options.runs):
+                timed(via_client, lambda: subprocess.run(client, cwd=tmp, capture_output=True, check=True))
+                reply = timed(via_socket, lambda: send({"prompt": PROMPT, "working_directory": os.path.join(tmp, "calculator")}, socket_path))
+                assert reply["status"] == "ok", reply
+            send({"command": "stop"}, socket_path)
+            daemon.wait(timeout=10)
+        finally:
+            if daemon.poll() is None:
+                daemon.kill()
+
+    c, k, s = percentiles(cold), percentiles(via_client), percentiles(via_socket)
+    print(f"cold CLI        : p50 {c['p50']:.1f} ms  p90 {c['p90']:.1f} ms")
+    print(f"daemon start-up : {startup_ms:.1f} ms (once)")
+    print(f"thin client     : p50 {k['p50']:.1f} ms  p90 {k['p90']:.1f} ms  ({c['p50'] / k['p50']:.1f}x)")
+    print(f"socket request  : p50 {s['p50']:.1f} ms  p90 {s['p90']:.1f} ms  ({c['p50'] / s['p50']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Compares run_python_file latency with a fresh interpreter per run (cold)
+# against the fork-server worker pool (warm), on a temporary copy of the
+# calculator sandbox. The first warm run, which starts the server, is
+# reported separately.
+#
+#   python benchmarks/bench_python_workers.py --runs 30
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import python_workers  # noqa: E402
+from functions.run_python_file import run_python_file  # noqa: E402
+from tracing import percentiles  # noqa: E402
+
+SCRIPTS = (("tests.py", []), ("main.py", ["3 + 5 * 2"]))
+
+
+def time_runs(working_dir, runs):
+    samples = {name: [] for name, _ in SCRIPTS}
+    outputs = {}
+    for _ in range(runs):
+        for name, args in SCRIPTS:
+            start = time.perf_counter()
+            outputs[name] = run_python_file(working_dir, name, args)
+            samples[name].append((time.perf_counter() - start) * 1000)
+    return samples, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold vs warm run_python_file.")
+    parser.add_argument("--runs", type=int, default=20)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        working_dir = os.path.join(tmp, "calculator")
+        shutil.copytree(os.path.join(ROOT, "calculator"), working_dir)
+
+        cold, cold_outputs = time_runs(working_dir, options.runs)
+        pool = python_workers.enable()
+        first, _ = time_runs(working_dir, 1)
+        warm, warm_outputs = time_runs(working_dir, options.runs)
+        pool.close()
+
+    for name, _ in SCRIPTS:
+        # unittest prints its own elapsed time; ignore that line.
+        same = [l for l in cold_outputs[name].splitlines() if not l.startswith("Ran ")] == \
+               [l for l in warm_outputs[name].splitlines() if not l.startswith("Ran ")]
+        c, w = percentiles(cold[name]), percentiles(warm[name])
+        print(f"{name}: cold p50 {c['p50']:.1f} ms  p90 {c['p90']:.1f} ms | "
+              f"first warm {first[name][0]:.1f} ms | warm p50 {w['p50']:.1f} ms  p90 {w['p90']:.1f} ms | "
+              f"{c['p50'] / w['p50']:.1f}x, same output: {same}")
+
+
+if __name__ == "__main__":
+    main()
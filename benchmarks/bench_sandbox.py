@@ -0,0 +1,97 @@
+# Counts stat/lstat syscalls and time per tool call for a turn's worth of
+# reads on a deep tree, with the per-turn resolver and stat cache in
+# functions/sandbox.py, against clearing it before every call (what each tool
+# used to do on its own).
+#
+#   python benchmarks/bench_sandbox.py --depth 12 --files 40 --turns 50
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions import sandbox  # noqa: E402
+from functions.get_file_content import get_file_content  # noqa: E402
+from functions.get_files_info import get_files_info  # noqa: E402
+from tool_cache import call_cached, tool_cache  # noqa: E402
+
+
+class SyscallCounter:
+    def __init__(self):
+        self.count = 0
+        self.originals = (os.stat, os.lstat)
+
+    def __enter__(self):
+        stat, lstat = self.originals
+
+        def counted_stat(*args, **kwargs):
+            self.count += 1
+            return stat(*args, **kwargs)
+
+        def counted_lstat(*args, **kwargs):
+            self.count += 1
+            return lstat(*args, **kwargs)
+
+        os.stat, os.lstat = counted_stat, counted_lstat
+        return self
+
+    def __exit__(self, *exc):
+        os.stat, os.lstat = self.originals
+
+
+def make_tree(root, depth, files):
+    path = root
+    for level in range(depth):
+        path = os.path.join(path, f"level{level}")
+    os.makedirs(path)
+    rel_paths = []
+    for i in range(files):
+        rel_path = os.path.relpath(os.path.join(path, f"module{i}.py"), root)
+        with open(os.path.join(root, rel_path), "w") as f:
+            f.write(f"VALUE = {i}\n")
+        rel_paths.append(rel_path)
+    return rel_paths, os.path.relpath(path, root)
+
+
+def run_turn(root, rel_paths, deep_dir, reset_each_call):
+    # A turn that re-reads files and lists their directory a few times, as
+    # the model does while working on a change.
+    calls = 0
+    for _ in range(3):
+        for rel_path in rel_paths:
+            if reset_each_call:
+                sandbox.invalidate_all()
+            call_cached(get_file_content, "get_file_content", {"working_directory": root, "file_path": rel_path})
+            calls += 1
+        if reset_each_call:
+            sandbox.invalidate_all()
+        call_cached(get_files_info, "get_files_info", {"working_directory": root, "directory": deep_dir})
+        calls += 1
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sandbox resolver and stat cache.")
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=50)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        rel_paths, deep_dir = make_tree(root, options.depth, options.files)
+        for label, reset in (("cache cleared per call", True), ("per-turn cache", False)):
+            calls = 0
+            with SyscallCounter() as counter:
+                start = time.perf_counter()
+                for _ in range(options.turns):
+                    sandbox.begin_turn()
+                    tool_cache.clear()
+                    calls += run_turn(root, rel_paths, deep_dir, reset)
+                elapsed = time.perf_counter() - start
+            print(f"{label:24} {counter.count / calls:6.1f} stat calls/tool call  {elapsed / calls * 1e6:7.1f} us/tool call")
+
+
+if __name__ == "__main__":
+    main()
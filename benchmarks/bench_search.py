@@ -0,0 +1,80 @@
+# Compares a brute-force scan of every file against search_files' trigram
+# index on a generated tree, and reports how long building and incrementally
+# refreshing the index take.
+#
+#   python benchmarks/bench_search.py --files 5000 --queries 20
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.search_files import _walk_files, get_index, required_literals, scan  # noqa: E402
+
+WORDS = ("value", "token", "parser", "result", "config", "buffer", "stack", "queue", "render", "handler",
+         "client", "stream", "record", "window", "format", "number", "string", "update", "delete", "insert")
+
+
+def make_tree(root, files, lines):
+    rng = random.Random(0)
+    for i in range(files):
+        directory = os.path.join(root, f"pkg{i % 50}", f"mod{i % 7}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{i}.py"), "w") as f:
+            for n in range(lines):
+                a, b = rng.choice(WORDS), rng.choice(WORDS)
+                f.write(f"def {a}_{b}_{n}(x):\n    return x + {rng.randint(0, 10**6)}\n")
+            f.write(f"MARKER_{i} = {i}\n")
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexed search against a brute-force scan.")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=40, help="functions per generated file")
+    parser.add_argument("--queries", type=int, default=10)
+    options = parser.parse_args()
+
+    rng = random.Random(1)
+    queries = [f"MARKER_{rng.randrange(options.files)} " for _ in range(options.queries)]
+    queries += [r"def (stack|queue)_render_1\b", "window_format_3("]
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as index_dir:
+        make_tree(root, options.files, options.lines)
+        build_ms, index = timed(lambda: get_index(root, index_dir=index_dir))
+        build_ms += timed(lambda: index.candidates([]))[0]
+
+        brute, indexed = [], []
+        for query in queries:
+            regex = "(" in query and "\\" in query
+            matcher = re.compile(query if regex else re.escape(query))
+            ms, expected = timed(lambda: scan(root, sorted(p for p, _ in _walk_files(root)), matcher))
+            brute.append(ms)
+            ms, got = timed(lambda: scan(root, index.candidates(required_literals(query, regex)), matcher))
+            indexed.append(ms)
+            assert got == expected, query
+
+        with open(os.path.join(root, "pkg0", "mod0", "file0.py"), "a") as f:
+            f.write("NEW_SYMBOL = 1\n")
+        refresh_ms, _ = timed(lambda: index.candidates(["NEW_SYMBOL"]))
+
+    print(f"{options.files} files, {len(queries)} queries")
+    print(f"  index build:          {build_ms:8.1f} ms")
+    print(f"  refresh (1 changed):  {refresh_ms:8.1f} ms")
+    print(f"  brute-force p50:      {statistics.median(brute):8.1f} ms")
+    print(f"  indexed p50:          {statistics.median(indexed):8.1f} ms")
+    print(f"  speedup:              {statistics.median(brute) / statistics.median(indexed):8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
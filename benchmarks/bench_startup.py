@@ -0,0 +1,78 @@
+# Measures CLI startup for the no-prompt path (`python main.py`, which only
+# prints usage) and fails if it regresses past the budget or pulls in a module
+# that should only load when a model call is made.
+#
+#   python benchmarks/bench_startup.py --runs 20 --budget-ms 60
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay out of the usage path.
+DEFERRED_MODULES = ("google.genai", "google.auth", "httpx", "pydantic", "dotenv")
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def run_once(argv):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *argv],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    # Everything imported at top level after `site` comes from the script.
+    import_us = 0
+    modules = []
+    after_site = False
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 1 and module == "site":
+            after_site = True
+            continue
+        if after_site:
+            modules.append(module)
+            if indent == 1:
+                import_us += cumulative
+    return wall_ms, import_us / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup and enforce an import-time budget.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=60.0, help="max median import time of main.py's own imports")
+    options = parser.parse_args()
+
+    baseline = [run_once(["-c", "pass"])[0] for _ in range(options.runs)]
+    samples = [run_once(["main.py"]) for _ in range(options.runs)]
+    wall = [s[0] for s in samples]
+    imports = [s[1] for s in samples]
+    modules = samples[-1][2]
+
+    print(f"python -c pass  : median {statistics.median(baseline):.1f} ms wall")
+    print(f"python main.py  : median {statistics.median(wall):.1f} ms wall, "
+          f"{statistics.median(imports):.1f} ms importing {len(modules)} modules (budget {options.budget_ms:.0f} ms)")
+
+    failures = []
+    loaded = [prefix for prefix in DEFERRED_MODULES if any(m.startswith(prefix) for m in modules)]
+    if loaded:
+        failures.append(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if statistics.median(imports) > options.budget_ms:
+        failures.append(f"import time {statistics.median(imports):.1f} ms exceeds budget {options.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+import time
+import weakref
+from collections import deque
+from config import CHANGE_JOURNAL_MAX_EVENTS, CHANGE_JOURNAL_POLLING, LIST_SKIP_DIRS
+from functions import sandbox
+
+# inotify(7) constants.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def _inotify():
+    # The libc functions, or None where inotify is unavailable.
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+
+def _scan(abs_root, rel_dir=""):
+    # (rel dirs, {rel file: (mtime_ns, size)}) below rel_dir, skipping LIST_SKIP_DIRS.
+    dirs = [rel_dir]
+    files = {}
+    stack = [rel_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(os.path.join(abs_root, current)) as it:
+                for entry in it:
+                    rel = os.path.join(current, entry.name) if current else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in LIST_SKIP_DIRS:
+                                dirs.append(rel)
+                                stack.append(rel)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files[rel] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return dirs, files
+
+
+class ChangeJournal:
+    """Files created, modified or deleted under one working directory, by turn.
+
+    Uses inotify where available, otherwise compares scandir mtimes and
+    sizes against the previous scan. Either way changes are collected when a
+    turn starts (see ToolDispatcher) and when get_changes asks, and stamped
+    with the time they were collected. Conversations sharing a directory
+    number their turns separately, so since() maps a turn to its start time
+    on the asking conversation's sandbox.Timeline; a change made between two
+    turns by an editor or a script belongs to the earlier one. Only the last
+    max_events changes are kept; asking about turns before that says the
+    answer is incomplete.
+    """
+
+    def __init__(self, abs_root, polling=CHANGE_JOURNAL_POLLING, max_events=CHANGE_JOURNAL_MAX_EVENTS):
+        self.root = abs_root
+        self.started = time.monotonic_ns()
+        self.last_query = weakref.WeakKeyDictionary()  # sandbox.Timeline -> turn of its last since()
+        self.events = deque()  # (monotonic ns, kind, rel path); kind is "created", "modified" or "deleted"
+        self.max_events = max_events
+        self.dropped_through = None  # newest stamp of the events dropped from the front
+        self.stats = {"drains": 0, "events": 0, "rescans": 0}
+        self._lock = threading.Lock()
+        self._fd = None
+        self._watches = {}  # watch descriptor -> rel dir
+        dirs, self._files = _scan(abs_root)
+        libc = None if polling else _inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                for rel_dir in dirs:
+                    if not self._add_watch(rel_dir):
+                        self._close_fd()  # out of watches; poll instead
+                        break
+        self.backend = "inotify" if self._fd is not None else "polling"
+
+    def _add_watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir).encode()
+        wd = _libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            return ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR)  # gone already: nothing to watch
+        self._watches[wd] = rel_dir
+        return True
+
+    def _close_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._watches = {}
+
+    def _record(self, kind, rel):
+        now = time.monotonic_ns()
+        if self.events and self.events[-1][1:] == (kind, rel):
+            self.events[-1] = (now, kind, rel)  # the same change again: keep the newest stamp
+            return
+        self.events.append((now, kind, rel))
+        self.stats["events"] += 1
+        while len(self.events) > self.max_events:
+            self.dropped_through = self.events.popleft()[0]
+
+    def _file_changed(self, rel, exists):
+        if exists:
+            self._record("modified" if rel in self._files else "created", rel)
+            self._files[rel] = None  # stamps only matter to the polling backend
+        elif rel in self._files:
+            del self._files[rel]
+            self._record("deleted", rel)
+
+    def _dir_appeared(self, rel_dir):
+        # Files can land in a new directory before its watch is added.
+        dirs, files = _scan(self.root, rel_dir)
+        for rel in dirs:
+            self._add_watch(rel)
+        for rel in files:
+            self._file_changed(rel, True)
+
+    def _dir_gone(self, rel_dir):
+        prefix = rel_dir + os.sep
+        for rel in [p for p in self._files if p.startswith(prefix)]:
+            self._file_changed(rel, False)
+
+    def _rescan(self):
+        self.stats["rescans"] += 1
+        _, files = _scan(self.root)
+        for rel, stamp in files.items():
+            known = self._files.get(rel, False)
+            if known is False:
+                self._record("created", rel)
+            elif known != stamp:
+                self._record("modified", rel)
+        for rel in [p for p in self._files if p not in files]:
+            self._record("deleted", rel)
+        self._files = files
+
+    def drain(self):
+        with self._lock:
+            self.stats["drains"] += 1
+            if self._fd is None:
+                self._rescan()
+                return
+            while True:
+                try:
+                    data = os.read(self._fd, 65536)
+                except BlockingIOError:
+                    return
+                except OSError:
+                    self._close_fd()
+                    self.backend = "polling"
+                    self._rescan()
+                    return
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = EVENT.unpack_from(data, offset)
+                    name = data[offset + EVENT.size:offset + EVENT.size + length].split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+                    offset += EVENT.size + length
+                    self._event(wd, mask, name)
+
+    def _event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        rel_dir = self._watches.get(wd)
+        if rel_dir is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF) and not name:
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+            return
+        rel = os.path.join(rel_dir, name) if rel_dir else name
+        if mask & IN_ISDIR:
+            if name in LIST_SKIP_DIRS:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._dir_appeared(rel)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._dir_gone(rel)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._file_changed(rel, False)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            self._file_changed(rel, True)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB) and rel in self._files:
+            self._record("modified", rel)
+
+    def since(self, since_turn=None, timeline=None):
+        # Net effect per path of the changes since turn since_turn of
+        # `timeline` (the current turn's by default) began: a file created
+        # and deleted again is left out, one created and then changed counts
+        # as created. Without since_turn, from that conversation's previous
+        # call on, so conversations sharing the directory don't consume each
+        # other's window.
+        self.drain()
+        timeline = timeline or sandbox.current().timeline
+        with self._lock:
+            if since_turn is None:
+                since_turn = self.last_query.get(timeline, 0)
+            self.last_query[timeline] = sandbox.current_turn()
+            since_ns = timeline.started(since_turn)
+            first, last = {}, {}
+            for stamp, kind, rel in self.events:
+                if stamp >= since_ns:
+                    first.setdefault(rel, kind)
+                    last[rel] = kind
+            incomplete = since_ns < self.started or (self.dropped_through is not None and since_ns <= self.dropped_through)
+        changes = {"created": [], "modified": [], "deleted": []}
+        for rel, kind in first.items():
+            if kind == "created" and last[rel] == "deleted":
+                continue
+            changes["created" if kind == "created" else "deleted" if last[rel] == "deleted" else "modified"].append(rel)
+        for paths in changes.values():
+            paths.sort()
+        return since_turn, changes, incomplete
+
+    def close(self):
+        with self._lock:
+            self._close_fd()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def watch(working_directory):
+    # Starts (or returns) the journal for a working directory.
+    abs_root = os.path.realpath(working_directory)
+    with _journals_lock:
+        journal = _journals.get(abs_root)
+        if journal is None and os.path.isdir(abs_root):
+            journal = _journals[abs_root] = ChangeJournal(abs_root)
+        return journal
+
+
+def unwatch(working_directory):
+    # Stops and forgets the journal of a working directory, e.g. when a batch
+    # session is done with it.
+    with _journals_lock:
+        journal = _journals.pop(os.path.realpath(working_directory), None)
+    if journal is not None:
+        journal.close()
+
+
+def journal_for(working_directory):
+    with _journals_lock:
+        return _journals.get(os.path.realpath(working_directory))
+
+
+def drain_all():
+    # Called as a turn starts, so what happened since is stamped with the
+    # turn that just ended. Journals of directories that are gone are closed.
+    with _journals_lock:
+        journals = list(_journals.items())
+    for abs_root, journal in journals:
+        if not os.path.isdir(abs_root):
+            journal.close()
+            with _journals_lock:
+                _journals.pop(abs_root, None)
+            continue
+        journal.drain()
+
+
+def close_all():
+    with _journals_lock:
+        for journal in _journals.values():
+            journal.close()
+        _journals.clear()
@@ -1,4 +1,60 @@
+import os
 
 MAX_CHARS = 10000  # 10,000 bytes
 MAX_ITERS =  20 # Maximum number of iterations for function call loop.
 WORKING_DIR = "./calculator"  # Default working directory
+MAX_TOOL_WORKERS = 8  # Threads used to run function calls from one model turn.
+TOOL_TIMEOUT = 60  # Seconds to wait for a single function call result.
+CHARS_PER_TOKEN = 4  # Rough average for English text and source code, used for every token estimate.
+HISTORY_TOKEN_BUDGET = 32000  # Estimated prompt tokens allowed for the message history.
+HISTORY_KEEP_RECENT = 6  # Most recent messages that are never compacted.
+TOOL_CACHE_MAX_BYTES = 16 * 1024 * 1024  # Size limit for cached read-only tool results.
+MODEL = "gemini-2.5-flash"  # Model used for every generate_content call.
+CONTEXT_CACHE_TTL = "3600s"  # Lifetime of the cached system prompt and tool schemas.
+BATCH_CONCURRENCY = 8  # Agent sessions run at the same time in --batch mode.
+BATCH_REQUESTS_PER_MINUTE = 300  # Model calls per minute shared by all batch sessions.
+MODEL_MAX_RETRIES = 4  # Retries of a failed model call before giving up.
+MODEL_BACKOFF_BASE = 1.0  # Seconds before the first retry; doubles on each attempt.
+MODEL_BACKOFF_MAX = 20.0  # Upper bound for a single backoff sleep.
+MODEL_CALL_DEADLINE = 180.0  # Seconds a model call may take, retries included.
+HEDGE_MIN_SAMPLES = 10  # Latency samples needed before the hedge delay follows the p95.
+HEDGE_DEFAULT_DELAY = 15.0  # Hedge delay used until enough samples are collected.
+MMAP_MIN_BYTES = 1024 * 1024  # Ranged reads of files at least this big go through mmap.
+LINE_INDEX_CACHE_SIZE = 32  # Files whose line-offset index is kept between reads.
+LIST_PAGE_SIZE = 500  # Entries returned per get_files_info call before a cursor is handed back.
+LIST_SKIP_DIRS = {".git", "__pycache__", ".venv", "venv", "node_modules", ".mypy_cache", ".pytest_cache"}  # Never listed or descended into.
+SEARCH_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".agent_cache")  # Where search_files keeps its trigram indexes.
+SEARCH_MAX_FILE_BYTES = 2 * 1024 * 1024  # Larger files are not indexed or searched.
+SEARCH_MAX_RESULTS = 50  # Matches returned by one search_files call.
+FSYNC_WRITES = False  # fsync files (and their directory) before write_file/edit_file report success.
+PYTHON_WORKERS = False  # Run scripts from warm fork-server interpreters instead of a fresh python each time (--warm-python).
+PYTHON_WORKER_PRELOAD_SECONDS = 10  # Time a warm server may spend importing a run's modules before it gives up on them.
+RUN_OUTPUT_MAX_BYTES = 10000  # Bytes of each of stdout/stderr kept from a script run (first and last halves).
+RUN_OUTPUT_HARD_LIMIT = 10 * 1024 * 1024  # A script writing more output than this is killed.
+RUN_CPU_SECONDS = 20  # CPU-time rlimit for scripts started by run_python_file (0 = no limit).
+RUN_MEMORY_LIMIT = 1024 * 1024 * 1024  # Address-space rlimit in bytes for those scripts (0 = no limit).
+RUN_TESTS_PATTERNS = ("test_*.py", "*_test.py", "tests.py")  # File names run_tests treats as test modules.
+RUN_TESTS_WORKERS = os.cpu_count() or 2  # Test processes run_tests starts at once.
+RUN_TESTS_SHARD_SECONDS = 2.0  # A test file is split into one shard per this many seconds of its last run.
+RUN_TESTS_TIMEOUT = 50  # Seconds one test process may run.
+RUN_TESTS_MAX_FAILURES = 20  # Failures listed in a run_tests summary.
+TURN_TOOL_TOKEN_BUDGET = 12000  # Estimated tokens all tool results of one model turn may add to the history.
+TOOL_RESULT_MIN_TOKENS = 500  # Every tool result may use at least this much, even when the turn's budget is spent.
+SESSION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".agent_cache", "sessions")  # Where --session NAME keeps its logs.
+SESSION_COMPRESS_MIN_BYTES = 512  # Session log records at least this big are zlib-compressed.
+REREAD_DIFF_MAX_RATIO = 0.5  # A re-read returns a diff only if it is at most this fraction of the file's size.
+REREAD_DIFF_CONTEXT = 2  # Context lines around each change in a re-read diff.
+DAEMON_SOCKET = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".agent_cache", "agent.sock")  # Unix socket of `main.py --serve`.
+READ_AHEAD = False  # Load small files in the background after get_files_info (--read-ahead).
+READ_AHEAD_MAX_FILES = 32  # Files loaded ahead per listing.
+READ_AHEAD_MAX_BYTES = 4 * 1024 * 1024  # Memory held by loaded-ahead files; the oldest are dropped beyond this.
+READ_AHEAD_FILE_MAX_BYTES = 64 * 1024  # Larger files are never loaded ahead.
+READ_AHEAD_WORKERS = 4  # Threads loading files ahead.
+READ_AHEAD_WAIT = 1.0  # Seconds get_file_content waits for a file that is still being loaded ahead.
+CHANGE_JOURNAL_POLLING = False  # Find changes by rescanning mtimes instead of using inotify.
+CHANGE_JOURNAL_MAX_EVENTS = 10000  # Changes kept per working directory; older ones are forgotten.
+GET_CHANGES_MAX_PATHS = 200  # Paths of each kind returned by one get_changes call.
+MODEL_TIERS = ("gemini-2.5-flash-lite", "gemini-2.5-flash", "gemini-2.5-pro")  # Models --route chooses from, cheapest first.
+ROUTE_DEFAULT_TIER = 1  # Tier of MODEL_TIERS for new prompts, failures and tool output that needs reading closely.
+ROUTE_CHEAP_TOOLS = ("get_files_info", "get_file_content", "search_files", "get_changes", "write_file", "edit_file")  # Successful calls of only these let the next step use the cheapest tier.
+ROUTE_LARGE_PROMPT_TOKENS = 32000  # Prompts estimated above this never go to the cheapest tier.
@@ -1,17 +1,59 @@
-from google.genai import types
-from config import WORKING_DIR
-from functions.tools_schema import function_map, schemas
+import os
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import change_journal
+from config import WORKING_DIR, MAX_TOOL_WORKERS, TOOL_TIMEOUT
+from functions import sandbox
+from functions.tools_schema import function_map, get_schemas
+from read_ahead import after_listing
+from tool_budget import TurnBudget, record_turn
+from tool_cache import call_cached
+from tracing import span
 
-available_functions = types.Tool(
+@functools.cache
+def get_available_functions():
+    from google.genai import types
+
+    schemas = get_schemas()
+    return types.Tool(
         function_declarations=[
             schemas["schema_get_files_info"],
             schemas["schema_get_file_content"],
             schemas["schema_write_file"],
-            schemas["schema_run_python_file"]
+            schemas["schema_edit_file"],
+            schemas["schema_run_python_file"],
+            schemas["schema_search_files"],
+            schemas["schema_run_tests"],
+            schemas["schema_get_changes"],
         ]
     )
 
-def call_function(function_call_part, verbose=False):
+def __getattr__(name):
+    if name == "available_functions":
+        return get_available_functions()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Tools that never change the working directory and can run side by side.
+READ_ONLY_FUNCTIONS = {"get_files_info", "get_file_content", "search_files", "get_changes"}
+# Tools that read or change files beyond any path argument; see ToolDispatcher.
+BARRIER_FUNCTIONS = {"run_python_file", "run_tests"}
+
+def _function_response(function_name, response):
+    from google.genai import types
+
+    return types.Content(
+        role="tool",
+        parts=[
+            types.Part.from_function_response(
+                name=function_name,
+                response=response,
+            )
+        ],
+    )
+
+def call_function(function_call_part, verbose=False, working_directory=WORKING_DIR, budget=None, reads=None):
     if verbose:
         print(f" - Calling function: {function_call_part.name} ({function_call_part.args})")
     else:
@@ -19,24 +61,147 @@ def call_function(function_call_part, verbose=False):
           
     function_name = function_call_part.name
     if function_name not in function_map:
-        return types.Content(
-            role="tool",
-            parts=[
-                types.Part.from_function_response(
-                    name=function_name,
-                    response={"error": f"Unknown function: {function_name}"},
-                )
-            ],
-        )
+        return _function_response(function_name, {"error": f"Unknown function: {function_name}"})
     args = dict(function_call_part.args)
-    args["working_directory"] = WORKING_DIR
-    function_result = function_map[function_name](**args)
-    return types.Content(
-        role="tool",
-        parts=[
-            types.Part.from_function_response(
-                name=function_name,
-                response={"result": function_result},
+    args["working_directory"] = working_directory
+    full = bool(args.pop("full", False)) if function_name == "get_file_content" else False
+    with span("tool_call", tool=function_name, path=_touched_path(function_call_part)) as tool_span:
+        function_result = call_cached(function_map[function_name], function_name, args)
+        if function_name == "get_files_info":
+            function_result = after_listing(args, function_result)
+        sent, reread_tokens_saved = reads.view(function_name, args, function_result, full) if reads else (function_result, 0)
+        sent, trimmed_tokens = (budget or TurnBudget()).fit(function_name, args, sent)
+        if reads:
+            reads.remember(function_name, args, function_result, trimmed=trimmed_tokens > 0)
+        tool_span.set(
+            result_chars=len(sent) if isinstance(sent, str) else len(str(sent)),
+            trimmed_tokens=trimmed_tokens,
+            reread_tokens_saved=reread_tokens_saved,
+        )
+    return _function_response(function_name, {"result": sent})
+
+
+class ToolDispatcher:
+    """Runs the function calls of one model turn on a thread pool.
+
+    Read-only calls run in parallel. A write or edit waits for every earlier
+    call on an overlapping path (the same file, or a directory containing
+    it), and later calls on such a path wait for it. BARRIER_FUNCTIONS and
+    other calls that may change anything are barriers: they wait for
+    every earlier call and every later call waits for them. The model sees
+    the same ordering as a sequential run.
+    """
+
+    def __init__(self, verbose=False, timeout=TOOL_TIMEOUT, max_workers=MAX_TOOL_WORKERS, working_directory=WORKING_DIR, reads=None, timeline=None):
+        # One dispatcher per model turn of the conversation `timeline`; path
+        # resolutions and stats are only reused within the turn. Changes seen
+        # until now belong to the last turn.
+        change_journal.drain_all()
+        self._turn = sandbox.new_turn(timeline)
+        self.turn = self._turn.number
+        self.budget = TurnBudget()
+        self.reads = reads
+        self.verbose = verbose
+        self.working_directory = working_directory
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._barrier = None
+        self._since_barrier = []  # (path, is write, future) submitted after the last barrier
+        self._pending = []  # (call, future, deadline)
+
+    def submit(self, function_call_part, reserved=False):
+        if not reserved:
+            self.budget.reserve()
+        name = function_call_part.name
+        path = _touched_path(function_call_part)
+        read_only = name in READ_ONLY_FUNCTIONS
+        barrier = name in BARRIER_FUNCTIONS or (path is None and not read_only)
+        if barrier:
+            deps = [future for _, _, future in self._since_barrier]
+        else:
+            path = path or "."  # a read without a path covers the whole working directory
+            deps = [future for other, write, future in self._since_barrier
+                    if (write or not read_only) and _paths_overlap(path, other)]
+        if self._barrier is not None:
+            deps.append(self._barrier)
+        # Copy the context so tool spans nest under the caller's turn span,
+        # and enter this turn's sandbox caches in it.
+        context = contextvars.copy_context()
+        context.run(sandbox.enter, self._turn)
+        # Each call gets `timeout` from its submission, however long the
+        # calls collected before it took.
+        deadline = time.monotonic() + self.timeout
+        future = self._executor.submit(context.run, self._run, function_call_part, deps, deadline)
+        if barrier:
+            self._barrier = future
+            self._since_barrier = []
+        else:
+            self._since_barrier.append((path, not read_only, future))
+        self._pending.append((function_call_part, future, deadline))
+        return future
+
+    def _run(self, function_call_part, deps, deadline):
+        for dep in deps:
+            try:
+                dep.result(timeout=max(deadline - time.monotonic(), 0))
+            except FuturesTimeoutError:
+                return _function_response(
+                    function_call_part.name,
+                    {"error": f"Skipped: an earlier call it depends on did not finish within {self.timeout}s"},
+                )
+            except Exception:
+                pass  # reported on the earlier call itself
+        return call_function(function_call_part, self.verbose, self.working_directory, self.budget, self.reads)
+
+    def result(self, function_call_part, future, deadline):
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeoutError:
+            return _function_response(
+                function_call_part.name,
+                {"error": f"Function {function_call_part.name} timed out after {self.timeout}s"},
             )
-        ],
-    )
\ No newline at end of file
+        except Exception as e:
+            return _function_response(function_call_part.name, {"error": f"Function {function_call_part.name} failed: {e}"})
+
+    def collect(self):
+        # Results come back in submission order, whatever order they finished in.
+        results = [self.result(part, future, deadline) for part, future, deadline in self._pending]
+        self._pending = []
+        return results
+
+    def close(self):
+        # Hung calls are abandoned rather than joined so they can't stall the loop.
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        record_turn(self.budget)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _touched_path(function_call_part):
+    args = function_call_part.args or {}
+    path = args.get("file_path", args.get("directory"))
+    if not isinstance(path, str):
+        return None
+    return os.path.normpath(path)
+
+
+def _paths_overlap(a, b):
+    # True if one path is the other or lies below it ("." is the whole tree).
+    if a == b or a == "." or b == ".":
+        return True
+    return a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def call_functions(function_call_parts, verbose=False, timeout=TOOL_TIMEOUT, working_directory=WORKING_DIR, reads=None, timeline=None):
+    with ToolDispatcher(verbose, timeout, working_directory=working_directory, reads=reads, timeline=timeline) as dispatcher:
+        # All calls are known up front, so the budget is split over all of
+        # them even if the first finishes before the last is submitted.
+        dispatcher.budget.reserve(len(function_call_parts))
+        for function_call_part in function_call_parts:
+            dispatcher.submit(function_call_part, reserved=True)
+        return dispatcher.collect()
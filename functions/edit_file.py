@@ -0,0 +1,220 @@
+import json
+import re
+from functions import sandbox
+from functions.write_file import atomic_write
+import python_workers
+import read_ahead
+from tracing import current_span
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+def edit_file(working_directory: str, file_path: str, edits=None, diff: str = None):
+    resolved = sandbox.resolve(working_directory, file_path)
+    if resolved is None:
+        return f'Error: {file_path} is outside the permitted working directory'
+    abs_working_dir, abs_file_path = resolved
+    if not sandbox.isfile(abs_file_path):
+        return f'Error: File not found or is not a regular file: "{file_path}"'
+    if not edits and not diff:
+        return "Error: pass either edits (search/replace pairs) or diff (a unified diff)"
+    if edits and diff:
+        return "Error: pass edits or diff, not both"
+
+    try:
+        with open(abs_file_path, "r", encoding="utf-8", newline="") as f:
+            original = f.read()
+    except Exception as e:
+        return f"Error: Could not read {file_path}: {e}"
+
+    try:
+        if diff:
+            updated, hunks = apply_unified_diff(original, diff)
+            chars_sent = len(diff)
+        else:
+            updated, hunks = apply_search_replace(original, edits)
+            chars_sent = len(json.dumps(edits))
+    except PatchError as e:
+        return f"Error: {file_path} was not changed, the edit does not apply: {e}"
+
+    if updated == original:
+        return f"No changes: the edit leaves {file_path} as it was"
+    try:
+        atomic_write(abs_file_path, updated)
+    except Exception as e:
+        return f"Failed to write to file: {file_path}, {e}"
+    sandbox.invalidate(abs_file_path)
+    python_workers.invalidate(abs_file_path)
+    read_ahead.invalidate(abs_file_path)
+
+    current_span().set(
+        bytes_written=len(updated.encode("utf-8")),
+        chars_sent=chars_sent,
+        chars_full_rewrite=len(updated),
+    )
+    saved = 1 - chars_sent / len(updated) if updated else 0.0
+    return (
+        f"Successfully edited {file_path} ({hunks} hunk{'s' if hunks != 1 else ''}; "
+        f"{chars_sent} characters sent instead of {len(updated)} for a full rewrite, {saved:.0%} saved)"
+    )
+
+
+def apply_search_replace(text, edits):
+    # Every search string has to match exactly once, against the file as it
+    # is after the previous edits, so an ambiguous edit can't land in the
+    # wrong place.
+    if isinstance(edits, dict):
+        edits = [edits]
+    for number, edit in enumerate(edits, 1):
+        if not isinstance(edit, dict) or not isinstance(edit.get("search"), str) or not isinstance(edit.get("replace"), str):
+            raise PatchError(f"edit {number} needs string 'search' and 'replace' fields")
+        search = edit["search"]
+        if not search:
+            raise PatchError(f"edit {number} has an empty search string")
+        count = text.count(search)
+        if count == 0:
+            raise PatchError(f"edit {number}: search text not found")
+        if count > 1:
+            raise PatchError(f"edit {number}: search text matches {count} times; include more surrounding lines")
+        text = text.replace(search, edit["replace"], 1)
+    return text, len(edits)
+
+
+def _count(left, old, new):
+    if left is not None:
+        left[0] = max(left[0] - old, 0)
+        left[1] = max(left[1] - new, 0)
+
+
+def _file_header(lines, i, left):
+    # "--- x" inside a hunk is usually a removed "-- x" line. It only starts
+    # the next file's header when "+++ " and a new hunk follow and the
+    # current hunk has all the lines its header counted.
+    following = lines[i + 1:i + 3]
+    if len(following) < 2 or not following[0].startswith("+++ ") or not following[1].startswith("@@"):
+        return False
+    return left is None or left == [0, 0]
+
+
+def parse_unified_diff(diff):
+    # Returns [(index of the first old line or None, old_lines, new_lines)].
+    # Headers without line numbers ("@@ @@") are located by their content.
+    hunks = []
+    current = None
+    left = None  # old and new lines still due in the current hunk, if its header counts them
+    lines = [line[:-1] if line.endswith("\r") else line for line in diff.split("\n")]
+    if lines[-1] == "":
+        lines.pop()
+    for i, line in enumerate(lines):
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            start = None
+            left = None
+            if match:
+                # "-N,0" means "insert after line N"; otherwise N is 1-based.
+                start = int(match.group(1)) if match.group(2) == "0" else max(int(match.group(1)) - 1, 0)
+                left = [int(match.group(2) or 1), int(match.group(4) or 1)]
+            current = (start, [], [])
+            hunks.append(current)
+        elif current is None or line.startswith(("diff ", "index ")):
+            current = None  # file headers up to the next hunk
+            continue
+        elif line.startswith("--- ") and _file_header(lines, i, left):
+            current = None
+            continue
+        elif line.startswith("\\"):  # "\ No newline at end of file"
+            continue
+        elif line.startswith("-"):
+            current[1].append(line[1:])
+            _count(left, 1, 0)
+        elif line.startswith("+"):
+            current[2].append(line[1:])
+            _count(left, 0, 1)
+        else:
+            # Context; some editors strip the leading space from blank lines.
+            current[1].append(line[1:])
+            current[2].append(line[1:])
+            _count(left, 1, 1)
+    if not hunks:
+        raise PatchError("no @@ hunks found in diff")
+    return hunks
+
+
+def _find_block(lines, block, expected):
+    # Nearest exact match to the line the header points at, so a stale line
+    # number still applies as long as the context is right.
+    if not block:
+        return expected if expected is not None else len(lines)
+    starts = [i for i in range(len(lines) - len(block) + 1) if lines[i:i + len(block)] == block]
+    if not starts:
+        return None
+    if expected is None:
+        if len(starts) > 1:
+            raise PatchError(f"hunk context matches {len(starts)} places and the header has no line numbers")
+        return starts[0]
+    return min(starts, key=lambda i: abs(i - expected))
+
+
+def _split_lines(text):
+    # Lines without their endings, and the endings ("\n", "\r\n" or "" for
+    # a last line without one). Only "\n" ends a line; str.splitlines()
+    # would also split at form feeds, "\x85", "\u2028" and the like.
+    pieces = text.split("\n")
+    last = pieces.pop()
+    lines = [piece[:-1] if piece.endswith("\r") else piece for piece in pieces]
+    endings = ["\r\n" if piece.endswith("\r") else "\n" for piece in pieces]
+    if last:
+        lines.append(last)
+        endings.append("")
+    return lines, endings
+
+
+def _new_endings(old_lines, old_endings, new_lines, default):
+    # Lines the hunk keeps keep their own ending; added lines take the ending
+    # of the old line they come before (or after, at the end of the hunk), so
+    # mixed line endings are left alone.
+    endings = []
+    k = 0
+    for line in new_lines:
+        try:
+            m = old_lines.index(line, k)
+        except ValueError:
+            endings.append(old_endings[min(k, len(old_endings) - 1)] if old_endings else default)
+            continue
+        endings.append(old_endings[m])
+        k = m + 1
+    return endings
+
+
+def apply_unified_diff(text, diff):
+    newline = "\r\n" if "\r\n" in text else "\n"
+    lines, endings = _split_lines(text)
+    trailing_newline = text.endswith("\n")
+
+    result = []
+    result_endings = []
+    position = 0
+    hunks = parse_unified_diff(diff)
+    for number, (expected, old_lines, new_lines) in enumerate(hunks, 1):
+        start = _find_block(lines[position:], old_lines, None if expected is None else max(expected - position, 0))
+        if start is None:
+            raise PatchError(f"hunk {number} does not match the file (context or removed lines differ)")
+        start += position
+        end = start + len(old_lines)
+        result.extend(lines[position:start])
+        result_endings.extend(endings[position:start])
+        result.extend(new_lines)
+        result_endings.extend(_new_endings(old_lines, endings[start:end], new_lines, newline))
+        position = end
+    result.extend(lines[position:])
+    result_endings.extend(endings[position:])
+
+    # Only the last line may lack an ending, and only if the file's did.
+    result_endings = [ending or newline for ending in result_endings]
+    if result and not trailing_newline:
+        result_endings[-1] = ""
+    return "".join(line + ending for line, ending in zip(result, result_endings)), len(hunks)
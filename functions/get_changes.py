@@ -0,0 +1,34 @@
+import change_journal
+from config import GET_CHANGES_MAX_PATHS
+from functions import sandbox
+from tracing import current_span
+
+
+def get_changes(working_directory: str, since_turn: int = None):
+    abs_working_dir = sandbox.resolve(working_directory)[0]
+    if not sandbox.isdir(abs_working_dir):
+        return f"Error: The directory {abs_working_dir} does not exist."
+
+    journal = change_journal.journal_for(abs_working_dir)
+    if journal is None:
+        change_journal.watch(abs_working_dir)
+        return {
+            "turn": sandbox.current_turn(),
+            "note": "Started watching the working directory now; nothing is known about earlier turns. Call again later.",
+        }
+
+    since_turn, changes, incomplete = journal.since(None if since_turn is None else int(since_turn))
+    response = {"turn": sandbox.current_turn(), "since_turn": since_turn}
+    total = 0
+    for kind, paths in changes.items():
+        if paths:
+            response[kind] = paths[:GET_CHANGES_MAX_PATHS]
+            if len(paths) > GET_CHANGES_MAX_PATHS:
+                response[f"more_{kind}"] = len(paths) - GET_CHANGES_MAX_PATHS
+        total += len(paths)
+    if not total:
+        response["note"] = "No files changed."
+    if incomplete:
+        response["incomplete"] = "Changes from before the journal's oldest entry are not known; list or read files to be sure."
+    current_span().set(changes=total, backend=journal.backend)
+    return response
@@ -1,23 +1,43 @@
 import os
-from config import MAX_CHARS
-from google.genai import types
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+import read_ahead
+from config import MAX_CHARS, MMAP_MIN_BYTES, LINE_INDEX_CACHE_SIZE
+from functions import sandbox
+from tracing import current_span
 
-def get_file_content(working_directory: str,file_path: str):
-    abs_working_dir = os.path.abspath(working_directory)
-    abs_file_path = os.path.abspath(os.path.join(working_directory,file_path))
-
-    if not abs_file_path.startswith(abs_working_dir):
+def get_file_content(working_directory: str,file_path: str, offset: int = None, length: int = None,
+                     start_line: int = None, end_line: int = None, tail_lines: int = None):
+    resolved = sandbox.resolve(working_directory, file_path)
+    if resolved is None:
         return f'Error: {file_path} is outside the permitted working directory'
+    abs_working_dir, abs_file_path = resolved
 
-    if not os.path.isfile(abs_file_path):
+    if not sandbox.isfile(abs_file_path):
         return f"Error: The file {abs_file_path} does not exist."
 
+    if offset is not None or length is not None or start_line is not None or end_line is not None or tail_lines is not None:
+        try:
+            return _read_range(abs_file_path, file_path, offset, length, start_line, end_line, tail_lines)
+        except (TypeError, ValueError) as e:
+            return f"Error: Invalid range for {file_path}: {e}"
+        except Exception as e:
+            return f"Error: Unable to read the file {abs_file_path}. Reason: {str(e)}."
+
     file_content = ""
     try:
-        with open(abs_file_path, 'r') as file:
-            file_content = file.read(MAX_CHARS)
-            if len(file_content) >= MAX_CHARS:
-                file_content += (f'[...File "{file_path}" truncated after {MAX_CHARS} characters...]')
+        prefetched = read_ahead.buffer.take(abs_file_path, sandbox.stat(abs_file_path)) if read_ahead.buffer else None
+        if prefetched is not None:
+            file_content = prefetched[:MAX_CHARS]
+            current_span().set(read_ahead_hit=True)
+        else:
+            with open(abs_file_path, 'r') as file:
+                file_content = file.read(MAX_CHARS)
+                current_span().set(bytes_read=len(file_content.encode("utf-8")))
+        if len(file_content) >= MAX_CHARS:
+            file_content += (f'[...File "{file_path}" truncated after {MAX_CHARS} characters...]')
         return file_content
     except Exception as e:
         return f"Error: Unable to read the file {abs_file_path}. Reason: {str(e)}."
@@ -25,3 +45,103 @@ def get_file_content(working_directory: str,file_path: str):
         return f"Error: The file {abs_file_path} is not a readable file or contains unsupported characters."
 
 
+class LineIndex:
+    # Byte offsets of line starts, extended only as far as lookups need.
+    def __init__(self):
+        self.starts = array("q", [0])
+        self.scanned_to = 0
+        self.complete = False
+        self.lock = threading.Lock()
+
+    def ensure(self, data, line_count):
+        # Makes sure the start of line `line_count` + 1 (i.e. the end of
+        # line `line_count`) is known, or the whole file has been scanned.
+        with self.lock:
+            while len(self.starts) <= line_count and not self.complete:
+                newline = data.find(b"\n", self.scanned_to)
+                if newline == -1 or newline + 1 >= len(data):
+                    self.scanned_to = len(data)
+                    self.complete = True
+                else:
+                    self.starts.append(newline + 1)
+                    self.scanned_to = newline + 1
+
+    def line_span(self, data, first, last=None):
+        # 1-based, inclusive line numbers -> byte range. Without `last` the
+        # range runs to the end of the file.
+        self.ensure(data, first if last is None else last)
+        if first > len(self.starts):
+            return None
+        start = self.starts[first - 1]
+        end = self.starts[last] if last is not None and last < len(self.starts) else len(data)
+        return start, end
+
+
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def _line_index(abs_file_path, st):
+    key = (abs_file_path, st.st_mtime_ns, st.st_size)
+    with _line_indexes_lock:
+        index = _line_indexes.get(key)
+        if index is None:
+            index = _line_indexes[key] = LineIndex()
+            while len(_line_indexes) > LINE_INDEX_CACHE_SIZE:
+                _line_indexes.popitem(last=False)
+        _line_indexes.move_to_end(key)
+        return index
+
+
+def _tail_start(data, lines):
+    end = len(data)
+    if end and data[end - 1:end] == b"\n":
+        end -= 1
+    for _ in range(lines):
+        end = data.rfind(b"\n", 0, end)
+        if end == -1:
+            return 0
+    return end + 1
+
+
+def _read_range(abs_file_path, file_path, offset, length, start_line, end_line, tail_lines):
+    with open(abs_file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        if size >= MMAP_MIN_BYTES:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+        try:
+            if tail_lines is not None:
+                start = _tail_start(data, int(tail_lines))
+                end = size
+                header = f"[Last {int(tail_lines)} lines of {file_path}, bytes {start}-{end} of {size}]"
+            elif start_line is not None or end_line is not None:
+                first = int(start_line) if start_line is not None else 1
+                last = int(end_line) if end_line is not None else None
+                if first < 1 or (last is not None and last < first):
+                    raise ValueError("start_line must be >= 1 and end_line >= start_line")
+                index = _line_index(abs_file_path, st)
+                span = index.line_span(data, first, last)
+                if span is None:
+                    return f"Error: {file_path} has fewer than {first} lines."
+                start, end = span
+                total = f"{len(index.starts)}" if index.complete else "?"
+                header = f"[Lines {first}-{last or 'end'} of {total} in {file_path}, bytes {start}-{end} of {size}]"
+            else:
+                start = int(offset or 0)
+                if start < 0 or start > size:
+                    raise ValueError(f"offset must be between 0 and {size}")
+                end = size if length is None else min(size, start + int(length))
+                header = f"[Bytes {start}-{end} of {size} in {file_path}]"
+            chunk = data[start:min(end, start + MAX_CHARS * 4)]
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    text = chunk.decode("utf-8", errors="replace")
+    current_span().set(bytes_read=len(chunk))
+    if len(text) > MAX_CHARS or start + len(chunk) < end:
+        text = text[:MAX_CHARS] + f'[...Range truncated after {MAX_CHARS} characters; continue from a later offset or line...]'
+    return f"{header}\n{text}"
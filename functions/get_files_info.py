@@ -1,28 +1,92 @@
 import os
-from google.genai import types
+from fnmatch import fnmatch
+from config import LIST_PAGE_SIZE, LIST_SKIP_DIRS
+from functions import sandbox
+from tracing import current_span
 
-def get_files_info(working_directory: str, directory: str = "."):
-    abs_working_dir = os.path.abspath(working_directory)
-    abs_dir = os.path.abspath(os.path.join(working_directory, directory))
-
-    if not abs_dir.startswith(abs_working_dir):
+def get_files_info(working_directory: str, directory: str = ".", max_depth: int = 1, include=None,
+                   exclude=None, cursor: str = None, limit: int = LIST_PAGE_SIZE):
+    resolved = sandbox.resolve(working_directory, directory)
+    if resolved is None:
         return f'Error: {directory} is outside the permitted working directory'
+    abs_working_dir, abs_dir = resolved
     
-    if not os.path.isdir(abs_dir):
+    if not sandbox.isdir(abs_dir):
         return f"Error: The directory {abs_dir} does not exist."
-    
-    response = ""
-    contents = os.listdir(abs_dir)
+
+    include = _patterns(include)
+    exclude = _patterns(exclude)
+    cursor_key = tuple(cursor.strip("/").split("/")) if cursor else None
+    limit = max(int(limit or LIST_PAGE_SIZE), 1)
+
+    entries = []
+    last = None
+    next_cursor = None
     try:
-        for content in contents:
-            path = os.path.join(abs_dir, content)
-            is_dir = os.path.isdir(path)
-            size = os.path.getsize(path) if not is_dir else "N/A"
-            response += f"\n- {content}: file_size={size} bytes, is_dir={is_dir}\n"
+        for parts, entry, is_dir in _walk(abs_dir, (), int(max_depth), exclude, cursor_key):
+            rel_path = "/".join(parts)
+            if include and (is_dir or not _matches(rel_path, entry.name, include)):
+                continue
+            if len(entries) >= limit:
+                next_cursor = last
+                break
+            entries.append(f"{rel_path}/" if is_dir else _describe(rel_path, entry))
+            last = rel_path
     except OSError as e:
         return f"Error: Could not access directory {abs_dir}. Reason: {e}"
-            
+
+    current_span().set(entries=len(entries))
+    response = {"directory": directory, "entries": entries}
+    if next_cursor:
+        response["next_cursor"] = next_cursor
     return response
 
-    
-    
\ No newline at end of file
+
+def _patterns(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _matches(rel_path, name, patterns):
+    return any(fnmatch(rel_path, p) or fnmatch(name, p) for p in patterns)
+
+
+def _describe(rel_path, entry):
+    # Symlinks are listed without a size: their target may be dangling or
+    # outside the working directory.
+    try:
+        st = entry.stat(follow_symlinks=False)
+    except OSError:
+        return rel_path  # removed while listing
+    return rel_path if entry.is_symlink() else f"{rel_path} {st.st_size}"
+
+
+def _walk(path, prefix, depth, exclude, cursor):
+    # Depth-first over names in sorted order, which is also the ordering of
+    # the path tuples, so `cursor` can skip whole subtrees already returned.
+    # Only the listed directory itself must be readable; subdirectories that
+    # are not are listed but not descended into.
+    try:
+        with os.scandir(path) as it:
+            items = sorted(it, key=lambda e: e.name)
+    except OSError:
+        if not prefix:
+            raise
+        return
+    for entry in items:
+        parts = prefix + (entry.name,)
+        is_dir = entry.is_dir()
+        if is_dir and entry.name in LIST_SKIP_DIRS:
+            continue
+        if exclude and _matches("/".join(parts), entry.name, exclude):
+            continue
+        if cursor is None or parts > cursor:
+            yield parts, entry, is_dir
+        if (
+            is_dir
+            and depth != 1
+            and not entry.is_symlink()
+            and (cursor is None or parts > cursor or cursor[:len(parts)] == parts)
+        ):
+            yield from _walk(entry.path, parts, depth - 1, exclude, cursor)
@@ -1,18 +1,22 @@
 import os
+import signal
 import sys
-import subprocess
-from google.genai import types
+import python_workers
+import read_ahead
+from config import RUN_CPU_SECONDS, RUN_OUTPUT_HARD_LIMIT
+from functions import sandbox
+from process_capture import run_captured
+from tracing import span
 
 def run_python_file(working_directory: str, file_path: str, args=None):
     if args is None:
         args = []
-    abs_working_dir = os.path.abspath(working_directory)
-    abs_file_path = os.path.abspath(os.path.join(working_directory, file_path))
-
-    if not abs_file_path.startswith(abs_working_dir):
+    resolved = sandbox.resolve(working_directory, file_path)
+    if resolved is None:
         return f'Error: {file_path} is outside the permitted working directory'
+    abs_working_dir, abs_file_path = resolved
 
-    if not os.path.isfile(abs_file_path):
+    if not sandbox.isfile(abs_file_path):
         return f"Error: {file_path} does not exist."
     
     if not file_path.endswith(".py"):
@@ -24,16 +28,28 @@ def run_python_file(working_directory: str, file_path: str, args=None):
         env_vars = os.environ.copy()
         env_vars['PYTHONIOENCODING'] = 'utf-8'
         
-        output = subprocess.run(
-            final_args,
-            cwd=abs_working_dir,
-            timeout=30,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            env=env_vars
-        )
+        with span("subprocess", file=file_path) as subprocess_span:
+            try:
+                if python_workers.worker_pool is not None:
+                    output = python_workers.worker_pool.run(abs_working_dir, abs_file_path, args, timeout=30)
+                else:
+                    output = run_captured(final_args, abs_working_dir, env_vars, timeout=30)
+            finally:
+                # The script may have changed anything under the working directory.
+                sandbox.invalidate_all()
+                read_ahead.invalidate(abs_working_dir)
+            subprocess_span.set(
+                warm=python_workers.worker_pool is not None,
+                returncode=output.returncode,
+                stdout_bytes=output.stdout_buffer.total,
+                stderr_bytes=output.stderr_buffer.total,
+                dropped_bytes=output.dropped_bytes,
+            )
         response = f"Process exited with code {output.returncode}\n"
+        if output.output_limit_hit:
+            response += f"Killed after writing more than {RUN_OUTPUT_HARD_LIMIT} bytes of output\n"
+        elif RUN_CPU_SECONDS and hasattr(signal, "SIGXCPU") and output.returncode == -signal.SIGXCPU:
+            response += f"Killed (CPU time limit is {RUN_CPU_SECONDS}s)\n"
         
         if output.stdout:
             response += f"STDOUT:\n{output.stdout}\n"
@@ -43,6 +59,12 @@ def run_python_file(working_directory: str, file_path: str, args=None):
         
         if not output.stdout and not output.stderr:
             response += "No output produced\n"
+
+        if output.dropped_bytes:
+            response += (
+                f"Output truncated: {output.stdout_buffer.dropped} bytes of stdout and "
+                f"{output.stderr_buffer.dropped} bytes of stderr dropped from the middle\n"
+            )
         
         return response
     
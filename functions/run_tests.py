@@ -0,0 +1,260 @@
+import ast
+import fnmatch
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    LIST_SKIP_DIRS,
+    RUN_TESTS_MAX_FAILURES,
+    RUN_TESTS_PATTERNS,
+    RUN_TESTS_SHARD_SECONDS,
+    RUN_TESTS_TIMEOUT,
+    RUN_TESTS_WORKERS,
+)
+import read_ahead
+from functions import sandbox
+from process_capture import run_captured
+from tracing import current_span
+
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "unittest_runner.py")
+
+
+def run_tests(working_directory: str, paths=None, run_all: bool = False):
+    abs_working_dir = sandbox.resolve(working_directory)[0]
+    if not sandbox.isdir(abs_working_dir):
+        return f"Error: The directory {abs_working_dir} does not exist."
+
+    state = _state(abs_working_dir)
+    with state.lock:
+        snapshot = _snapshot(abs_working_dir)
+        graph = state.graph.update(abs_working_dir, snapshot)
+        test_files = sorted(p for p in snapshot if _is_test_file(p))
+        selected_ids = []
+
+        if paths:
+            paths = [paths] if isinstance(paths, str) else list(paths)
+            selected = []
+            for path in paths:
+                # "tests.py" runs a file; "tests.py::test_add" runs one test in it.
+                file_part, _, test_part = path.partition("::")
+                file_part = os.path.normpath(file_part)
+                if file_part not in snapshot:
+                    return f"Error: {path} is not a file in the working directory"
+                if file_part not in selected:
+                    selected.append(file_part)
+                if test_part:
+                    selected_ids.append(test_part)
+            reason = "requested"
+        elif run_all or state.last_snapshot is None:
+            selected, reason = test_files, "all"
+        else:
+            changed = {p for p in snapshot if snapshot[p] != state.last_snapshot.get(p)}
+            changed |= {p for p in state.last_snapshot if p not in snapshot}
+            # Test files that failed last time are rerun even when nothing
+            # they import changed, so a fix elsewhere is confirmed.
+            selected = [t for t in test_files if t in state.failing or graph.closure(t) & changed]
+            reason = f"{len(changed)} changed file{'s' if len(changed) != 1 else ''} since the last run"
+
+        summary = {"selection": reason, "test_files": selected}
+        if not paths and not run_all:
+            summary["not_affected"] = [t for t in test_files if t not in selected]
+        if not selected:
+            summary["result"] = "nothing to run" if test_files else "no test files found"
+            state.last_snapshot = snapshot
+            return summary
+
+        try:
+            runs = _run_files(abs_working_dir, selected, selected_ids, state.durations)
+        finally:
+            sandbox.invalidate_all()
+            read_ahead.invalidate(abs_working_dir)
+        if not paths:
+            # A targeted run says nothing about the tests it did not run, so
+            # changes since the last full or change-based run stay pending.
+            state.last_snapshot = snapshot
+
+    passed = total = 0
+    failures = []
+    skipped = 0
+    for rel_path, result in runs:
+        passed += result["passed"]
+        total += result["total"]
+        for record in result["records"]:
+            if record["kind"] == "skip":
+                skipped += 1
+            else:
+                if "traceback" in record:
+                    record["traceback"] = record["traceback"].replace(abs_working_dir + os.sep, "")
+                failures.append({"file": rel_path, **record})
+        if result.get("duration_s") is not None:
+            state.durations[rel_path] = result["duration_s"]
+        if any(r["kind"] != "skip" for r in result["records"]):
+            state.failing.add(rel_path)
+        elif not selected_ids:
+            state.failing.discard(rel_path)
+
+    summary.update(passed=passed, failed=len(failures), skipped=skipped, total=total)
+    summary["failures"] = [{k: v for k, v in f.items() if k != "duration_s"} for f in failures[:RUN_TESTS_MAX_FAILURES]]
+    if len(failures) > RUN_TESTS_MAX_FAILURES:
+        summary["more_failures"] = len(failures) - RUN_TESTS_MAX_FAILURES
+    current_span().set(test_files=len(selected), tests=total, failures=len(failures))
+    return summary
+
+
+def _run_files(abs_working_dir, rel_paths, selected_ids, durations):
+    # Files that took a while last time are split into round-robin shards so
+    # the work spreads over RUN_TESTS_WORKERS processes.
+    jobs = []
+    for rel_path in rel_paths:
+        shards = max(1, min(RUN_TESTS_WORKERS, int(durations.get(rel_path, 0) / RUN_TESTS_SHARD_SECONDS)))
+        jobs.extend((rel_path, shard, shards) for shard in range(shards))
+
+    with tempfile.TemporaryDirectory(prefix="agent-tests-") as tmp:
+        def run_job(index):
+            rel_path, shard, shards = jobs[index]
+            results_path = os.path.join(tmp, f"{index}.json")
+            argv = [sys.executable, RUNNER_SCRIPT, os.path.join(abs_working_dir, rel_path), results_path, str(shard), str(shards), *selected_ids]
+            env = os.environ.copy()
+            env["PYTHONIOENCODING"] = "utf-8"
+            output = None
+            try:
+                output = run_captured(argv, abs_working_dir, env, timeout=RUN_TESTS_TIMEOUT)
+                with open(results_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                detail = str(e) if output is None else f"runner exited with code {output.returncode}\n{output.stderr[-2000:]}"
+                return {"passed": 0, "total": 0, "records": [{"test": rel_path, "kind": "error", "traceback": detail}]}
+
+        with ThreadPoolExecutor(max_workers=min(RUN_TESTS_WORKERS, len(jobs))) as executor:
+            results = list(executor.map(run_job, range(len(jobs))))
+
+    merged = {}
+    for (rel_path, _, _), result in zip(jobs, results):
+        into = merged.setdefault(rel_path, {"passed": 0, "total": 0, "records": [], "duration_s": 0.0})
+        into["passed"] += result["passed"]
+        into["total"] += result["total"]
+        into["records"] += result["records"]
+        into["duration_s"] += result.get("duration_s", 0.0)
+    return [(rel_path, merged[rel_path]) for rel_path in rel_paths]
+
+
+def _is_test_file(rel_path):
+    return any(fnmatch.fnmatch(os.path.basename(rel_path), pattern) for pattern in RUN_TESTS_PATTERNS)
+
+
+def _snapshot(abs_working_dir):
+    snapshot = {}
+    for root, dirs, files in os.walk(abs_working_dir):
+        dirs[:] = [d for d in dirs if d not in LIST_SKIP_DIRS]
+        for name in files:
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, abs_working_dir)] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+class ImportGraph:
+    """Which sandbox files each sandbox file imports, parsed with ast.
+
+    Imports are parsed again only for files whose mtime or size changed, but
+    resolved against the current file list every time, so a module created
+    after the file importing it was parsed is still picked up.
+    """
+
+    def __init__(self):
+        self.parsed = {}  # rel_path -> (stamp, [(module, search roots)])
+        self.deps = {}  # rel_path -> set of rel_paths it imports directly
+
+    def update(self, abs_working_dir, snapshot):
+        self.parsed = {p: v for p, v in self.parsed.items() if p in snapshot}
+        for rel_path, stamp in snapshot.items():
+            known = self.parsed.get(rel_path)
+            if known is None or known[0] != stamp:
+                self.parsed[rel_path] = (stamp, _parse_imports(abs_working_dir, rel_path))
+        self.deps = {}
+        for rel_path, (_, imports) in self.parsed.items():
+            deps = set()
+            for module, roots in imports:
+                deps.update(_module_files(module, roots, snapshot))
+            deps.discard(rel_path)
+            self.deps[rel_path] = deps
+        return self
+
+    def closure(self, rel_path):
+        seen = {rel_path}
+        stack = [rel_path]
+        while stack:
+            for dep in self.deps.get(stack.pop(), ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        return seen
+
+
+def _module_files(module, roots, snapshot):
+    # "a.b.c" -> a/__init__.py, a/b/__init__.py, and a/b/c.py or a/b/c/__init__.py.
+    parts = module.split(".")
+    for root in roots:
+        found = []
+        for i in range(1, len(parts) + 1):
+            base = os.path.normpath(os.path.join(root, *parts[:i]))
+            for candidate in (base + ".py", os.path.join(base, "__init__.py")):
+                if candidate in snapshot:
+                    found.append(candidate)
+        if found:
+            return found
+    return []
+
+
+def _parse_imports(abs_working_dir, rel_path):
+    try:
+        with open(os.path.join(abs_working_dir, rel_path), "rb") as f:
+            tree = ast.parse(f.read(), filename=rel_path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+    package_dir = os.path.dirname(rel_path)
+    roots = (package_dir, "") if package_dir else ("",)
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, roots) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package_dir
+                for _ in range(node.level - 1):
+                    base = os.path.dirname(base)
+                search = (base,)
+                prefix = node.module or ""
+            else:
+                search = roots
+                prefix = node.module
+            for alias in node.names:
+                # "from pkg import render" may name a submodule or an attribute.
+                for module in filter(None, (f"{prefix}.{alias.name}" if prefix else alias.name, prefix)):
+                    imports.append((module, search))
+    return imports
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.graph = ImportGraph()
+        self.last_snapshot = None
+        self.durations = {}
+        self.failing = set()
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def _state(abs_working_dir):
+    with _states_lock:
+        return _states.setdefault(abs_working_dir, _State())
@@ -0,0 +1,164 @@
+import contextvars
+import os
+import stat as stat_module
+import threading
+import time
+
+# Path resolution and stat results shared by the tool calls of one model
+# turn. ToolDispatcher starts a Turn per model turn and its worker threads see
+# it through a context variable, so concurrent sessions (batch, daemon) never
+# share or clear each other's caches. Within a turn, write_file/edit_file
+# invalidate the paths they wrote and run_python_file/run_tests clear
+# everything.
+
+stats = {"resolve_hits": 0, "resolve_misses": 0, "stat_hits": 0, "stat_misses": 0}
+
+
+class Timeline:
+    """The model turns of one conversation, numbered from 1.
+
+    Turn numbers are shown to the model (re-reads, get_changes), so each
+    conversation counts its own. starts maps a turn to the time.monotonic_ns()
+    at which it began.
+    """
+
+    def __init__(self):
+        self.turn = 0
+        self.starts = {0: time.monotonic_ns()}
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            self.turn += 1
+            self.starts[self.turn] = time.monotonic_ns()
+            return self.turn
+
+    def started(self, turn):
+        # When a turn began; turns before the first count from the first.
+        with self._lock:
+            turn = max(min(turn, self.turn), 0)
+            return self.starts[turn]
+
+
+class Turn:
+    def __init__(self, number, timeline, cache=True):
+        self.number = number
+        self.timeline = timeline
+        self.cache = cache
+        self.resolved = {}  # (working_directory, path) -> (real working dir, real path)
+        self.stats = {}  # real path -> os.stat_result, or None if it does not exist
+        self.generation = 0  # bumped by invalidation, so a stat taken before it is not cached after it
+        self.lock = threading.Lock()
+
+
+# Outside any turn (tools called directly) nothing is cached.
+default_timeline = Timeline()
+_current = contextvars.ContextVar("sandbox_turn", default=Turn(0, default_timeline, cache=False))
+
+
+def current():
+    return _current.get()
+
+
+def current_turn():
+    return _current.get().number
+
+
+def new_turn(timeline=None):
+    timeline = timeline or default_timeline
+    return Turn(timeline.next(), timeline)
+
+
+def enter(turn):
+    # Makes `turn` current in the calling context (ToolDispatcher runs each
+    # call in a copied context that has entered its turn).
+    _current.set(turn)
+
+
+def begin_turn(timeline=None):
+    turn = new_turn(timeline)
+    enter(turn)
+    return turn.number
+
+
+def is_within(real_root, real_path):
+    # Compares whole path components, so /a/calculator2 is not inside
+    # /a/calculator the way a plain startswith() would have it.
+    return real_path == real_root or real_path.startswith(real_root.rstrip(os.sep) + os.sep)
+
+
+def resolve(working_directory, path="."):
+    """Returns (real working dir, real path), or None if path escapes it.
+
+    Both are realpath()s, so ".." and symlinks pointing outside the working
+    directory are caught; a path that does not exist yet resolves through its
+    existing parents.
+    """
+    turn = _current.get()
+    key = (working_directory, path)
+    cached = turn.resolved.get(key)
+    if cached is not None:
+        stats["resolve_hits"] += 1
+        return cached if cached[1] is not None else None
+    stats["resolve_misses"] += 1
+    generation = turn.generation
+    real_root = os.path.realpath(working_directory)
+    real_path = os.path.realpath(os.path.join(real_root, path))
+    result = (real_root, real_path if is_within(real_root, real_path) else None)
+    with turn.lock:
+        if turn.cache and turn.generation == generation:
+            turn.resolved[key] = result
+    return result if result[1] is not None else None
+
+
+def stat(real_path):
+    turn = _current.get()
+    try:
+        result = turn.stats[real_path]
+        stats["stat_hits"] += 1
+        return result
+    except KeyError:
+        pass
+    stats["stat_misses"] += 1
+    generation = turn.generation
+    try:
+        result = os.stat(real_path)
+    except (OSError, ValueError):
+        result = None
+    with turn.lock:
+        if turn.cache and turn.generation == generation:
+            turn.stats[real_path] = result
+    return result
+
+
+def isfile(real_path):
+    st = stat(real_path)
+    return st is not None and stat_module.S_ISREG(st.st_mode)
+
+
+def isdir(real_path):
+    st = stat(real_path)
+    return st is not None and stat_module.S_ISDIR(st.st_mode)
+
+
+def invalidate(real_path):
+    # The path itself, and its parents, whose mtimes change when an entry is
+    # added or replaced.
+    turn = _current.get()
+    with turn.lock:
+        turn.generation += 1
+        path = real_path
+        while True:
+            turn.stats.pop(path, None)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+
+def invalidate_all():
+    turn = _current.get()
+    with turn.lock:
+        turn.generation += 1
+        turn.resolved.clear()
+        turn.stats.clear()
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from config import LIST_SKIP_DIRS, SEARCH_INDEX_DIR, SEARCH_MAX_FILE_BYTES, SEARCH_MAX_RESULTS
+from functions import sandbox
+from tracing import current_span
+
+INDEX_VERSION = 1
+
+def search_files(working_directory: str, pattern: str, regex: bool = False, case_sensitive: bool = True,
+                 include=None, context_lines: int = 1, max_results: int = SEARCH_MAX_RESULTS):
+    abs_working_dir = sandbox.resolve(working_directory)[0]
+    if not sandbox.isdir(abs_working_dir):
+        return f"Error: The directory {abs_working_dir} does not exist."
+    if not pattern:
+        return "Error: pattern must not be empty"
+
+    try:
+        matcher = re.compile(pattern if regex else re.escape(pattern), 0 if case_sensitive else re.IGNORECASE)
+    except re.error as e:
+        return f"Error: Invalid regular expression {pattern!r}: {e}"
+
+    try:
+        index = get_index(abs_working_dir)
+        candidates = index.candidates(required_literals(pattern, regex))
+    except OSError as e:
+        return f"Error: Could not index {abs_working_dir}. Reason: {e}"
+
+    include = [include] if isinstance(include, str) else list(include or [])
+    if include:
+        from fnmatch import fnmatch
+        candidates = [p for p in candidates if any(fnmatch(p, g) or fnmatch(os.path.basename(p), g) for g in include)]
+
+    matches, files_matched = scan(abs_working_dir, candidates, matcher, int(context_lines), int(max_results))
+    current_span().set(indexed_files=len(index.files), candidate_files=len(candidates), matches=len(matches))
+
+    if not matches:
+        return f"No matches for {pattern!r} ({len(candidates)} of {len(index.files)} indexed files searched)"
+    header = f"{len(matches)} matches in {files_matched} files"
+    if len(matches) >= int(max_results):
+        header += f" (stopped at {max_results}; narrow the pattern or use include)"
+    return header + "\n" + "\n--\n".join(matches)
+
+
+def scan(abs_working_dir, rel_paths, matcher, context_lines=1, max_results=SEARCH_MAX_RESULTS):
+    # Returns grep-style blocks: "path:line: text" for matches and
+    # "path-line- text" for context.
+    results = []
+    files_matched = 0
+    for rel_path in rel_paths:
+        resolved = sandbox.resolve(abs_working_dir, rel_path)
+        if resolved is None:
+            continue  # a symlink pointed out of the working directory since it was indexed
+        try:
+            with open(resolved[1], "r", encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        matched = False
+        for number, line in enumerate(lines, 1):
+            if not matcher.search(line):
+                continue
+            matched = True
+            block = []
+            for ctx in range(max(1, number - context_lines), min(len(lines), number + context_lines) + 1):
+                sep = ":" if ctx == number else "-"
+                block.append(f"{rel_path}{sep}{ctx}{sep} {lines[ctx - 1]}")
+            results.append("\n".join(block))
+            if len(results) >= max_results:
+                return results, files_matched + 1
+        files_matched += matched
+    return results, files_matched
+
+
+def required_literals(pattern, regex):
+    # Substrings every match must contain, used to narrow the candidate
+    # files. Returns [] when nothing can be required (e.g. top-level "a|b").
+    if not regex:
+        return [pattern]
+    try:
+        from re import _parser
+        parsed = _parser.parse(pattern)
+    except Exception:
+        return []
+    literals, run = [], []
+    for op, arg in parsed:
+        if str(op) == "LITERAL":
+            run.append(chr(arg))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+        if str(op) == "BRANCH":
+            return []
+    if run:
+        literals.append("".join(run))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Lower-cased trigram sets per file, refreshed from mtimes and sizes.
+
+    Saved to SEARCH_INDEX_DIR between runs. Each lookup re-walks the tree
+    (stat only) and re-reads just the files that were added or changed.
+    """
+
+    def __init__(self, root, path):
+        self.root = root
+        self.path = path
+        self.files = {}  # rel_path -> (mtime_ns, size, frozenset of trigrams)
+        self.postings = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return
+        if data.get("version") == INDEX_VERSION and data.get("root") == self.root:
+            # Trigram sets are stored as one concatenated string per file;
+            # pickling thousands of small frozensets is an order of magnitude slower.
+            self.files = {p: (mtime, size, frozenset(packed[i:i + 3] for i in range(0, len(packed), 3)))
+                          for p, (mtime, size, packed) in data["files"].items()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            files = {p: (mtime, size, "".join(trigrams)) for p, (mtime, size, trigrams) in self.files.items()}
+            pickle.dump({"version": INDEX_VERSION, "root": self.root, "files": files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        seen = set()
+        changed = 0
+        for rel_path, st in _walk_files(self.root):
+            seen.add(rel_path)
+            known = self.files.get(rel_path)
+            if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+                continue
+            try:
+                with open(os.path.join(self.root, rel_path), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            trigrams = frozenset() if b"\0" in data[:1024] else frozenset(_trigrams(data.decode("utf-8", errors="replace").lower()))
+            self._unpost(rel_path)
+            self.files[rel_path] = (st.st_mtime_ns, st.st_size, trigrams)
+            self._post(rel_path)
+            changed += 1
+        removed = [p for p in self.files if p not in seen]
+        for rel_path in removed:
+            self._unpost(rel_path)
+            del self.files[rel_path]
+        return changed + len(removed)
+
+    def _post(self, rel_path):
+        if self.postings is not None:
+            for trigram in self.files[rel_path][2]:
+                self.postings.setdefault(trigram, set()).add(rel_path)
+
+    def _unpost(self, rel_path):
+        if self.postings is not None and rel_path in self.files:
+            for trigram in self.files[rel_path][2]:
+                self.postings[trigram].discard(rel_path)
+
+    def _build_postings(self):
+        postings = {}
+        for rel_path, (_, _, trigrams) in self.files.items():
+            for trigram in trigrams:
+                postings.setdefault(trigram, set()).add(rel_path)
+        self.postings = postings
+
+    def candidates(self, literals):
+        with self.lock:
+            if self.refresh():
+                self.save()
+            if not literals:
+                return sorted(p for p, (_, _, trigrams) in self.files.items() if trigrams)
+            if self.postings is None:
+                self._build_postings()
+            result = None
+            for literal in literals:
+                for trigram in _trigrams(literal.lower()):
+                    paths = self.postings.get(trigram, ())
+                    result = set(paths) if result is None else result.intersection(paths)
+                    if not result:
+                        return []
+            if result is None:  # only literals shorter than a trigram
+                return sorted(p for p, (_, _, trigrams) in self.files.items() if trigrams)
+            return sorted(result)
+
+
+def _walk_files(root, prefix=""):
+    with os.scandir(os.path.join(root, prefix) if prefix else root) as it:
+        for entry in it:
+            rel_path = f"{prefix}/{entry.name}" if prefix else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in LIST_SKIP_DIRS:
+                    yield from _walk_files(root, rel_path)
+            elif entry.is_file():
+                # Symlinked files are followed only to targets inside the
+                # root, like get_file_content does.
+                if entry.is_symlink() and sandbox.resolve(root, rel_path) is None:
+                    continue
+                st = entry.stat()
+                if st.st_size <= SEARCH_MAX_FILE_BYTES:
+                    yield rel_path, st
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(abs_working_dir, index_dir=None):
+    index_dir = index_dir or SEARCH_INDEX_DIR
+    with _indexes_lock:
+        index = _indexes.get((abs_working_dir, index_dir))
+        if index is None:
+            name = hashlib.sha1(abs_working_dir.encode("utf-8")).hexdigest()[:16]
+            index = TrigramIndex(abs_working_dir, os.path.join(index_dir, f"search-{name}.pickle"))
+            index.load()
+            _indexes[(abs_working_dir, index_dir)] = index
+        return index
@@ -1,86 +1,270 @@
-from google.genai import types
+import functools
 from config import MAX_CHARS
 from functions.get_files_info import get_files_info
 from functions.get_file_content import get_file_content
 from functions.write_file import write_file
+from functions.edit_file import edit_file
 from functions.run_python_file import run_python_file
+from functions.search_files import search_files
+from functions.run_tests import run_tests
+from functions.get_changes import get_changes
 
 function_map = {
         "get_files_info": get_files_info,
         "get_file_content": get_file_content,
         "run_python_file": run_python_file,
         "write_file": write_file,
+        "edit_file": edit_file,
+        "search_files": search_files,
+        "run_tests": run_tests,
+        "get_changes": get_changes,
     }
 
-schemas = {
-    "schema_get_files_info" : types.FunctionDeclaration(
-        name="get_files_info",
-        description="Lists files in the specified directory along with their sizes, constrained to the working directory.",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "directory": types.Schema(
-                    type=types.Type.STRING,
-                    description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
-                ),
-            },
-                required=[]
+# Building the declarations needs google.genai, which is slow to import, so
+# they are only created the first time a model request needs them.
+@functools.cache
+def get_schemas():
+    from google.genai import types
+
+    return {
+        "schema_get_files_info" : types.FunctionDeclaration(
+            name="get_files_info",
+            description=(
+                "Lists files in the specified directory along with their sizes, constrained to the working directory. "
+                "Returns entries as 'path size' for files and 'path/' for directories, relative to the listed directory. "
+                "Can walk subdirectories and filter by glob. If 'next_cursor' is returned, call again with it to get the next page. "
+                "If 'preloaded' is returned, those small files are already being loaded into memory: read all of them you need in one turn."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "directory": types.Schema(
+                        type=types.Type.STRING,
+                        description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
+                    ),
+                    "max_depth": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="How many directory levels to list. 1 (the default) lists only the directory itself; 0 walks the whole tree.",
+                    ),
+                    "include": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(type=types.Type.STRING),
+                        description="Optional glob patterns (e.g. '*.py'); only matching files are listed.",
+                    ),
+                    "exclude": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(type=types.Type.STRING),
+                        description="Optional glob patterns for files or directories to leave out.",
+                    ),
+                    "cursor": types.Schema(
+                        type=types.Type.STRING,
+                        description="The 'next_cursor' value from a previous call, to continue the listing.",
+                    ),
+                },
+                    required=[]
+            ),
+        ),
+
+        "schema_get_file_content" : types.FunctionDeclaration(
+            name="get_file_content",
+            description=(
+                f"Reads and returns the first {MAX_CHARS} characters of the content from a specified file within the working directory. "
+                "Use offset/length, start_line/end_line or tail_lines to read only part of a large file; ranged results start with a header giving the byte (and line) range returned."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "file_path": types.Schema(
+                        type=types.Type.STRING,
+                        description="The path to the file whose content should be read, relative to the working directory.",
+                    ),
+                    "offset": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Optional byte offset to start reading from.",
+                    ),
+                    "length": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Optional number of bytes to read from offset.",
+                    ),
+                    "start_line": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Optional first line to return, starting at 1.",
+                    ),
+                    "end_line": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Optional last line to return (inclusive). Defaults to the end of the file.",
+                    ),
+                    "tail_lines": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Optional number of lines to return from the end of the file.",
+                    ),
+                    "full": types.Schema(
+                        type=types.Type.BOOLEAN,
+                        description=(
+                            "Return the whole file even if you already have a copy. Without it, re-reading a file you "
+                            "read or wrote earlier returns only a diff against that copy, or a note that it is unchanged."
+                        ),
+                    ),
+                },
+                required=["file_path"],
+            ),
+        ),
+
+        "schema_search_files" : types.FunctionDeclaration(
+            name="search_files",
+            description=(
+                "Searches every text file under the working directory for a substring or regular expression and returns "
+                "matching lines as 'path:line: text', with context lines as 'path-line- text'. Much cheaper than reading files one by one to find a symbol."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "pattern": types.Schema(
+                        type=types.Type.STRING,
+                        description="The text to look for, or a Python regular expression if regex is true.",
+                    ),
+                    "regex": types.Schema(
+                        type=types.Type.BOOLEAN,
+                        description="Treat pattern as a regular expression. Defaults to false (plain substring).",
+                    ),
+                    "case_sensitive": types.Schema(
+                        type=types.Type.BOOLEAN,
+                        description="Defaults to true.",
+                    ),
+                    "include": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(type=types.Type.STRING),
+                        description="Optional glob patterns (e.g. '*.py') limiting which files are searched.",
+                    ),
+                    "context_lines": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Lines of context shown around each match. Defaults to 1.",
+                    ),
+                },
+                required=["pattern"],
+            ),
+        ),
+
+        "schema_run_tests" : types.FunctionDeclaration(
+            name="run_tests",
+            description=(
+                "Runs the unittest/pytest-style tests in the working directory and returns a summary with pass/fail counts "
+                "and only the failing tests, with short tracebacks. By default only test files affected by files changed since "
+                "the last run_tests call (plus files that failed last time) are run. Prefer this over run_python_file for tests."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "paths": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(type=types.Type.STRING),
+                        description="Optional test files to run, relative to the working directory; 'tests.py::test_name' runs a single test.",
+                    ),
+                    "run_all": types.Schema(
+                        type=types.Type.BOOLEAN,
+                        description="Run every test file, not only the affected ones. Defaults to false.",
+                    ),
+                },
+            ),
         ),
-    ),
 
-    "schema_get_file_content" : types.FunctionDeclaration(
-        name="get_file_content",
-        description=f"Reads and returns the first {MAX_CHARS} characters of the content from a specified file within the working directory.",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="The path to the file whose content should be read, relative to the working directory.",
-                ),
-            },
-            required=["file_path"],
+        "schema_get_changes" : types.FunctionDeclaration(
+            name="get_changes",
+            description=(
+                "Lists the files created, modified or deleted in the working directory since a given turn, whether by your own tools, "
+                "a script, or the user's editor. Results include the current 'turn'; pass it as since_turn next time. "
+                "Files not listed have not changed, so there is no need to list or read them again."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "since_turn": types.Schema(
+                        type=types.Type.INTEGER,
+                        description="Report changes from this turn on. Defaults to the turn of the previous get_changes call.",
+                    ),
+                },
+            ),
         ),
-    ),
 
-    "schema_run_python_file" : types.FunctionDeclaration(
-        name="run_python_file",
-        description="Executes a Python file within the working directory and returns the output from the interpreter.",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="Path to the Python file to execute, relative to the working directory.",
-                ),
-                "args": types.Schema(
-                    type=types.Type.ARRAY,
-                    items=types.Schema(
+        "schema_run_python_file" : types.FunctionDeclaration(
+            name="run_python_file",
+            description="Executes a Python file within the working directory and returns the output from the interpreter.",
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "file_path": types.Schema(
                         type=types.Type.STRING,
-                        description="Optional arguments to pass to the Python file.",
+                        description="Path to the Python file to execute, relative to the working directory.",
+                    ),
+                    "args": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(
+                            type=types.Type.STRING,
+                            description="Optional arguments to pass to the Python file.",
+                        ),
                     ),
-                ),
-            },
-            required=["file_path"],
+                },
+                required=["file_path"],
+            ),
         ),
-    ),
     
-    "schema_write_file" : types.FunctionDeclaration(
-        name="write_file",
-        description="Writes content to a file within the working directory. Creates the file if it doesn't exist.",
-        parameters=types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "file_path": types.Schema(
-                    type=types.Type.STRING,
-                    description="Path to the file to write, relative to the working directory.",
-                ),
-                "content": types.Schema(
-                    type=types.Type.STRING,
-                    description="Content to write to the file",
-                ),
-            },
-            required=["file_path", "content"],
+        "schema_write_file" : types.FunctionDeclaration(
+            name="write_file",
+            description="Writes content to a file within the working directory. Creates the file if it doesn't exist.",
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "file_path": types.Schema(
+                        type=types.Type.STRING,
+                        description="Path to the file to write, relative to the working directory.",
+                    ),
+                    "content": types.Schema(
+                        type=types.Type.STRING,
+                        description="Content to write to the file",
+                    ),
+                },
+                required=["file_path", "content"],
+            ),
         ),
-    ),
-}
+
+        "schema_edit_file" : types.FunctionDeclaration(
+            name="edit_file",
+            description=(
+                "Changes part of an existing file without resending all of it. Pass either edits, a list of "
+                "search/replace pairs where each search text must occur exactly once, or diff, a unified diff of the file. "
+                "Nothing is written unless every change applies cleanly. Prefer this over write_file for changes to existing files."
+            ),
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "file_path": types.Schema(
+                        type=types.Type.STRING,
+                        description="Path to the file to edit, relative to the working directory.",
+                    ),
+                    "edits": types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(
+                            type=types.Type.OBJECT,
+                            properties={
+                                "search": types.Schema(type=types.Type.STRING, description="Exact text to replace, with enough surrounding lines to be unique."),
+                                "replace": types.Schema(type=types.Type.STRING, description="Text to put in its place."),
+                            },
+                            required=["search", "replace"],
+                        ),
+                        description="Search/replace pairs, applied in order.",
+                    ),
+                    "diff": types.Schema(
+                        type=types.Type.STRING,
+                        description="A unified diff with @@ hunks and a few lines of context.",
+                    ),
+                },
+                required=["file_path"],
+            ),
+        ),
+    }
+
+
+def __getattr__(name):
+    if name == "schemas":
+        return get_schemas()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,24 +1,89 @@
+import functools
 import os
-from google.genai import types
+import tempfile
+from config import FSYNC_WRITES
+from functions import sandbox
+import python_workers
+import read_ahead
+from tracing import current_span
+
+
+@functools.cache
+def _umask():
+    # mkstemp creates files as 0600; new files should get the usual
+    # 0666 & ~umask. os.umask() can only read it by setting it, which would
+    # race other threads creating files, so it is read from /proc, or from
+    # the mode of a probe file where there is no /proc.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    probe_dir = tempfile.mkdtemp()
+    try:
+        probe = os.path.join(probe_dir, "probe")
+        os.close(os.open(probe, os.O_CREAT | os.O_WRONLY, 0o666))
+        return ~os.stat(probe).st_mode & 0o666
+    finally:
+        try:
+            os.unlink(probe)
+        except OSError:
+            pass
+        os.rmdir(probe_dir)
+
+
+def atomic_write(abs_file_path, content, fsync=FSYNC_WRITES):
+    # Writes to a temp file in the same directory and renames it over the
+    # target, so a crash part-way through never leaves a truncated file.
+    parent_dir = os.path.dirname(abs_file_path)
+    try:
+        mode = os.stat(abs_file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask()
+    fd, tmp_path = tempfile.mkstemp(dir=parent_dir, prefix=f".{os.path.basename(abs_file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, abs_file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(parent_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
-def write_file(working_directory: str, file_path: str, content: str):
-    abs_working_dir = os.path.abspath(working_directory)
-    abs_file_path = os.path.abspath(os.path.join(working_directory, file_path))
 
-    if not abs_file_path.startswith(abs_working_dir):
+def write_file(working_directory: str, file_path: str, content: str):
+    resolved = sandbox.resolve(working_directory, file_path)
+    if resolved is None:
         return f'Error: {file_path} is outside the permitted working directory'
+    abs_working_dir, abs_file_path = resolved
 
     parent_dir = os.path.dirname(abs_file_path)
-    if not os.path.isdir(parent_dir):
+    if not sandbox.isdir(parent_dir):
         try:
             os.makedirs(parent_dir)
         except Exception as e:
             return f"Could not create parent dirs: {parent_dir} = {e}"
         
     try:
-        with open(abs_file_path,"w") as f:
-            f.write(content)
+        atomic_write(abs_file_path, content)
+        sandbox.invalidate(abs_file_path)
+        python_workers.invalidate(abs_file_path)
+        read_ahead.invalidate(abs_file_path)
+        current_span().set(bytes_written=len(content.encode("utf-8")), chars_sent=len(content))
         return f"Successfully wrote to {file_path} ({len(content)} characters...)"        
     except Exception as e:
         return f"Failed to write to file: {file_path}, {e}"
-        
\ No newline at end of file
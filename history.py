@@ -0,0 +1,214 @@
+import json
+import os
+from config import CHARS_PER_TOKEN, HISTORY_TOKEN_BUDGET, HISTORY_KEEP_RECENT
+from functions.sandbox import Timeline
+from read_tracker import RANGE_ARGS, ReadTracker, is_relative_read
+
+ELIDED_KEEP_CHARS = 300  # Characters kept from each end of an elided tool response.
+
+
+def _part_chars(part, elidable=False):
+    # With elidable, the least a tool response can shrink to.
+    if part.text:
+        return len(part.text)
+    if part.function_call:
+        return len(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        chars = len(json.dumps(part.function_response.response or {}, default=str))
+        return min(chars, 2 * ELIDED_KEEP_CHARS) if elidable else chars
+    return 0
+
+
+def estimate_tokens(messages):
+    return sum(_part_chars(part) for content in messages for part in content.parts or []) // CHARS_PER_TOKEN
+
+
+def _is_prompt(content):
+    return content.role == "user" and not any(part.function_response for part in content.parts or [])
+
+
+def _tool_exchanges(messages):
+    # Pairs every function response with the call that produced it. Responses
+    # follow their model message and come back in call order.
+    calls = []
+    for index, content in enumerate(messages):
+        parts = content.parts or []
+        if any(part.function_call for part in parts):
+            calls = [part.function_call for part in parts if part.function_call]
+            continue
+        responses = [i for i, part in enumerate(parts) if part.function_response]
+        for call, part_index in zip(calls, responses):
+            yield index, part_index, call
+        if responses:
+            calls = []
+
+
+def _path_arg(call):
+    path = (call.args or {}).get("file_path")
+    return os.path.normpath(path) if isinstance(path, str) else None
+
+
+def _read_key(call):
+    args = dict(call.args or {})
+    args.pop("file_path", None)
+    return _path_arg(call), json.dumps(args, sort_keys=True, default=str)
+
+
+def _payload(response):
+    value = response.get("result", response.get("error", ""))
+    return value if isinstance(value, str) else json.dumps(value, default=str)
+
+
+# Tools that may change any file, whatever their arguments.
+RUN_FUNCTIONS = ("run_python_file", "run_tests")
+
+
+def _referenced_reads(messages, exchanges):
+    # A diff or "unchanged" re-read only makes sense next to the full read
+    # (and earlier diffs) it was made against, back to the last full read,
+    # write or edit of that path, or run of anything (ReadTracker forgets
+    # its copies then too). Re-reads whose copy went with the skipped older
+    # messages are returned as dangling.
+    chains = {}
+    kept = set()
+    dangling = set()
+    for index, part_index, call in exchanges:
+        if call.name in RUN_FUNCTIONS:
+            chains = {}
+            continue
+        path = _path_arg(call)
+        if path is None:
+            continue
+        if call.name in ("write_file", "edit_file"):
+            chains[path] = []
+        elif call.name == "get_file_content" and not any((call.args or {}).get(k) is not None for k in RANGE_ARGS):
+            payload = _payload(messages[index].parts[part_index].function_response.response or {})
+            if not is_relative_read(payload):
+                chains[path] = [(index, part_index)]
+            elif path in chains:
+                kept.update(chains[path])
+                chains[path].append((index, part_index))
+            else:
+                dangling.add((index, part_index))
+    return kept, dangling
+
+
+class HistoryManager:
+    """Builds the contents sent to the model from the full message history.
+
+    The full history is left untouched; only the copy sent to the model is
+    compacted. Older tool responses are replaced when the same file is read
+    again or rewritten later, then elided oldest first until the estimated
+    size fits the token budget. The last `keep_recent` messages are never
+    changed, and neither are reads that a later diff or "unchanged" re-read
+    (see ReadTracker, which lives here because it is per conversation too,
+    like the sandbox.Timeline numbering its turns) refers back to.
+
+    Turns that could not fit even with all their tool responses elided are
+    skipped whole, from the oldest, and never decoded: the history is read
+    back from its end, so a resumed SessionMessages only decodes the turns
+    that are sent. `skipped` counts them; once skipped they stay skipped,
+    and re-reads that referred to a copy in them are replaced.
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, keep_recent=HISTORY_KEEP_RECENT):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.tokens_saved = 0
+        self.skipped = 0
+        self.reads = ReadTracker()
+        self.timeline = Timeline()
+
+    def _first_sent(self, messages):
+        # The prompt starting the oldest turn that, with every tool response
+        # before the last `keep_recent` messages cut to its elided size, still
+        # fits the budget along with the turns after it.
+        floor = self.skipped if self.skipped < len(messages) else 0
+        protected_from = max(len(messages) - self.keep_recent, 0)
+        chars = 0
+        start = None
+        for index in range(len(messages) - 1, floor - 1, -1):
+            content = messages[index]
+            chars += sum(_part_chars(part, index < protected_from) for part in content.parts or [])
+            if start is not None and index < protected_from and chars // CHARS_PER_TOKEN > self.token_budget:
+                return start
+            if index <= protected_from and _is_prompt(content):
+                start = index
+        return floor
+
+    def compact(self, messages):
+        start = self._first_sent(messages)
+        if start > self.skipped:
+            self.reads.clear()  # the copies it would diff against may be in the skipped turns
+        self.skipped = start
+        original = messages[start:]
+        compacted = list(original)
+        protected_from = max(len(compacted) - self.keep_recent, 0)
+        exchanges = list(_tool_exchanges(compacted))
+
+        kept, dangling = _referenced_reads(compacted, exchanges)
+        replacements = {}
+        latest_read = {}
+        latest_change = {}
+        latest_run = (-1, None)
+        for position, (index, part_index, call) in enumerate(exchanges):
+            if call.name in RUN_FUNCTIONS:
+                latest_run = (position, call.name)
+                continue
+            path = _path_arg(call)
+            if path is None:
+                continue
+            if call.name == "get_file_content":
+                latest_read[_read_key(call)] = position
+            elif call.name in ("write_file", "edit_file"):
+                latest_change[path] = position
+        for position, (index, part_index, call) in enumerate(exchanges):
+            if index >= protected_from or call.name != "get_file_content" or (index, part_index) in kept:
+                continue
+            path = _path_arg(call)
+            if latest_read.get(_read_key(call), position) > position:
+                replacements[(index, part_index)] = f"[Earlier read of {path} omitted; it was read again later.]"
+            elif latest_change.get(path, -1) > position:
+                replacements[(index, part_index)] = f"[Earlier read of {path} omitted; the file was changed later.]"
+            elif latest_run[0] > position:
+                replacements[(index, part_index)] = f"[Earlier read of {path} omitted; a later {latest_run[1]} may have changed the file.]"
+        for index, part_index, call in exchanges:
+            if (index, part_index) in dangling:
+                replacements[(index, part_index)] = f"[Read of {_path_arg(call)} omitted; the copy it referred to was in skipped older messages.]"
+
+        for (index, part_index), text in replacements.items():
+            compacted[index] = self._replace_response(compacted[index], part_index, text)
+
+        over_budget = estimate_tokens(compacted) - self.token_budget
+        for index, part_index, call in exchanges:
+            if over_budget <= 0 or index >= protected_from or (index, part_index) in replacements or (index, part_index) in kept:
+                continue
+            response = compacted[index].parts[part_index].function_response.response or {}
+            payload = _payload(response)
+            if len(payload) <= 2 * ELIDED_KEEP_CHARS:
+                continue
+            elided = len(payload) - 2 * ELIDED_KEEP_CHARS
+            text = (
+                payload[:ELIDED_KEEP_CHARS]
+                + f"\n[... {elided} characters of this older {call.name} result elided ...]\n"
+                + payload[-ELIDED_KEEP_CHARS:]
+            )
+            compacted[index] = self._replace_response(compacted[index], part_index, text)
+            over_budget -= elided // CHARS_PER_TOKEN
+
+        if start:
+            from google.genai import types
+
+            notice = types.Part(text=f"[{start} older messages were skipped to fit the history budget.]")
+            compacted[0] = compacted[0].model_copy(update={"parts": [notice, *compacted[0].parts]})
+        self.tokens_saved = estimate_tokens(original) - estimate_tokens(compacted)
+        return compacted
+
+    @staticmethod
+    def _replace_response(content, part_index, text):
+        parts = list(content.parts)
+        part = parts[part_index]
+        key = "error" if "error" in (part.function_response.response or {}) else "result"
+        function_response = part.function_response.model_copy(update={"response": {key: text}})
+        parts[part_index] = part.model_copy(update={"function_response": function_response})
+        return content.model_copy(update={"parts": parts})
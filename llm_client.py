@@ -0,0 +1,308 @@
+# Model clients used by the agent loop.
+#
+# The loop only needs `client.models.generate_content(model=, contents=, config=)`
+# and, for --stream, `client.aio.models.generate_content_stream(...)`. Anything
+# exposing those can stand in for `genai.Client`, which is how the replay
+# client below lets the loop run without a network connection.
+import asyncio
+import json
+import os
+import threading
+import time
+from google.genai import types
+from history import CHARS_PER_TOKEN, estimate_tokens
+
+
+def load_transcript(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [
+            types.GenerateContentResponse.model_validate(json.loads(line))
+            for line in f
+            if line.strip()
+        ]
+
+
+def dump_response(response):
+    return json.dumps(response.model_dump(mode="json", exclude_none=True))
+
+
+def merge_chunks(chunks):
+    # A streamed answer as one response, the way generate_content returns it.
+    parts = []
+    for chunk in chunks:
+        if chunk.candidates and chunk.candidates[0].content:
+            parts.extend(chunk.candidates[0].content.parts or [])
+    last = chunks[-1]
+    candidate = last.candidates[0] if last.candidates else types.Candidate()
+    candidate = candidate.model_copy(update={"content": types.Content(role="model", parts=parts)})
+    usage = next((chunk.usage_metadata for chunk in reversed(chunks) if chunk.usage_metadata), None)
+    return last.model_copy(update={"candidates": [candidate], "usage_metadata": usage})
+
+
+def _config_tokens(system_instruction, tools):
+    chars = len(system_instruction or "")
+    for tool in tools or []:
+        chars += len(json.dumps(tool.model_dump(mode="json", exclude_none=True)))
+    return chars // CHARS_PER_TOKEN
+
+
+class ReplayClient:
+    """Answers model calls with recorded responses, in order.
+
+    `latency` adds a fixed sleep per call to approximate a real round trip;
+    a dict of model name to seconds gives each model its own.
+    Every request is kept in `requests` for inspection.
+
+    With `by_turn`, the response is picked by the number of model turns
+    already in the request, so concurrent conversations each replay the
+    transcript from the start instead of sharing one cursor.
+
+    With `estimate_usage`, recorded usage is replaced by a local estimate of
+    what was actually sent, including the part served from a context cache.
+    `caches.create` refuses prefixes smaller than `cache_min_tokens`, as the
+    live API does, so the fallback path can be exercised too.
+    """
+
+    def __init__(self, responses, latency=0.0, estimate_usage=False, cache_min_tokens=0, by_turn=False):
+        self.responses = list(responses)
+        self.latency = latency
+        self.by_turn = by_turn
+        self.estimate_usage = estimate_usage
+        self.requests = []
+        self._position = 0
+        self._lock = threading.Lock()
+        self.models = _ReplayModels(self)
+        self.aio = _ReplayAio(self)
+        self.caches = _ReplayCaches(cache_min_tokens)
+
+    @classmethod
+    def from_file(cls, path, latency=0.0, **kwargs):
+        return cls(load_transcript(path), latency, **kwargs)
+
+    def delay(self, model):
+        if isinstance(self.latency, dict):
+            return self.latency.get(model, 0.0)
+        return self.latency
+
+    def next_response(self, model, contents, config):
+        with self._lock:
+            position = self._position
+            if self.by_turn:
+                position = sum(1 for content in contents if content.role == "model")
+            if position >= len(self.responses):
+                raise RuntimeError(f"Replay transcript exhausted after {position} responses")
+            response = self.responses[position]
+            self._position += 1
+            self.requests.append({"model": model, "contents": list(contents), "config": config})
+        if self.estimate_usage:
+            response = self._with_estimated_usage(response, contents, config)
+        return response
+
+    def _with_estimated_usage(self, response, contents, config):
+        cached_tokens = 0
+        prompt_tokens = estimate_tokens(contents)
+        if config is not None and config.cached_content:
+            cached_tokens = self.caches.get(config.cached_content)
+            prompt_tokens += cached_tokens
+        elif config is not None:
+            prompt_tokens += _config_tokens(config.system_instruction, config.tools)
+        usage = (response.usage_metadata or types.GenerateContentResponseUsageMetadata()).model_copy(
+            update={"prompt_token_count": prompt_tokens, "cached_content_token_count": cached_tokens or None}
+        )
+        return response.model_copy(update={"usage_metadata": usage})
+
+
+class _ReplayCaches:
+    def __init__(self, min_tokens):
+        self.min_tokens = min_tokens
+        self._tokens = {}
+
+    def create(self, *, model, config=None):
+        tokens = _config_tokens(config.system_instruction, config.tools) if config else 0
+        if tokens < self.min_tokens:
+            raise ValueError(f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.min_tokens}")
+        name = f"cachedContents/replay-{len(self._tokens) + 1}"
+        self._tokens[name] = tokens
+        return types.CachedContent(
+            name=name,
+            model=model,
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=tokens),
+        )
+
+    def get(self, name):
+        if name not in self._tokens:
+            raise ValueError(f"CachedContent not found: {name}")
+        return self._tokens[name]
+
+    def delete(self, *, name, config=None):
+        self._tokens.pop(name, None)
+
+
+class _ReplayModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, *, model, contents, config=None):
+        if self._client.delay(model):
+            time.sleep(self._client.delay(model))
+        return self._client.next_response(model, contents, config)
+
+
+class _ReplayAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, *, model, contents, config=None):
+        if self._client.delay(model):
+            await asyncio.sleep(self._client.delay(model))
+        return self._client.next_response(model, contents, config)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        response = self._client.next_response(model, contents, config)
+        return self._stream(response, self._client.delay(model))
+
+    async def _stream(self, response, delay):
+        # One chunk per part, with usage on the last, like the live API.
+        parts = response.candidates[0].content.parts if response.candidates else []
+        if delay:
+            await asyncio.sleep(delay)
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+                usage_metadata=response.usage_metadata if last else None,
+            )
+
+
+class _ReplayAio:
+    def __init__(self, client):
+        self.models = _ReplayAsyncModels(client)
+
+
+class RecordingClient:
+    """Wraps a live client and appends every response to a transcript file.
+
+    A streamed response is written once the stream ends, as a single response.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.models = _RecordingModels(client, path)
+        self.aio = _RecordingAio(client, self.models)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _RecordingModels:
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+        self._lock = threading.Lock()
+
+    def generate_content(self, **kwargs):
+        response = self._client.models.generate_content(**kwargs)
+        self.write(response)
+        return response
+
+    def write(self, response):
+        with self._lock, open(self._path, "a", encoding="utf-8") as f:
+            f.write(dump_response(response) + "\n")
+
+    def __getattr__(self, name):
+        return getattr(self._client.models, name)
+
+
+class _RecordingAsyncModels:
+    def __init__(self, client, recorder):
+        self._client = client
+        self._recorder = recorder
+
+    async def generate_content_stream(self, **kwargs):
+        stream = await self._client.aio.models.generate_content_stream(**kwargs)
+        return self._record(stream)
+
+    async def _record(self, stream):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        if chunks:
+            self._recorder.write(merge_chunks(chunks))
+
+    def __getattr__(self, name):
+        return getattr(self._client.aio.models, name)
+
+
+class _RecordingAio:
+    def __init__(self, client, recorder):
+        self._client = client
+        self.models = _RecordingAsyncModels(client, recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._client.aio, name)
+
+
+class RateLimiter:
+    """Token bucket shared by every thread that makes model calls."""
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.interval = 60.0 / requests_per_minute
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.interval
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """Wraps a client so every generate_content call takes a limiter token first."""
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self.limiter = limiter
+        self.models = _RateLimitedModels(client.models, limiter)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _RateLimitedModels:
+    def __init__(self, models, limiter):
+        self._models = models
+        self._limiter = limiter
+
+    def generate_content(self, **kwargs):
+        self._limiter.acquire()
+        return self._models.generate_content(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+def create_client(replay=None, record=None, **replay_options):
+    if replay:
+        return ReplayClient.from_file(replay, **replay_options)
+
+    from google import genai
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("Error: LLM_PI_KEY not found in environment variables.")
+        return None
+    client = genai.Client(api_key=api_key)
+    if record:
+        client = RecordingClient(client, record)
+    return client
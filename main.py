@@ -1,26 +1,55 @@
 # main.py
-import os
 import sys
-from config import MAX_ITERS
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
+from config import MAX_ITERS, WORKING_DIR, BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE
 from agent_instructions import SYSTEM_PROMPT
-from func_calling import call_function, available_functions
+from func_calling import call_functions
+from history import HistoryManager
+from tool_budget import session_stats
+from tool_cache import tool_cache
+from tracing import span, tracer, profiled
+from request_config import RequestConfig, as_request_config, is_cache_error
 
-def generate_content(client, messages, verbose, system_prompt):
-        response = client.models.generate_content(
-            model = "gemini-2.5-flash",
-            contents=messages,
-            config = types.GenerateContentConfig(
-                tools=[available_functions],
-                system_instruction=system_prompt,
-            ),
-        )
+# google.genai, dotenv and the streaming loop are imported where they are
+# first needed, so `python main.py` without a prompt returns immediately.
+
+def generate_content(client, messages, verbose, request, history=None, working_directory=WORKING_DIR):
+        request = as_request_config(client, request)
+        contents = history.compact(messages) if history else messages
+        if verbose and history:
+            print("History tokens saved:", history.tokens_saved)
+        with span("model_call", model=request.model, messages=len(contents), cached_prefix=bool(request.cache_name)) as model_span:
+            try:
+                response = client.models.generate_content(
+                    model=request.model,
+                    contents=contents,
+                    config=request.config,
+                )
+            except Exception as e:
+                if not request.cache_name or not is_cache_error(e):
+                    raise
+                # The cached prefix expired or is gone; resend it inline from now on.
+                request.drop_cache()
+                model_span.set(cache_fallback=True)
+                response = client.models.generate_content(
+                    model=request.model,
+                    contents=contents,
+                    config=request.config,
+                )
+            if history:
+                model_span.set(history_tokens_saved=history.tokens_saved)
+            if response is not None and response.usage_metadata is not None:
+                model_span.set(
+                    prompt_tokens=response.usage_metadata.prompt_token_count,
+                    response_tokens=response.usage_metadata.candidates_token_count,
+                    cached_tokens=response.usage_metadata.cached_content_token_count,
+                    function_calls=len(response.function_calls or []),
+                )
 
         if verbose :
             print("Prompt tokens:", response.usage_metadata.prompt_token_count)
             print("Response tokens:", response.usage_metadata.candidates_token_count)
+            if response.usage_metadata.cached_content_token_count:
+                print("Cached prompt tokens:", response.usage_metadata.cached_content_token_count)
 
         if response is None or response.usage_metadata is None : 
             print("No llm response...")
@@ -37,8 +66,10 @@ def generate_content(client, messages, verbose, system_prompt):
             return response
     
         function_responses = []
-        for function_call_part in response.function_calls:
-            function_call_result = call_function(function_call_part, verbose)
+        for function_call_result in call_functions(
+            response.function_calls, verbose, working_directory=working_directory,
+            reads=history.reads if history else None, timeline=history.timeline if history else None,
+        ):
             if (
                 not function_call_result.parts
                 or not function_call_result.parts[0].function_response
@@ -51,62 +82,161 @@ def generate_content(client, messages, verbose, system_prompt):
         if not function_responses:
             raise Exception("no function responses generated, exiting.")
 
+        from google.genai import types
+
         messages.append(types.Content(parts=function_responses))
         return response
     
+def run_agent(client, messages, verbose, request, history=None):
+    with span("turn") as turn_span:
+        for iteration in range(MAX_ITERS):
+            turn_span.set(iterations=iteration + 1)
+            try:
+                response = generate_content(client, messages, verbose, request, history)
+            except Exception as e:
+                print(f"Error in generate_content: {e}")
+                return None
+            if response and not response.function_calls:
+                return "".join(part.text or "" for part in response.candidates[0].content.parts)
+        print("Agent: I couldn't resolve the request within the maximum number of allowed steps.")
+        return None
+
+def run_session(client, user_prompt, verbose, request, session=None):
+    from google.genai import types
+
+    messages = session.messages if session else []
+    history = HistoryManager()
+    print("AI Agent activated. Type 'exit' to end the session.")
+    first_prompt = True
+    while True:
+        user_prompt = user_prompt if first_prompt else input("--> You... : ")
+        first_prompt = False
+        if verbose:
+            print(f"\nUser prompt: {user_prompt}\n")
+        if user_prompt.lower() == 'exit' :
+            break
+        notice = session.take_notice() if session else []
+        messages.append(types.Content(role="user", parts=[*notice, types.Part(text=user_prompt)]))
+        final_response = run_agent(client, messages, verbose, request, history)
+        if final_response is not None:
+            print(f"\n--> Agent... : {final_response}")
+            print("----------------------------------------------\n")
+            break
+    if verbose:
+        print("Tool cache:", tool_cache.stats())
+        print("Tool output budget:", session_stats)
+        print("Re-reads:", history.reads.stats)
+
+def _flag_value(name):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+    return None
+
 def main():
-    load_dotenv()
-    
     verbose = "--verbose" in sys.argv
+    stream = "--stream" in sys.argv
     args = []
     for arg in sys.argv[1:]:
         if not arg.startswith("--"):
             args.append(arg)
             
-    if not args:
+    batch = _flag_value("batch")
+    serve = "--serve" in sys.argv
+    if not args and not batch and not serve:
         print("AI Code Assistant")
-        print('\nUsage: python main.py "your prompt here" [--verbose]')
+        print('\nUsage: python main.py "your prompt here" [--verbose] [--stream] [--record=FILE | --replay=FILE] [--trace=FILE] [--profile=FILE] [--context-cache] [--hedge] [--route] [--warm-python] [--read-ahead] [--session=NAME]')
+        print('       python main.py --batch=prompts.jsonl [--out=results.jsonl] [--concurrency=N] [--keep-workdirs]')
+        print('       python main.py --serve [--socket=PATH], then python agent_client.py "your prompt here"')
         print('Example: python main.py "How do I fix the calculator?"')
         sys.exit(1)
                 
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: LLM_PI_KEY not found in environment variables.")
+    if stream and (batch or serve or "--hedge" in sys.argv or "--route" in sys.argv):
+        # Streamed calls are retried and recorded, but not hedged or routed,
+        # and batch and daemon sessions do not stream.
+        print("Error: --stream cannot be combined with --batch, --serve, --hedge or --route")
+        sys.exit(1)
+
+    from dotenv import load_dotenv
+    from llm_client import create_client
+
+    load_dotenv()
+    client = create_client(replay=_flag_value("replay"), record=_flag_value("record"), by_turn=bool(batch) or serve)
+    if client is None:
         sys.exit(1)
-    client = genai.Client(api_key=api_key)
+    concurrency = int(_flag_value("concurrency") or BATCH_CONCURRENCY)
+    if batch:
+        from llm_client import RateLimiter, RateLimitedClient
+        # Limit below the retry layer so retries and hedges are counted too.
+        client = RateLimitedClient(client, RateLimiter(BATCH_REQUESTS_PER_MINUTE, burst=concurrency))
+    from resilience import ResilientClient
+    client = ResilientClient(client, hedge="--hedge" in sys.argv)
+    if "--route" in sys.argv:
+        from model_router import ModelRouter
+        # Above the retry layer, so a tier is only given up on once its retries are spent.
+        client = ModelRouter(client)
     system_prompt = SYSTEM_PROMPT.strip()
     user_prompt = " ".join(args)
-    
-        
-    messages = []
-    print("AI Agent activated. Type 'exit' to end the session.")
-    first_prompt = True
-    end = False
-    while True:
-        user_prompt = user_prompt if first_prompt else input("--> You... : ")
-        first_prompt = False
-        if verbose:
-            print(f"\nUser prompt: {user_prompt}\n")
-        if user_prompt.lower() == 'exit' :
-            break
-        messages.append(types.Content(role="user", parts=[types.Part(text=user_prompt)]))
-        for _ in range(MAX_ITERS):
-            try:
-                response = generate_content(client, messages, verbose, system_prompt)
-                
-                if response and not response.function_calls:
-                    final_response = "".join(part.text for part in response.candidates[0].content.parts)
-                    print(f"\n--> Agent... : {final_response}")
-                    print("----------------------------------------------\n")
-                    end = True
-                    break
-                
-            except Exception as e:
-                print(f"Error in generate_content: {e}")
-                break
-        else:
-            print("Agent: I couldn't resolve the request within the maximum number of allowed steps.")
-        if end: break    
+
+    if _flag_value("trace"):
+        tracer.open(_flag_value("trace"))
+    if not batch and not serve:
+        import change_journal
+        change_journal.watch(WORKING_DIR)
+    if "--read-ahead" in sys.argv:
+        import read_ahead
+        read_ahead.enable()
+    if "--warm-python" in sys.argv:
+        import python_workers
+        python_workers.enable()
+    request = RequestConfig(client, system_prompt, use_cache="--context-cache" in sys.argv, verbose=verbose)
+    session = None
+    if _flag_value("session") and not batch and not serve:
+        from session import Session
+        session = Session.open(_flag_value("session"))
+        if session.resumed:
+            print(f"Resuming session {_flag_value('session')}: {len(session.messages)} messages, "
+                  f"{len(session.changed_files)} changed and {len(session.removed_files)} removed files since it was saved.")
+    try:
+        with profiled(_flag_value("profile")):
+            if serve:
+                from agent_daemon import AgentDaemon
+                from config import DAEMON_SOCKET
+                daemon = AgentDaemon(client, request, _flag_value("socket") or DAEMON_SOCKET, verbose=verbose)
+                print(f"Agent daemon listening on {daemon.socket_path}")
+                try:
+                    daemon.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+            elif batch:
+                from batch import run_batch
+                run_batch(
+                    client, request, batch,
+                    _flag_value("out") or "batch_results.jsonl",
+                    concurrency=concurrency,
+                    requests_per_minute=None,
+                    keep_workdirs="--keep-workdirs" in sys.argv,
+                    verbose=verbose,
+                )
+            elif stream:
+                import asyncio
+                from async_agent import main_async
+                asyncio.run(main_async(client, user_prompt, verbose, request, session))
+            else:
+                run_session(client, user_prompt, verbose, request, session)
+    finally:
+        if session is not None:
+            session.close()
+        request.close()
+        tracer.close()
+    if verbose:
+        print("Model calls:", client.stats())
+        import python_workers
+        if python_workers.worker_pool is not None:
+            print("Python workers:", python_workers.worker_pool.stats())
+        import read_ahead
+        if read_ahead.buffer is not None:
+            print("Read-ahead:", read_ahead.buffer.stats())
     
 if __name__ == "__main__":
     main()
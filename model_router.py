@@ -0,0 +1,176 @@
+# Picks the model for each call from a list of tiers, cheapest first, and
+# moves a call up a tier when the cheaper model's answer is unusable.
+import threading
+import time
+from collections import deque
+from config import MODEL_TIERS, ROUTE_CHEAP_TOOLS, ROUTE_DEFAULT_TIER, ROUTE_LARGE_PROMPT_TOKENS
+from history import estimate_tokens
+from tracing import current_span, percentiles, span
+
+
+def _failed(response):
+    if not isinstance(response, dict) or "error" in response:
+        return True
+    result = response.get("result")
+    return isinstance(result, str) and result.startswith("Error")
+
+
+def choose_tier(contents, tier_count, default_tier=ROUTE_DEFAULT_TIER,
+                cheap_tools=ROUTE_CHEAP_TOOLS, large_prompt_tokens=ROUTE_LARGE_PROMPT_TOKENS):
+    # The cheapest tier only gets the follow-up to a turn that was nothing but
+    # successful calls of cheap tools (listing, reading, searching, writing),
+    # in a prompt that is not long. New prompts, failed calls, script and
+    # test output go to the default tier.
+    default_tier = min(default_tier, tier_count - 1)
+    if len(contents) < 2 or contents[-2].role != "model":
+        return default_tier
+    calls = contents[-2].parts or []
+    if not calls or any(part.function_call is None for part in calls):
+        return default_tier  # the model also said something; it is reasoning, not dispatching
+    responses = [part.function_response for part in contents[-1].parts or [] if part.function_response]
+    if not responses:
+        return default_tier
+    for response in responses:
+        if response.name not in cheap_tools or _failed(response.response):
+            return default_tier
+    if estimate_tokens(contents) > large_prompt_tokens:
+        return default_tier
+    return 0
+
+
+def check_response(response, config=None):
+    # Why a response cannot be used, or None if it can.
+    if response is None or not response.candidates:
+        return "empty"
+    candidate = response.candidates[0]
+    finish_reason = str(getattr(candidate, "finish_reason", None) or "")
+    if finish_reason.endswith("MALFORMED_FUNCTION_CALL"):
+        return "malformed_call"
+    parts = candidate.content.parts if candidate.content else None
+    if not parts:
+        return "empty"
+    calls = [part.function_call for part in parts if part.function_call]
+    if not calls:
+        return None if any((part.text or "").strip() for part in parts) else "empty"
+    declared = {}
+    for tool in getattr(config, "tools", None) or []:
+        for declaration in tool.function_declarations or []:
+            required = declaration.parameters.required if declaration.parameters else None
+            declared[declaration.name] = set(required or ())
+    if not declared:
+        return None  # a cached config carries no declarations to check against
+    for call in calls:
+        if call.name not in declared:
+            return "unknown_function"
+        if declared[call.name] - set(call.args or {}):
+            return "missing_args"
+    return None
+
+
+class _TierStats:
+    def __init__(self):
+        self.counters = {"calls": 0, "errors": 0, "rejected": 0, "prompt_tokens": 0, "response_tokens": 0}
+        self.latency = deque(maxlen=200)
+
+
+class ModelRouter:
+    """Wraps a model client and routes each call to one of `tiers`.
+
+    choose_tier() picks the starting tier from the conversation so far. If
+    that model fails, returns nothing or calls a function that does not
+    exist or without its required arguments, the same request goes to the
+    next tier up; the top tier's answer is returned whatever it is. Calls
+    using a context cache stay on the model they asked for, since a cache
+    belongs to one model. Streaming calls are not routed.
+
+    stats() adds per-tier calls, rejections, tokens and latency to the
+    wrapped client's.
+    """
+
+    def __init__(self, client, tiers=MODEL_TIERS, default_tier=ROUTE_DEFAULT_TIER):
+        self._client = client
+        self.tiers = list(tiers)
+        self.default_tier = default_tier
+        self.metrics = {"routed": 0, "escalations": 0, "pinned": 0}
+        self._tiers = {model: _TierStats() for model in self.tiers}
+        self._lock = threading.Lock()
+        self.models = _RoutedModels(self)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _record(self, model, elapsed, response=None, error=False, rejected=False):
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            tier = self._tiers.setdefault(model, _TierStats())
+            tier.counters["calls"] += 1
+            tier.counters["errors"] += error
+            tier.counters["rejected"] += rejected
+            if usage is not None:
+                tier.counters["prompt_tokens"] += usage.prompt_token_count or 0
+                tier.counters["response_tokens"] += usage.candidates_token_count or 0
+            tier.latency.append(elapsed)
+
+    def stats(self):
+        stats = self._client.stats() if hasattr(self._client, "stats") else {}
+        with self._lock:
+            stats.update(self.metrics)
+            tiers = {}
+            for model, tier in self._tiers.items():
+                tiers[model] = dict(tier.counters)
+                if tier.latency:
+                    cuts = percentiles(tier.latency)
+                    tiers[model]["p50_latency_s"] = round(cuts["p50"], 3)
+                    tiers[model]["p90_latency_s"] = round(cuts["p90"], 3)
+        stats["tiers"] = tiers
+        return stats
+
+    def generate_content(self, *, model, contents, config=None):
+        if not self.tiers or getattr(config, "cached_content", None):
+            with self._lock:
+                self.metrics["pinned"] += 1
+            return self._client.models.generate_content(model=model, contents=contents, config=config)
+        tier = choose_tier(contents, len(self.tiers), self.default_tier)
+        with self._lock:
+            self.metrics["routed"] += 1
+        escalations = []
+        while True:
+            tier_model = self.tiers[tier]
+            top = tier == len(self.tiers) - 1
+            with span("model_attempt", model=tier_model, tier=tier) as attempt:
+                start = time.monotonic()
+                try:
+                    response = self._client.models.generate_content(model=tier_model, contents=contents, config=config)
+                except Exception:
+                    self._record(tier_model, time.monotonic() - start, error=True)
+                    if top:
+                        raise
+                    problem = "error"
+                else:
+                    problem = None if top else check_response(response, config)
+                    self._record(tier_model, time.monotonic() - start, response, rejected=problem is not None)
+                    if response is not None and response.usage_metadata is not None:
+                        attempt.set(prompt_tokens=response.usage_metadata.prompt_token_count,
+                                    response_tokens=response.usage_metadata.candidates_token_count)
+                if problem:
+                    attempt.set(rejected=problem)
+            if problem is None:
+                break
+            escalations.append(f"{tier_model}:{problem}")
+            tier += 1
+        if escalations:
+            with self._lock:
+                self.metrics["escalations"] += len(escalations)
+        current_span().set(routed_model=tier_model, escalations=escalations or None)
+        return response
+
+
+class _RoutedModels:
+    def __init__(self, router):
+        self._router = router
+
+    def generate_content(self, **kwargs):
+        return self._router.generate_content(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._router._client.models, name)
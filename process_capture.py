@@ -0,0 +1,134 @@
+import os
+import selectors
+import subprocess
+import time
+from config import RUN_CPU_SECONDS, RUN_MEMORY_LIMIT, RUN_OUTPUT_HARD_LIMIT, RUN_OUTPUT_MAX_BYTES
+
+
+class HeadTailBuffer:
+    """Keeps the first and last max_bytes/2 bytes written and counts the rest."""
+
+    def __init__(self, max_bytes=RUN_OUTPUT_MAX_BYTES):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        if len(self.head) < self.head_limit:
+            room = self.head_limit - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_limit:
+                del self.tail[:len(self.tail) - self.tail_limit]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def getvalue(self):
+        # Text the way subprocess.run(text=True) would return it.
+        if self.dropped:
+            data = bytes(self.head) + f"\n[... {self.dropped} bytes dropped ...]\n".encode() + bytes(self.tail)
+        else:
+            data = bytes(self.head + self.tail)
+        return data.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+class CapturedRun:
+    def __init__(self, args, returncode, stdout, stderr, output_limit_hit=False):
+        self.args = args
+        self.returncode = returncode
+        self.stdout_buffer = stdout
+        self.stderr_buffer = stderr
+        self.stdout = stdout.getvalue()
+        self.stderr = stderr.getvalue()
+        self.output_limit_hit = output_limit_hit
+
+    @property
+    def dropped_bytes(self):
+        return self.stdout_buffer.dropped + self.stderr_buffer.dropped
+
+
+def pump(sinks, timeout=None, hard_limit=None, limited=None):
+    # Reads every fd in sinks ({fd: object with write()}) until EOF. Returns
+    # "timeout" or "limit" if it had to stop early, None otherwise. Only the
+    # fds in `limited` count towards hard_limit (0 = no limit).
+    limited = set(sinks if limited is None else limited)
+    hard_limit = RUN_OUTPUT_HARD_LIMIT if hard_limit is None else hard_limit
+    produced = 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    try:
+        for fd in sinks:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return "timeout"
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    continue
+                sinks[key.fd].write(data)
+                if key.fd in limited:
+                    produced += len(data)
+                    if hard_limit and produced > hard_limit:
+                        return "limit"
+        return None
+    finally:
+        selector.close()
+
+
+def limits():
+    return {"cpu": RUN_CPU_SECONDS, "memory": RUN_MEMORY_LIMIT}
+
+
+def apply_limits(limits, pid=0):
+    # pid=0 means the calling process. The CPU hard limit is one second above
+    # the soft one so the child first gets SIGXCPU, then SIGKILL.
+    try:
+        import resource
+    except ImportError:
+        return
+    settings = []
+    if limits.get("cpu"):
+        settings.append((resource.RLIMIT_CPU, (limits["cpu"], limits["cpu"] + 1)))
+    if limits.get("memory") and hasattr(resource, "RLIMIT_AS"):
+        settings.append((resource.RLIMIT_AS, (limits["memory"], limits["memory"])))
+    for which, value in settings:
+        try:
+            if pid:
+                resource.prlimit(pid, which, value)
+            else:
+                resource.setrlimit(which, value)
+        except (OSError, ValueError, AttributeError):
+            pass
+
+
+def run_captured(argv, cwd, env, timeout):
+    """subprocess.run(capture_output=True, text=True) with bounded memory.
+
+    Output is kept in HeadTailBuffers, the child is killed as soon as it has
+    written more than RUN_OUTPUT_HARD_LIMIT bytes, and the configured CPU and
+    memory rlimits are applied to it.
+    """
+    process = subprocess.Popen(argv, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    apply_limits(limits(), process.pid)
+    stdout, stderr = HeadTailBuffer(), HeadTailBuffer()
+    try:
+        stopped = pump({process.stdout.fileno(): stdout, process.stderr.fileno(): stderr}, timeout)
+        if stopped:
+            process.kill()
+        process.wait()
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+    if stopped == "timeout":
+        raise subprocess.TimeoutExpired(argv, timeout, output=stdout.getvalue(), stderr=stderr.getvalue())
+    return CapturedRun(argv, process.returncode, stdout, stderr, output_limit_hit=stopped == "limit")
@@ -0,0 +1,212 @@
+# Fork server started by python_workers, one per sandbox script directory.
+#
+#   python python_worker_server.py SOCKET_PATH SCRIPT_DIR SANDBOX_ROOT
+#
+# Only imports the stdlib, so nothing from the agent leaks into the scripts it
+# runs. For every request it forks a supervisor, which forks the child that
+# actually runs the script and reports its exit status, so runs are isolated
+# from each other and from this process. Modules the scripts imported are
+# imported here afterwards, which is what makes the next run warm.
+import atexit
+import importlib
+import json
+import os
+import runpy
+import signal
+import socket
+import sys
+import traceback
+
+_SKIP_FRAMES = {os.path.abspath(__file__), runpy.__file__, "<frozen runpy>"}
+
+
+def _sandbox_modules(sandbox_root):
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(sandbox_root + os.sep):
+            modules[name] = os.path.abspath(path)
+    return modules
+
+
+class PreloadTimeout(BaseException):
+    pass
+
+
+def _preload_timeout(signum, frame):
+    raise PreloadTimeout()
+
+
+class Server:
+    def __init__(self, socket_path, script_dir, sandbox_root):
+        self.socket_path = socket_path
+        self.script_dir = script_dir
+        self.sandbox_root = sandbox_root
+        self.loaded = {}  # sandbox module name -> (path, mtime_ns)
+        self.pending = []  # module names to import once the current run is forked
+
+    def serve(self):
+        sys.path[0] = self.script_dir
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # supervisors are reaped automatically
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(64)
+        sys.stdout.write("ready\n")
+        sys.stdout.flush()
+        # Nobody reads the pipe after this; whatever preloaded modules print
+        # must not fill it and block the server.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+        signal.signal(signal.SIGALRM, _preload_timeout)
+
+        while True:
+            conn, _ = listener.accept()
+            try:
+                message, fds, _, _ = socket.recv_fds(conn, 1 << 16, 2)
+                request = json.loads(message)
+            except (OSError, ValueError):
+                conn.close()
+                continue
+            op = request.get("op")
+            if op == "stop":
+                conn.close()
+                break
+            if op == "invalidate":
+                self.drop_sandbox_modules()
+                conn.close()
+                continue
+
+            self.drop_stale_modules()
+            if os.fork() == 0:
+                listener.close()
+                supervise(conn, fds, request)
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            self.preload(request.get("preload", []), request.get("preload_seconds"))
+        listener.close()
+
+    def preload(self, names, seconds=None):
+        # A module that hangs at import would stop the server from taking
+        # requests, so the imports as a whole get `seconds`.
+        if seconds:
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            for name in self.pending + list(names):
+                if name in sys.modules:
+                    continue
+                try:
+                    importlib.import_module(name)
+                except PreloadTimeout:
+                    break
+                except BaseException:
+                    pass
+        except PreloadTimeout:
+            pass
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        self.pending = []
+        for name, path in _sandbox_modules(self.sandbox_root).items():
+            if name not in self.loaded:
+                try:
+                    self.loaded[name] = (path, os.stat(path).st_mtime_ns)
+                except OSError:
+                    pass
+
+    def drop_stale_modules(self):
+        for path, mtime_ns in self.loaded.values():
+            try:
+                if os.stat(path).st_mtime_ns == mtime_ns:
+                    continue
+            except OSError:
+                pass
+            self.drop_sandbox_modules()
+            return
+
+    def drop_sandbox_modules(self):
+        # Dropping every sandbox module, not only the changed one, keeps
+        # modules that imported it from holding on to the old version.
+        for name in _sandbox_modules(self.sandbox_root):
+            sys.modules.pop(name, None)
+        self.pending.extend(self.loaded)
+        self.loaded = {}
+        importlib.invalidate_caches()
+
+
+def supervise(conn, fds, request):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    pid = os.fork()
+    if pid == 0:
+        run_script(conn, fds, request)
+    for fd in fds:
+        os.close(fd)
+    try:
+        conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+        _, status = os.waitpid(pid, 0)
+        conn.sendall(json.dumps({"returncode": os.waitstatus_to_exitcode(status)}).encode() + b"\n")
+    finally:
+        os._exit(0)
+
+
+def _exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def apply_limits(limits):
+    # Same settings as process_capture.apply_limits, which can't be imported
+    # here.
+    import resource
+
+    if limits.get("cpu"):
+        resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu"], limits["cpu"] + 1))
+    if limits.get("memory") and hasattr(resource, "RLIMIT_AS"):
+        resource.setrlimit(resource.RLIMIT_AS, (limits["memory"], limits["memory"]))
+
+
+def run_script(conn, fds, request):
+    code = 1
+    try:
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            os.close(fd)
+        sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+        sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", buffering=1, closefd=False)
+        os.chdir(request["cwd"])
+        apply_limits(request.get("limits", {}))
+        sys.argv = list(request["argv"])
+        before = set(sys.modules)
+        try:
+            runpy.run_path(request["argv"][0], run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            code = _exit_code(e.code)
+        except BaseException as e:
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename in _SKIP_FRAMES:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb)
+        atexit._run_exitfuncs()
+        imported = sorted(name for name in set(sys.modules) - before if name != "__main__")
+        conn.sendall(json.dumps({"modules": imported}).encode() + b"\n")
+    except BaseException:
+        pass
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+        os._exit(code)
+
+
+if __name__ == "__main__":
+    Server(*sys.argv[1:4]).serve()
@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from config import PYTHON_WORKER_PRELOAD_SECONDS, PYTHON_WORKERS
+from process_capture import CapturedRun, HeadTailBuffer, limits, pump
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker_server.py")
+
+
+class WorkerUnavailable(Exception):
+    pass
+
+
+class _Server:
+    def __init__(self, sandbox_root, script_dir):
+        self.sandbox_root = sandbox_root
+        self.script_dir = script_dir
+        self.socket_dir = tempfile.mkdtemp(prefix="agent-python-")
+        self.socket_path = os.path.join(self.socket_dir, "server.sock")
+        env = os.environ.copy()
+        env["PYTHONIOENCODING"] = "utf-8"
+        self.process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, self.socket_path, script_dir, sandbox_root],
+            cwd=sandbox_root,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+        )
+        ready = self.process.stdout.readline()
+        self.process.stdout.close()  # the server sends its own output to /dev/null from here on
+        if ready != b"ready\n":
+            self.stop()
+            raise WorkerUnavailable(f"worker for {script_dir} did not start")
+        self.imported = set()  # modules reported by runs
+        self.preloaded = set()  # ...of which the server was already asked to import
+        self.lock = threading.Lock()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, message, fds=()):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            socket.send_fds(conn, [json.dumps(message).encode()], list(fds))
+        except OSError as e:
+            conn.close()
+            raise WorkerUnavailable(str(e))
+        return conn
+
+    def run(self, cwd, argv, timeout):
+        with self.lock:
+            preload = sorted(self.imported - self.preloaded)
+            self.preloaded.update(preload)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            message = {"op": "run", "cwd": cwd, "argv": argv, "preload": preload,
+                       "preload_seconds": PYTHON_WORKER_PRELOAD_SECONDS, "limits": limits()}
+            conn = self.send(message, (out_w, err_w))
+        except WorkerUnavailable:
+            for fd in (out_r, err_r):
+                os.close(fd)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        return self._collect(conn, out_r, err_r, argv, timeout)
+
+    def _collect(self, conn, out_r, err_r, argv, timeout):
+        # Same contract as process_capture.run_captured: bounded output, and
+        # the child is killed on timeout or once it writes too much.
+        stdout, stderr, status = HeadTailBuffer(), HeadTailBuffer(), io.BytesIO()
+        try:
+            stopped = pump({out_r: stdout, err_r: stderr, conn.fileno(): status}, timeout, limited=(out_r, err_r))
+            info = {}
+            if stopped:
+                # The pid line arrives as soon as the child is forked.
+                for line in status.getvalue().splitlines():
+                    info.update(json.loads(line))
+                if "pid" in info:
+                    try:
+                        os.kill(info["pid"], signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+            if stopped == "limit":
+                pump({conn.fileno(): status}, timeout=5)
+            for line in status.getvalue().splitlines():
+                info.update(json.loads(line))
+        finally:
+            conn.close()
+            os.close(out_r)
+            os.close(err_r)
+
+        if stopped == "timeout":
+            if "pid" not in info:
+                # The script never started: the server itself is stuck, so
+                # kill it and let the pool start a fresh one.
+                self.process.kill()
+                self.process.wait()
+            raise subprocess.TimeoutExpired(argv, timeout, output=stdout.getvalue(), stderr=stderr.getvalue())
+        if "returncode" not in info:
+            raise RuntimeError("python worker exited without reporting a status")
+        with self.lock:
+            self.imported.update(info.get("modules", ()))
+        return CapturedRun(argv, info["returncode"], stdout, stderr, output_limit_hit=stopped == "limit")
+
+    def invalidate(self):
+        try:
+            self.send({"op": "invalidate"}).close()
+        except WorkerUnavailable:
+            pass
+
+    def stop(self):
+        if self.alive():
+            try:
+                self.send({"op": "stop"}).close()
+                self.process.wait(timeout=5)
+            except (WorkerUnavailable, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        os.rmdir(self.socket_dir)
+
+
+class WorkerPool:
+    """Fork servers for run_python_file, one per sandbox script directory.
+
+    A server is an interpreter that has already imported what earlier runs
+    imported; each run is forked from it, so the script starts warm but
+    still cannot affect later runs. Servers drop sandbox modules whose files
+    changed, and write_file/edit_file tell them explicitly as well.
+    """
+
+    def __init__(self):
+        self.servers = {}
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.cold_starts = 0
+
+    def server(self, sandbox_root, script_dir):
+        key = (sandbox_root, script_dir)
+        with self.lock:
+            server = self.servers.get(key)
+            if server is None or not server.alive():
+                if server is not None:
+                    server.stop()
+                server = _Server(sandbox_root, script_dir)
+                self.servers[key] = server
+                self.cold_starts += 1
+            return server
+
+    def run(self, abs_working_dir, abs_file_path, args, timeout):
+        argv = [abs_file_path, *args]
+        server = self.server(abs_working_dir, os.path.dirname(abs_file_path))
+        try:
+            result = server.run(abs_working_dir, argv, timeout)
+        except WorkerUnavailable:
+            # The server went away before the script started; start a fresh
+            # one and try once more.
+            with self.lock:
+                self.servers.pop((abs_working_dir, os.path.dirname(abs_file_path)), None)
+            server.stop()
+            server = self.server(abs_working_dir, os.path.dirname(abs_file_path))
+            result = server.run(abs_working_dir, argv, timeout)
+        self.runs += 1
+        return result
+
+    def invalidate(self, abs_path):
+        abs_path = os.path.abspath(abs_path)
+        with self.lock:
+            servers = [s for (root, _), s in self.servers.items() if abs_path == root or abs_path.startswith(root + os.sep)]
+        for server in servers:
+            server.invalidate()
+
+    def stats(self):
+        return {"servers": len(self.servers), "runs": self.runs, "cold_starts": self.cold_starts}
+
+    def close(self):
+        with self.lock:
+            servers = list(self.servers.values())
+            self.servers.clear()
+        for server in servers:
+            server.stop()
+
+
+worker_pool = None
+
+
+def enable():
+    global worker_pool
+    if worker_pool is None and hasattr(os, "fork") and hasattr(socket, "send_fds"):
+        import atexit
+
+        worker_pool = WorkerPool()
+        atexit.register(worker_pool.close)
+    return worker_pool
+
+
+def invalidate(abs_path):
+    if worker_pool is not None and abs_path.endswith(".py"):
+        worker_pool.invalidate(abs_path)
+
+
+if PYTHON_WORKERS:
+    enable()
@@ -0,0 +1,160 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from config import (
+    READ_AHEAD,
+    READ_AHEAD_FILE_MAX_BYTES,
+    READ_AHEAD_MAX_BYTES,
+    READ_AHEAD_MAX_FILES,
+    READ_AHEAD_WAIT,
+    READ_AHEAD_WORKERS,
+)
+from functions import sandbox
+
+
+class ReadAhead:
+    """Small text files loaded in the background after a directory listing.
+
+    The model usually reads most of the small files it was just shown, one
+    round trip later. schedule() loads up to max_files of them (.py first)
+    on a few threads; take() hands a file's text to get_file_content once,
+    provided its mtime and size still match, and waits briefly for a load
+    that is still running. Writes and script runs drop what they may have
+    changed. Loaded files beyond max_bytes push out the oldest.
+    """
+
+    def __init__(self, max_files=READ_AHEAD_MAX_FILES, max_bytes=READ_AHEAD_MAX_BYTES,
+                 file_max_bytes=READ_AHEAD_FILE_MAX_BYTES, workers=READ_AHEAD_WORKERS):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.file_max_bytes = file_max_bytes
+        self.current_bytes = 0
+        self.counters = {"scheduled": 0, "loaded": 0, "skipped": 0, "hits": 0, "misses": 0, "wasted": 0}
+        self._entries = OrderedDict()  # real path -> (mtime_ns, size, text)
+        self._pending = {}  # real path -> future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="read-ahead")
+
+    def schedule(self, abs_dir, entries):
+        # entries: (path relative to abs_dir, size) of the files a listing
+        # returned. Returns the relative paths that will be loaded.
+        candidates = [(rel, size) for rel, size in entries if 0 < size <= self.file_max_bytes]
+        candidates.sort(key=lambda item: not item[0].endswith(".py"))
+        chosen = []
+        with self._lock:
+            for rel, size in candidates[:self.max_files]:
+                abs_path = os.path.join(abs_dir, rel)
+                if abs_path not in self._entries and abs_path not in self._pending:
+                    self._pending[abs_path] = self._executor.submit(self._load, abs_path)
+                    self.counters["scheduled"] += 1
+                chosen.append(rel)
+        return chosen
+
+    def _load(self, abs_path):
+        try:
+            with open(abs_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = f.read(self.file_max_bytes + 1)
+            text = None
+            if len(data) <= self.file_max_bytes and b"\0" not in data:
+                # The text get_file_content would read: UTF-8 with universal newlines.
+                text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        except (OSError, UnicodeDecodeError):
+            text = None
+        with self._lock:
+            if self._pending.pop(abs_path, None) is None:
+                return  # invalidated while loading
+            if text is None:
+                self.counters["skipped"] += 1
+                return
+            self._entries[abs_path] = (st.st_mtime_ns, st.st_size, text)
+            self.current_bytes += st.st_size
+            self.counters["loaded"] += 1
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, abs_path):
+        entry = self._entries.pop(abs_path, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+            self.counters["wasted"] += 1
+        return entry
+
+    def take(self, abs_path, st):
+        with self._lock:
+            future = self._pending.get(abs_path)
+        if future is not None:
+            try:
+                future.result(timeout=READ_AHEAD_WAIT)
+            except FuturesTimeoutError:
+                pass
+        with self._lock:
+            entry = self._entries.pop(abs_path, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+            if entry is None or st is None or (entry[0], entry[1]) != (st.st_mtime_ns, st.st_size):
+                self.counters["misses"] += 1
+                if entry is not None:
+                    self.counters["wasted"] += 1
+                return None
+            self.counters["hits"] += 1
+            return entry[2]
+
+    def invalidate(self, abs_path):
+        # The path itself, or everything under it for a directory.
+        prefix = abs_path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for path in [p for p in self._entries if p == abs_path or p.startswith(prefix)]:
+                self._drop(path)
+            for path in [p for p in self._pending if p == abs_path or p.startswith(prefix)]:
+                self._pending.pop(path).cancel()
+                self.counters["wasted"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self.current_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+buffer = None
+
+
+def enable():
+    global buffer
+    if buffer is None:
+        buffer = ReadAhead()
+    return buffer
+
+
+def invalidate(abs_path):
+    if buffer is not None:
+        buffer.invalidate(abs_path)
+
+
+def after_listing(args, result):
+    # Starts loading the small files a get_files_info result lists and names
+    # them in the result, so the model can ask for all it needs in one turn.
+    if buffer is None or not isinstance(result, dict) or not result.get("entries"):
+        return result
+    resolved = sandbox.resolve(args["working_directory"], args.get("directory", "."))
+    if resolved is None:
+        return result
+    files = []
+    for entry in result["entries"]:
+        rel, _, size = entry.rpartition(" ")
+        if rel and size.isdigit():
+            files.append((rel, int(size)))
+    preloaded = buffer.schedule(resolved[1], files)
+    return {**result, "preloaded": preloaded} if preloaded else result
+
+
+if READ_AHEAD:
+    enable()
@@ -0,0 +1,110 @@
+import difflib
+import os
+import threading
+from config import MAX_CHARS, REREAD_DIFF_CONTEXT, REREAD_DIFF_MAX_RATIO
+from functions import sandbox
+from tool_budget import estimate_tokens
+
+# Whole-file reads that refer to a copy already in the history start with one
+# of these; HistoryManager keeps the copies they refer to.
+UNCHANGED_PREFIX = "[Unchanged since turn "
+DIFF_PREFIX = "[Changes to "
+RANGE_ARGS = ("offset", "length", "start_line", "end_line", "tail_lines")
+
+
+def is_relative_read(text):
+    return isinstance(text, str) and (text.startswith(UNCHANGED_PREFIX) or text.startswith(DIFF_PREFIX))
+
+
+class ReadTracker:
+    """What get_file_content returned for each file in one conversation.
+
+    A later whole-file read of the same file is answered with a marker when
+    nothing changed, or with a unified diff against the copy the model has
+    when that is much smaller than the file. A file written with write_file
+    counts as read, since its content is in the model's own call; edit_file
+    and script or test runs make the next read a full one. Reads with
+    full=true always return the whole file.
+    """
+
+    def __init__(self):
+        self.versions = {}  # real path -> (text the model has, turn, "read"/"wrote")
+        self.stats = {"full_reads": 0, "diff_reads": 0, "unchanged_reads": 0, "tokens_saved": 0}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.versions.clear()
+
+    def _key(self, args):
+        resolved = sandbox.resolve(args["working_directory"], args.get("file_path", ""))
+        return resolved[1] if resolved else None
+
+    def view(self, function_name, args, result, full=False):
+        # The result to send in place of `result`, and the tokens that saves.
+        if function_name != "get_file_content" or not isinstance(result, str) or result.startswith("Error:"):
+            return result, 0
+        if any(args.get(k) is not None for k in RANGE_ARGS):
+            return result, 0
+        with self._lock:
+            known = None if full else self.versions.get(self._key(args))
+        if known is None:
+            self.stats["full_reads"] += 1
+            return result, 0
+        text, turn, how = known
+        file_path = args["file_path"]
+        if text == result:
+            sent = f"{UNCHANGED_PREFIX}{turn}: {file_path} is identical to the copy you {how} then ({len(result)} characters). Pass full=true to read it again.]"
+            self.stats["unchanged_reads"] += 1
+        else:
+            diff = "\n".join(difflib.unified_diff(
+                text.splitlines(), result.splitlines(),
+                fromfile=f"{file_path} (turn {turn})", tofile=f"{file_path} (now)",
+                n=REREAD_DIFF_CONTEXT, lineterm="",
+            ))
+            if len(diff) > len(result) * REREAD_DIFF_MAX_RATIO:
+                self.stats["full_reads"] += 1
+                return result, 0
+            sent = f"{DIFF_PREFIX}{file_path} since the copy you {how} in turn {turn}; pass full=true for the whole file.]\n{diff}"
+            self.stats["diff_reads"] += 1
+        saved = max(estimate_tokens(result) - estimate_tokens(sent), 0)
+        self.stats["tokens_saved"] += saved
+        return sent, saved
+
+    def remember(self, function_name, args, result, trimmed=False):
+        # Called with the full result once it was sent. A result the budget
+        # trimmed is not what the model has, so it is forgotten instead.
+        if function_name == "get_file_content":
+            if any(args.get(k) is not None for k in RANGE_ARGS) or not isinstance(result, str) or result.startswith("Error:"):
+                return
+            text, how = result, "read"
+        elif function_name == "write_file":
+            content = args.get("content")
+            if not isinstance(content, str) or not isinstance(result, str) or result.startswith("Error:"):
+                return
+            # A later read returns this exactly only if it is not truncated.
+            text, how = (content, "wrote") if len(content) < MAX_CHARS else (None, None)
+        elif function_name == "edit_file":
+            if isinstance(result, str) and result.startswith("Error:"):
+                return
+            text, how = None, None  # the model has its edits, not the file they produced
+        elif function_name in ("run_python_file", "run_tests"):
+            # A run may have changed any file; history compaction drops the
+            # copies from before it as well.
+            resolved = sandbox.resolve(args["working_directory"])
+            if resolved is not None:
+                prefix = resolved[0].rstrip(os.sep) + os.sep
+                with self._lock:
+                    for key in [k for k in self.versions if k.startswith(prefix)]:
+                        del self.versions[key]
+            return
+        else:
+            return
+        key = self._key(args)
+        if key is None:
+            return
+        with self._lock:
+            if trimmed or text is None:
+                self.versions.pop(key, None)
+            else:
+                self.versions[key] = (text, sandbox.current_turn(), how)
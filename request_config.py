@@ -0,0 +1,83 @@
+from config import MODEL, CONTEXT_CACHE_TTL
+from func_calling import get_available_functions
+
+
+class RequestConfig:
+    """The static part of every generate_content request, built once per session.
+
+    With `use_cache`, the system instruction and tool declarations are
+    registered as cached content and later requests only reference it. If the
+    backend refuses (unsupported model, prefix below the minimum cache size,
+    expired cache), requests fall back to sending them inline.
+    """
+
+    def __init__(self, client, system_prompt, model=MODEL, use_cache=False, verbose=False):
+        from google.genai import types
+
+        self.model = model
+        self.system_prompt = system_prompt
+        self.uncached = types.GenerateContentConfig(
+            tools=[get_available_functions()],
+            system_instruction=system_prompt,
+        )
+        self.config = self.uncached
+        self.cache_name = None
+        self._client = client
+        self._verbose = verbose
+        if use_cache:
+            self._create_cache()
+
+    def _create_cache(self):
+        from google.genai import types
+
+        try:
+            cache = self._client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self.system_prompt,
+                    tools=[get_available_functions()],
+                    ttl=CONTEXT_CACHE_TTL,
+                    display_name="ai-agent-static-prefix",
+                ),
+            )
+        except Exception as e:
+            if self._verbose:
+                print(f"Context cache unavailable, sending the prompt prefix inline: {e}")
+            return
+        self.cache_name = cache.name
+        self.config = types.GenerateContentConfig(cached_content=cache.name)
+        if self._verbose:
+            print(f"Context cache created: {cache.name}")
+
+    def drop_cache(self):
+        # Sends the prefix inline from now on. The cache is deleted so it is
+        # not billed until its TTL runs out.
+        name, self.cache_name = self.cache_name, None
+        self.config = self.uncached
+        if name:
+            try:
+                self._client.caches.delete(name=name)
+            except Exception:
+                pass  # it expires on its own
+
+    def close(self):
+        self.drop_cache()
+
+
+def is_cache_error(error):
+    # The cached prefix is gone or unusable (not found, expired, refused).
+    # Rate limits and server errors say nothing about the cache; the retry
+    # layer has already dealt with them.
+    code = getattr(error, "code", None)
+    if code == 404:
+        return True
+    message = str(error).lower()
+    if isinstance(code, int) and code not in (400, 403):
+        return False
+    return "cache" in message
+
+
+def as_request_config(client, system_prompt_or_config):
+    if isinstance(system_prompt_or_config, RequestConfig):
+        return system_prompt_or_config
+    return RequestConfig(client, system_prompt_or_config)
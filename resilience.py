@@ -0,0 +1,245 @@
+# Retries, deadlines and request hedging around model calls.
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config import (
+    MODEL_MAX_RETRIES, MODEL_BACKOFF_BASE, MODEL_BACKOFF_MAX, MODEL_CALL_DEADLINE,
+    HEDGE_MIN_SAMPLES, HEDGE_DEFAULT_DELAY,
+)
+from tracing import current_span
+
+# Rate limiting, timeouts and transient server errors.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error):
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Only check httpx's exceptions if the SDK has already loaded it.
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    return False
+
+
+def backoff_delay(attempt, base=MODEL_BACKOFF_BASE, cap=MODEL_BACKOFF_MAX):
+    # "Full jitter": anywhere between 0 and the exponential bound.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+class ResilientClient:
+    """Wraps a model client with retries, a per-call deadline and optional hedging.
+
+    Retryable failures are retried with exponentially growing, jittered
+    sleeps until `max_retries` or the deadline runs out. With `hedge`, a
+    second identical request is sent when the first has not answered within
+    the recent p95 latency, and whichever succeeds first is used.
+
+    Streamed calls (`aio.models.generate_content_stream`) get the same
+    retries and deadline up to their first chunk. Chunks after that have
+    been shown already, so a stream failing midway is not retried, and
+    streams are never hedged.
+    """
+
+    def __init__(self, client, hedge=False, max_retries=MODEL_MAX_RETRIES, deadline=MODEL_CALL_DEADLINE,
+                 backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX):
+        self._client = client
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency = LatencyTracker()
+        self.metrics = {"calls": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0, "hedges_sent": 0, "hedge_wins": 0}
+        self._metrics_lock = threading.Lock()
+        # Abandoned attempts keep their thread until they return, so leave headroom.
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model")
+        self.models = _ResilientModels(self)
+        self.aio = _ResilientAio(self)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _count(self, key, amount=1):
+        with self._metrics_lock:
+            self.metrics[key] += amount
+
+    def stats(self):
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        p95 = self.latency.p95()
+        stats["p95_latency_s"] = round(p95, 3) if p95 is not None else None
+        return stats
+
+    def generate_content(self, **kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return self._attempt(kwargs, remaining)
+            except DeadlineExceeded:
+                self._count("deadline_exceeded")
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                if time.monotonic() + delay >= deadline:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                current_span().set(retries=attempt)
+                time.sleep(delay)
+
+    async def generate_content_stream(self, **kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"model call deadline of {self.deadline}s exceeded")
+                try:
+                    return await asyncio.wait_for(self._open_stream(kwargs), remaining)
+                except TimeoutError:
+                    if time.monotonic() < deadline:
+                        raise  # the call's own timeout, which is retryable
+                    raise DeadlineExceeded(f"model call deadline of {self.deadline}s exceeded") from None
+            except DeadlineExceeded:
+                self._count("deadline_exceeded")
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                if time.monotonic() + delay >= deadline:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                current_span().set(retries=attempt)
+                await asyncio.sleep(delay)
+
+    async def _open_stream(self, kwargs):
+        # The SDK may only send the request once the stream is read, so the
+        # first chunk is read here, where failures can still be retried.
+        stream = await self._client.aio.models.generate_content_stream(**kwargs)
+        try:
+            first = await anext(stream)
+        except StopAsyncIteration:
+            return _chain((), stream)
+        return _chain((first,), stream)
+
+    def _timed_call(self, kwargs):
+        start = time.monotonic()
+        response = self._client.models.generate_content(**kwargs)
+        self.latency.add(time.monotonic() - start)
+        return response
+
+    def _attempt(self, kwargs, remaining):
+        if remaining <= 0:
+            raise DeadlineExceeded(f"model call deadline of {self.deadline}s exceeded")
+        primary = self._executor.submit(self._timed_call, kwargs)
+        pending = {primary}
+        hedge_delay = self.latency.p95() if self.hedge else None
+        if self.hedge and hedge_delay is None:
+            hedge_delay = HEDGE_DEFAULT_DELAY
+        end = time.monotonic() + remaining
+        hedge = None
+        error = None
+        while pending:
+            timeout = end - time.monotonic()
+            if hedge is None and hedge_delay is not None:
+                timeout = min(timeout, hedge_delay)
+            done, pending = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if future is hedge:
+                    self._count("hedge_wins")
+                    current_span().set(hedge_won=True)
+                return response
+            if not done and hedge is None and hedge_delay is not None and time.monotonic() < end:
+                hedge = self._executor.submit(self._timed_call, kwargs)
+                pending.add(hedge)
+                self._count("hedges_sent")
+                current_span().set(hedged=True)
+                continue
+            if not done and time.monotonic() >= end:
+                raise DeadlineExceeded(f"model call deadline of {self.deadline}s exceeded")
+        raise error
+
+
+class _ResilientModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, **kwargs):
+        return self._client.generate_content(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client._client.models, name)
+
+
+class _ResilientAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content_stream(self, **kwargs):
+        return await self._client.generate_content_stream(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client._client.aio.models, name)
+
+
+class _ResilientAio:
+    def __init__(self, client):
+        self._client = client
+        self.models = _ResilientAsyncModels(client)
+
+    def __getattr__(self, name):
+        return getattr(self._client._client.aio, name)
+
+
+async def _chain(first, stream):
+    for chunk in first:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
@@ -0,0 +1,76 @@
+# Summarizes a trace written with `main.py --trace=FILE`.
+#
+#   python scripts/trace_summary.py trace.jsonl
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracing import percentiles
+
+COUNTERS = ("prompt_tokens", "response_tokens", "bytes_read", "bytes_written", "chars_sent", "chars_full_rewrite", "stdout_bytes", "stderr_bytes", "dropped_bytes", "result_chars", "trimmed_tokens", "reread_tokens_saved")
+
+
+def load_spans(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def group_key(record):
+    if record["name"] == "tool_call":
+        return f"tool_call:{record.get('tool')}"
+    if record["name"] == "model_attempt":
+        return f"model_attempt:{record.get('model')}"
+    if record["name"] == "subprocess":
+        return f"subprocess:{record.get('file')}"
+    return record["name"]
+
+
+def summarize(spans):
+    groups = defaultdict(list)
+    for record in spans:
+        groups[group_key(record)].append(record)
+
+    rows = []
+    for key, records in sorted(groups.items()):
+        durations = [r["duration_ms"] for r in records]
+        row = {"span": key, "total_ms": sum(durations), **percentiles(durations)}
+        for counter in COUNTERS:
+            values = [r[counter] for r in records if isinstance(r.get(counter), (int, float))]
+            if values:
+                row[counter] = sum(values)
+        hits = [r["cache_hit"] for r in records if "cache_hit" in r]
+        if hits:
+            row["cache_hits"] = sum(hits)
+        errors = sum(1 for r in records if "error" in r)
+        if errors:
+            row["errors"] = errors
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate agent trace spans into a latency breakdown.")
+    parser.add_argument("trace")
+    parser.add_argument("--json", action="store_true", help="print rows as JSON instead of a table")
+    options = parser.parse_args()
+
+    rows = summarize(load_spans(options.trace))
+    if options.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'span':<36}{'n':>6}{'total ms':>12}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}  totals")
+    for row in rows:
+        totals = ", ".join(f"{k}={row[k]}" for k in (*COUNTERS, "cache_hits", "errors") if k in row)
+        print(
+            f"{row['span']:<36}{row['n']:>6}{row['total_ms']:>12.2f}"
+            f"{row['p50']:>10.2f}{row['p90']:>10.2f}{row['max']:>10.2f}  {totals}"
+        )
+
+
+if __name__ == "__main__":
+    main()
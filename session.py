@@ -0,0 +1,265 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+from collections.abc import Sequence
+from config import FSYNC_WRITES, SESSION_COMPRESS_MIN_BYTES, SESSION_DIR, WORKING_DIR
+
+# A session log is MAGIC followed by records, each a RECORD header (payload
+# length, kind) and the payload. Records are only ever appended; a record cut
+# short by a crash is dropped the next time the log is opened.
+MAGIC = b"AGENTSESSION1\n"
+RECORD = struct.Struct(">IB")
+KIND_CONTENT = 1  # types.Content as JSON
+KIND_CONTENT_ZLIB = 2  # the same, zlib-compressed
+KIND_FILES = 3  # {path: [mtime_ns, size, sha256] or null once removed} of files the agent read or wrote
+
+# Tools whose file_path argument names a file whose contents the model has seen.
+FILE_TOOLS = ("get_file_content", "write_file", "edit_file")
+_NAME = re.compile(r"^[\w.-]+$")
+
+
+def session_path(name, session_dir=None):
+    if not _NAME.match(name):
+        raise ValueError(f"invalid session name {name!r}; use letters, digits, '.', '-' and '_'")
+    return os.path.join(session_dir or SESSION_DIR, f"{name}.log")
+
+
+def _file_stamp(abs_path, known=None):
+    # Hashing is skipped when mtime and size match what was recorded.
+    try:
+        st = os.stat(abs_path)
+    except OSError:
+        return None
+    if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+        return known
+    digest = hashlib.sha256()
+    try:
+        with open(abs_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, digest.hexdigest()]
+
+
+class SessionMessages(Sequence):
+    """The message history of a session, decoded from the log on first access.
+
+    append() writes the message to the log before adding it, so main.py and
+    async_agent.py can use this in place of their plain messages list.
+    """
+
+    def __init__(self, session, offsets):
+        self._session = session
+        self._offsets = offsets  # (payload offset, length, kind) per message
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        content = self._decoded.get(index)
+        if content is None:
+            if not 0 <= index < len(self._offsets):
+                raise IndexError("session message index out of range")
+            content = self._session._decode(*self._offsets[index])
+            self._decoded[index] = content
+        return content
+
+    def append(self, content):
+        offset, length, kind = self._session._append_content(content)
+        self._decoded[len(self._offsets)] = content
+        self._offsets.append((offset, length, kind))
+
+    @property
+    def decoded(self):
+        return len(self._decoded)
+
+
+class Session:
+    """An append-only log of one conversation, resumable with --session NAME.
+
+    Opening an existing log maps it and indexes the record headers only;
+    messages are decoded when the history is first sent to the model. Files
+    the agent read or wrote are recorded with their hashes, and on resume
+    the model is told which of them changed instead of reading them again.
+    """
+
+    def __init__(self, path, working_directory=WORKING_DIR):
+        self.path = path
+        self.working_directory = os.path.realpath(working_directory)
+        self.files = {}
+        self.changed_files = []
+        self.removed_files = []
+        self.resumed = False
+        self._calls = []
+        self._notice = None
+        self._map = None
+        offsets = self._load()
+        self.messages = SessionMessages(self, offsets)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._write(MAGIC)
+        if self.resumed:
+            self._check_files()
+
+    @classmethod
+    def open(cls, name, working_directory=WORKING_DIR, session_dir=None):
+        path = session_path(name, session_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(path, working_directory)
+
+    def _load(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size == 0:
+            return []
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not a session log")
+        offsets = []
+        position = end = len(MAGIC)
+        while position + RECORD.size <= size:
+            length, kind = RECORD.unpack_from(self._map, position)
+            start = position + RECORD.size
+            if start + length > size:
+                break
+            if kind == KIND_FILES:
+                for path, stamp in json.loads(self._map[start:start + length]).items():
+                    if stamp is None:
+                        self.files.pop(path, None)
+                    else:
+                        self.files[path] = stamp
+            elif kind in (KIND_CONTENT, KIND_CONTENT_ZLIB):
+                offsets.append((start, length, kind))
+            position = end = start + length
+        self.resumed = bool(offsets)
+        if offsets and self._has_unanswered_calls(self._decode(*offsets[-1])):
+            # The session stopped between a model's function calls and their
+            # responses; the model would reject that history, so drop the calls.
+            end = offsets.pop()[0] - RECORD.size
+        if end < size:
+            self._map.close()
+            self._map = None
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+            if end > len(MAGIC):
+                return self._load()
+            self.resumed = False
+            return []
+        return offsets
+
+    @staticmethod
+    def _has_unanswered_calls(content):
+        return any(part.function_call for part in content.parts or [])
+
+    def _decode(self, offset, length, kind):
+        from google.genai import types
+
+        payload = self._map[offset:offset + length]
+        if kind == KIND_CONTENT_ZLIB:
+            payload = zlib.decompress(payload)
+        return types.Content.model_validate(json.loads(payload))
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        if FSYNC_WRITES:
+            os.fsync(self._file.fileno())
+
+    def _append_record(self, kind, payload):
+        offset = self._file.tell() + RECORD.size
+        self._write(RECORD.pack(len(payload), kind) + payload)
+        return offset
+
+    def _append_content(self, content):
+        payload = json.dumps(content.model_dump(mode="json", exclude_none=True), separators=(",", ":")).encode("utf-8")
+        kind = KIND_CONTENT
+        if len(payload) >= SESSION_COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(payload, 6)
+            if len(compressed) < len(payload):
+                payload, kind = compressed, KIND_CONTENT_ZLIB
+        offset = self._append_record(kind, payload)
+        self._record_files(content)
+        return offset, len(payload), kind
+
+    def _record_files(self, content):
+        # Function responses follow the model message holding their calls.
+        parts = content.parts or []
+        if any(part.function_call for part in parts):
+            self._calls = [part.function_call for part in parts if part.function_call]
+            return
+        if not any(part.function_response for part in parts):
+            return
+        touched = {}
+        for call in self._calls:
+            path = (call.args or {}).get("file_path")
+            if call.name in FILE_TOOLS and isinstance(path, str):
+                path = os.path.normpath(path)
+                stamp = _file_stamp(os.path.join(self.working_directory, path))
+                if stamp is not None and self.files.get(path) != stamp:
+                    touched[path] = stamp
+        self._calls = []
+        if touched:
+            self.files.update(touched)
+            self._append_record(KIND_FILES, json.dumps(touched, separators=(",", ":")).encode("utf-8"))
+
+    def _check_files(self):
+        current = {}
+        for path, known in self.files.items():
+            stamp = _file_stamp(os.path.join(self.working_directory, path), known)
+            if stamp is None:
+                self.removed_files.append(path)
+                current[path] = None
+            elif stamp[2] != known[2]:
+                self.changed_files.append(path)
+                current[path] = stamp
+            elif stamp is not known:
+                current[path] = stamp  # touched but identical; skip hashing next time
+        if current:
+            self._append_record(KIND_FILES, json.dumps(current, separators=(",", ":")).encode("utf-8"))
+            for path, stamp in current.items():
+                if stamp is None:
+                    del self.files[path]
+                else:
+                    self.files[path] = stamp
+
+        lines = [f"This conversation was resumed from a saved session ({len(self.messages)} earlier messages)."]
+        if self.changed_files:
+            lines.append("Files changed since you last saw them: " + ", ".join(sorted(self.changed_files)) + ".")
+        if self.removed_files:
+            lines.append("Files that no longer exist: " + ", ".join(sorted(self.removed_files)) + ".")
+        if self.files.keys() - set(self.changed_files):
+            lines.append("Every other file you read earlier is unchanged; use what you already read instead of reading it again.")
+        self._notice = " ".join(lines)
+
+    def take_notice(self):
+        # Parts to put before the first prompt after a resume, once.
+        from google.genai import types
+
+        notice, self._notice = self._notice, None
+        return [types.Part(text=notice)] if notice else []
+
+    def close(self):
+        self._file.close()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,3 +1,15 @@
+import time
+import asyncio
+import os
+import tempfile
+from google.genai import types
+import func_calling
+import async_agent
+from history import HistoryManager, estimate_tokens
+from tool_cache import ToolCache, call_cached
+import tool_cache
+from llm_client import ReplayClient
+from request_config import RequestConfig
 from functions.run_python_file import run_python_file
 
 
@@ -15,5 +27,1340 @@ def test():
     print(result)
 
 
+def test_call_functions():
+    events = []
+
+    def slow_read(working_directory, file_path):
+        time.sleep(0.2)
+        events.append(("read", file_path))
+        return file_path
+
+    def write(working_directory, file_path, content):
+        events.append(("write", file_path))
+        return content
+
+    def hang(working_directory, file_path):
+        time.sleep(2)
+
+    saved = dict(func_calling.function_map)
+    func_calling.function_map.update(get_file_content=slow_read, write_file=write, run_python_file=hang)
+    try:
+        calls = [types.FunctionCall(name="get_file_content", args={"file_path": f"f{i}.py"}) for i in range(5)]
+        calls.append(types.FunctionCall(name="write_file", args={"file_path": "f0.py", "content": "new"}))
+        calls.append(types.FunctionCall(name="run_python_file", args={"file_path": "main.py"}))
+        start = time.perf_counter()
+        results = func_calling.call_functions(calls, timeout=0.5)
+        elapsed = time.perf_counter() - start
+    finally:
+        func_calling.function_map.clear()
+        func_calling.function_map.update(saved)
+
+    responses = [r.parts[0].function_response.response for r in results]
+    print(f"call_functions: {elapsed:.2f}s {responses}")
+    assert elapsed < 1.0
+    assert [r.get("result") for r in responses[:6]] == ["f0.py", "f1.py", "f2.py", "f3.py", "f4.py", "new"]
+    assert "timed out" in responses[6]["error"]
+    assert events.index(("read", "f0.py")) < events.index(("write", "f0.py"))
+
+    # The timeout runs from each call's submission, not from when the call
+    # before it was collected.
+    def read(working_directory, file_path):
+        time.sleep(0.4 if file_path == "slow.py" else 2)
+        return file_path
+
+    func_calling.function_map["get_file_content"] = read
+    try:
+        calls = [types.FunctionCall(name="get_file_content", args={"file_path": p}) for p in ("slow.py", "hung.py")]
+        start = time.perf_counter()
+        results = func_calling.call_functions(calls, timeout=0.5)
+        elapsed = time.perf_counter() - start
+    finally:
+        func_calling.function_map.clear()
+        func_calling.function_map.update(saved)
+    responses = [r.parts[0].function_response.response for r in results]
+    assert responses[0] == {"result": "slow.py"} and "timed out" in responses[1]["error"]
+    assert elapsed < 0.8, elapsed
+
+
+def test_dispatcher_barriers():
+    events = []
+
+    def slow(kind, delay):
+        def tool(working_directory, **args):
+            time.sleep(delay)
+            events.append((kind, args.get("file_path") or args.get("directory") or args.get("pattern")))
+            return kind
+        return tool
+
+    saved = dict(func_calling.function_map)
+    func_calling.function_map.update(
+        edit_file=slow("edit", 0.2), write_file=slow("write", 0.2), run_tests=slow("tests", 0),
+        run_python_file=slow("run", 0), get_files_info=slow("list", 0), search_files=slow("search", 0),
+        get_file_content=slow("read", 0),
+    )
+    try:
+        def run(*calls):
+            events.clear()
+            func_calling.call_functions([types.FunctionCall(name=name, args=args) for name, args in calls], timeout=2)
+            return [kind for kind, _ in events]
+
+        # The tests must see the edit made earlier in the same turn.
+        assert run(("edit_file", {"file_path": "pkg/calculator.py", "edits": []}), ("run_tests", {})) == ["edit", "tests"]
+        assert run(("write_file", {"file_path": "pkg/calculator.py", "content": ""}), ("run_python_file", {"file_path": "tests.py"})) == ["write", "run"]
+        assert run(("write_file", {"file_path": "pkg/calculator.py", "content": ""}), ("get_files_info", {"directory": "."})) == ["write", "list"]
+        assert run(("write_file", {"file_path": "pkg/calculator.py", "content": ""}), ("get_files_info", {"directory": "pkg"})) == ["write", "list"]
+        assert run(("write_file", {"file_path": "pkg/calculator.py", "content": ""}), ("search_files", {"pattern": "x"})) == ["write", "search"]
+        # Calls after a barrier wait for it; unrelated paths still run side by side.
+        assert run(("run_tests", {}), ("write_file", {"file_path": "a.py", "content": ""}), ("get_file_content", {"file_path": "b.py"})) == ["tests", "read", "write"]
+        assert run(("write_file", {"file_path": "a.py", "content": ""}), ("get_files_info", {"directory": "pkg"})) == ["list", "write"]
+    finally:
+        func_calling.function_map.clear()
+        func_calling.function_map.update(saved)
+
+
+def test_profiled_tool_threads():
+    import pstats
+    from tracing import profiled
+
+    def busy(working_directory, file_path):
+        time.sleep(0.05)
+        return file_path
+
+    saved = dict(func_calling.function_map)
+    func_calling.function_map["get_file_content"] = busy
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "session.prof")
+            with profiled(path):
+                func_calling.call_functions([types.FunctionCall(name="get_file_content", args={"file_path": "a.py"})])
+            names = {function for _, _, function in pstats.Stats(path).stats}
+    finally:
+        func_calling.function_map.clear()
+        func_calling.function_map.update(saved)
+    assert "busy" in names  # ran on a dispatcher thread, not the profiling one
+
+
+def test_generate_content_stream():
+    started = []
+
+    def read(working_directory, file_path):
+        started.append(time.perf_counter())
+        return "content"
+
+    def chunk(*parts):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=list(parts)))]
+        )
+
+    async def stream():
+        yield chunk(types.Part.from_function_call(name="get_file_content", args={"file_path": "main.py"}))
+        await asyncio.sleep(0.3)
+        yield chunk(types.Part(text="Reading "), types.Part(text="main.py"))
+
+    class FakeModels:
+        async def generate_content_stream(self, **kwargs):
+            return stream()
+
+    class FakeClient:
+        class aio:
+            models = FakeModels()
+
+    saved = dict(func_calling.function_map)
+    func_calling.function_map["get_file_content"] = read
+    try:
+        messages = []
+        start = time.perf_counter()
+        result = asyncio.run(async_agent.generate_content_stream(FakeClient(), messages, False, ""))
+    finally:
+        func_calling.function_map.clear()
+        func_calling.function_map.update(saved)
+
+    assert result is None
+    assert started[0] - start < 0.2
+    assert [p.text for p in messages[0].parts][1] == "Reading main.py"
+    assert messages[1].parts[0].function_response.response == {"result": "content"}
+
+
+def test_history_compaction():
+    def exchange(name, args, result):
+        return [
+            types.Content(role="model", parts=[types.Part.from_function_call(name=name, args=args)]),
+            types.Content(parts=[types.Part.from_function_response(name=name, response={"result": result})]),
+        ]
+
+    messages = [types.Content(role="user", parts=[types.Part(text="fix the calculator")])]
+    messages += exchange("get_file_content", {"file_path": "pkg/calculator.py"}, "x" * 8000)
+    messages += exchange("run_python_file", {"file_path": "tests.py"}, "y" * 20000)
+    messages += exchange("get_file_content", {"file_path": "./pkg/calculator.py"}, "z" * 8000)
+    messages += exchange("get_files_info", {}, "- main.py")
+
+    history = HistoryManager(token_budget=3000, keep_recent=2)
+    compacted = history.compact(messages)
+    responses = [c.parts[0].function_response.response["result"] for c in compacted[2::2]]
+    print(f"history: {estimate_tokens(messages)} -> {estimate_tokens(compacted)} tokens")
+    assert "read again later" in responses[0]
+    assert "elided" in responses[1]
+    assert responses[2] == "z" * 8000
+    assert history.tokens_saved > 0
+    assert messages[2].parts[0].function_response.response["result"] == "x" * 8000
+
+    # edit_file and runs change files just like write_file.
+    messages = [types.Content(role="user", parts=[types.Part(text="fix it")])]
+    messages += exchange("get_file_content", {"file_path": "a.py"}, "a" * 100)
+    messages += exchange("get_file_content", {"file_path": "b.py"}, "b" * 100)
+    messages += exchange("edit_file", {"file_path": "a.py", "edits": []}, "Successfully edited a.py")
+    messages += exchange("run_tests", {}, {"passed": 1})
+    messages += exchange("get_files_info", {}, "- a.py")
+    compacted = HistoryManager(keep_recent=2).compact(messages)
+    responses = [c.parts[0].function_response.response["result"] for c in compacted[2::2]]
+    assert responses[0] == "[Earlier read of a.py omitted; the file was changed later.]"
+    assert responses[1] == "[Earlier read of b.py omitted; a later run_tests may have changed the file.]"
+
+    # Turns too large to fit even elided are skipped, and a re-read that
+    # referred to a copy in them no longer stands alone.
+    messages = [types.Content(role="user", parts=[types.Part(text="read a.py")])]
+    messages += exchange("get_file_content", {"file_path": "a.py"}, "a" * 4000)
+    messages += [types.Content(role="user", parts=[types.Part(text="read it again")])]
+    messages += exchange("get_file_content", {"file_path": "a.py"}, "[Unchanged since turn 1: a.py is identical]")
+    history = HistoryManager(token_budget=100, keep_recent=0)
+    compacted = history.compact(messages)
+    assert history.skipped == 3 and len(compacted) == 3
+    assert [p.text for p in compacted[0].parts] == ["[3 older messages were skipped to fit the history budget.]", "read it again"]
+    assert compacted[2].parts[0].function_response.response["result"].startswith("[Read of a.py omitted")
+
+
+def test_tool_cache():
+    from functions.get_file_content import get_file_content
+    from functions.get_files_info import get_files_info
+    from functions.write_file import write_file
+
+    saved = tool_cache.tool_cache
+    tool_cache.tool_cache = ToolCache(max_bytes=64)
+    try:
+        with tempfile.TemporaryDirectory() as wd:
+            write_file(wd, "a.txt", "hello")
+            read = {"working_directory": wd, "file_path": "a.txt"}
+            assert call_cached(get_file_content, "get_file_content", dict(read)) == "hello"
+            assert call_cached(get_file_content, "get_file_content", dict(read)) == "hello"
+            listing = {"working_directory": wd, "max_depth": 0}
+            call_cached(get_files_info, "get_files_info", dict(listing))
+            # Listings always see changes made outside the agent, even deep in the tree.
+            os.makedirs(os.path.join(wd, "pkg"))
+            with open(os.path.join(wd, "pkg", "b.py"), "w") as f:
+                f.write("x = 1\n")
+            assert "pkg/b.py 6" in call_cached(get_files_info, "get_files_info", dict(listing))["entries"]
+            call_cached(write_file, "write_file", {"working_directory": wd, "file_path": "a.txt", "content": "bye"})
+            assert tool_cache.tool_cache.stats()["entries"] == 0
+            assert call_cached(get_file_content, "get_file_content", dict(read)) == "bye"
+            write_file(wd, "big.txt", "x" * 100)
+            call_cached(get_file_content, "get_file_content", {"working_directory": wd, "file_path": "big.txt"})
+            stats = tool_cache.tool_cache.stats()
+    finally:
+        tool_cache.tool_cache = saved
+    print(f"tool cache: {stats}")
+    assert stats["hits"] == 1 and stats["misses"] == 3
+    assert stats["bytes"] <= 64
+
+
+def test_replay_session():
+    import shutil
+    import main as agent
+
+    cwd = os.getcwd()
+    client = ReplayClient.from_file(os.path.join(cwd, "benchmarks", "transcripts", "calculator_session.jsonl"))
+    messages = [types.Content(role="user", parts=[types.Part(text="check the calculator")])]
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree("calculator", os.path.join(tmp, "calculator"))
+        os.chdir(tmp)
+        try:
+            final_response = agent.run_agent(client, messages, False, "")
+            notes_written = os.path.exists(os.path.join("calculator", "notes.txt"))
+        finally:
+            os.chdir(cwd)
+
+    print(f"replay: {final_response}")
+    assert "all 24 unit tests pass" in final_response
+    assert notes_written
+    assert len(client.requests) == len(client.responses)
+    tool_results = [p.function_response.response for c in messages for p in c.parts if p.function_response]
+    assert all("result" in r for r in tool_results)
+
+
+def test_context_cache():
+    import shutil
+    import main as agent
+    from agent_instructions import SYSTEM_PROMPT
+
+    cwd = os.getcwd()
+    transcript = os.path.join(cwd, "benchmarks", "transcripts", "calculator_session.jsonl")
+    totals = {}
+    for use_cache, min_tokens in ((False, 0), (True, 0), (True, 10**6)):
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copytree("calculator", os.path.join(tmp, "calculator"))
+            os.chdir(tmp)
+            try:
+                client = ReplayClient.from_file(transcript, estimate_usage=True, cache_min_tokens=min_tokens)
+                request = RequestConfig(client, SYSTEM_PROMPT.strip(), use_cache=use_cache)
+                messages = [types.Content(role="user", parts=[types.Part(text="check the calculator")])]
+                usage = []
+                while True:
+                    response = agent.generate_content(client, messages, False, request)
+                    usage.append(response.usage_metadata)
+                    if not response.function_calls:
+                        break
+                totals[(use_cache, min_tokens)] = (
+                    sum(u.prompt_token_count for u in usage),
+                    sum(u.cached_content_token_count or 0 for u in usage),
+                )
+                assert all(r["config"] is request.config for r in client.requests)
+            finally:
+                os.chdir(cwd)
+
+    print(f"context cache (prompt, cached) tokens: {totals}")
+    uncached, cached, refused = totals[(False, 0)], totals[(True, 0)], totals[(True, 10**6)]
+    assert uncached[0] == cached[0] and uncached[1] == 0
+    assert cached[1] > 0
+    assert refused == uncached
+
+    # Only a missing or expired cache is abandoned, and then deleted; other
+    # errors leave it in place for the next call.
+    class FailingModels:
+        def __init__(self, errors):
+            self.errors = errors
+
+        def generate_content(self, **kwargs):
+            if self.errors:
+                raise self.errors.pop(0)
+            return client.models.generate_content(**kwargs)
+
+    class FailingClient:
+        def __init__(self, errors):
+            self.models = FailingModels(errors)
+            self.caches = client.caches
+
+    client = ReplayClient.from_file(transcript, estimate_usage=True)
+    request = RequestConfig(client, SYSTEM_PROMPT.strip(), use_cache=True)
+    messages = [types.Content(role="user", parts=[types.Part(text="check the calculator")])]
+    name = request.cache_name
+    for error in (FakeModelError(429), FakeModelError(503)):
+        try:
+            agent.generate_content(FailingClient([error]), messages, False, request)
+        except FakeModelError:
+            pass
+        else:
+            raise AssertionError("transient error was swallowed")
+        assert request.cache_name == name
+    agent.generate_content(FailingClient([FakeModelError(404)]), messages, False, request)
+    assert request.cache_name is None and request.config is request.uncached
+    try:
+        client.caches.get(name=name)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("abandoned cache was not deleted")
+
+
+def test_batch():
+    import json
+    import change_journal
+    from batch import run_batch
+
+    transcript = os.path.join("benchmarks", "transcripts", "calculator_session.jsonl")
+    client = ReplayClient.from_file(transcript, by_turn=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        prompts_path = os.path.join(tmp, "prompts.jsonl")
+        output_path = os.path.join(tmp, "results.jsonl")
+        with open(prompts_path, "w") as f:
+            for i in range(4):
+                f.write(json.dumps({"id": f"s{i}", "prompt": f"check the calculator {i}"}) + "\n")
+            # Awkward ids get their own directory under the batch root; a
+            # record without a prompt fails alone.
+            for record_id in ("s0", "../escape", "a/b"):
+                f.write(json.dumps({"id": record_id, "prompt": "check the calculator"}) + "\n")
+            f.write(json.dumps({"id": "empty"}) + "\n")
+        summary = run_batch(client, "", prompts_path, output_path, concurrency=2, requests_per_minute=60000)
+        with open(output_path) as f:
+            results = [json.loads(line) for line in f]
+        assert not os.path.exists(os.path.join(tempfile.gettempdir(), "escape"))
+
+    assert summary["statuses"] == {"ok": 7, "error": 1}
+    assert not any("agent-batch-" in root for root in change_journal._journals)  # each session's journal was closed
+    assert sorted(r["id"] for r in results) == ["../escape", "a/b", "empty", "s0", "s0", "s1", "s2", "s3"]
+    assert [r["error"] for r in results if r["status"] == "error"] == ["ValueError: record has no prompt"]
+    results = [r for r in results if r["status"] == "ok"]
+    assert all(r["model_calls"] == 6 for r in results)
+    assert not os.path.exists(os.path.join("calculator", "notes.txt"))
+
+
+def test_lazy_startup():
+    import subprocess
+    import sys
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py"], capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "Usage" in result.stdout
+    assert "google.genai" not in result.stderr
+    assert "dotenv" not in result.stderr
+
+
+def test_ranged_reads():
+    import functions.get_file_content as module
+
+    saved = module.MMAP_MIN_BYTES
+    with tempfile.TemporaryDirectory() as wd:
+        with open(os.path.join(wd, "big.log"), "w") as f:
+            for i in range(1, 60001):
+                f.write(f"line {i}\n")
+        # Once through plain reads, once through mmap.
+        for threshold in (saved, 0):
+            module.MMAP_MIN_BYTES = threshold
+            try:
+                result = module.get_file_content(wd, "big.log", start_line=50000, end_line=50001)
+                assert result.splitlines()[1:] == ["line 50000", "line 50001"]
+                result = module.get_file_content(wd, "big.log", start_line=10, end_line=10)
+                assert result.splitlines()[1:] == ["line 10"]
+                result = module.get_file_content(wd, "big.log", tail_lines=2)
+                assert result.splitlines()[1:] == ["line 59999", "line 60000"]
+                result = module.get_file_content(wd, "big.log", offset=5, length=3)
+                assert result.splitlines()[1:] == ["1", "l"]
+                assert "truncated" in module.get_file_content(wd, "big.log", start_line=2)
+                assert module.get_file_content(wd, "big.log", start_line=70000).startswith("Error")
+                assert module.get_file_content(wd, "big.log", offset=-1).startswith("Error")
+            finally:
+                module.MMAP_MIN_BYTES = saved
+
+
+def test_files_listing():
+    from functions.get_files_info import get_files_info
+
+    with tempfile.TemporaryDirectory() as wd:
+        for d in ("a/b/c", "a/__pycache__", ".git", "z"):
+            os.makedirs(os.path.join(wd, d))
+        for f in ("a/one.py", "a/b/two.py", "a/b/c/three.txt", "a/__pycache__/x.pyc", ".git/HEAD", "z/four.py", "top.py"):
+            with open(os.path.join(wd, f), "w") as fh:
+                fh.write("x" * 3)
+
+        assert get_files_info(wd)["entries"] == ["a/", "top.py 3", "z/"]
+        full = get_files_info(wd, max_depth=0)["entries"]
+        assert full == ["a/", "a/b/", "a/b/c/", "a/b/c/three.txt 3", "a/b/two.py 3", "a/one.py 3", "top.py 3", "z/", "z/four.py 3"]
+        assert get_files_info(wd, max_depth=2)["entries"] == ["a/", "a/b/", "a/one.py 3", "top.py 3", "z/", "z/four.py 3"]
+        assert get_files_info(wd, max_depth=0, include=["*.py"], exclude=["z"])["entries"] == ["a/b/two.py 3", "a/one.py 3", "top.py 3"]
+
+        pages, cursor = [], None
+        while True:
+            page = get_files_info(wd, max_depth=0, cursor=cursor, limit=2)
+            pages += page["entries"]
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+        assert pages == full
+
+        # Symlinks, dangling or pointing outside, are listed without a size.
+        with tempfile.TemporaryDirectory() as outside:
+            with open(os.path.join(outside, "secret.txt"), "w") as fh:
+                fh.write("x" * 1234)
+            os.symlink(os.path.join(outside, "secret.txt"), os.path.join(wd, "a", "b", "out.txt"))
+            os.symlink(os.path.join(wd, "missing"), os.path.join(wd, "z", "dangling"))
+            entries = get_files_info(wd, max_depth=0)["entries"]
+            assert "a/b/out.txt" in entries and "z/dangling" in entries and "z/four.py 3" in entries
+
+
+def test_search_files():
+    import re
+    import functions.search_files as search
+
+    saved = search.SEARCH_INDEX_DIR
+    try:
+        with tempfile.TemporaryDirectory() as wd, tempfile.TemporaryDirectory() as index_dir:
+            search.SEARCH_INDEX_DIR = index_dir
+            os.makedirs(os.path.join(wd, "pkg"))
+            with open(os.path.join(wd, "pkg", "calc.py"), "w") as f:
+                f.write("import math\n\ndef evaluate(expr):\n    return expr\n")
+            with open(os.path.join(wd, "notes.txt"), "w") as f:
+                f.write("nothing to see\n")
+
+            result = search.search_files(wd, "def evaluate")
+            assert result.startswith("1 matches in 1 files"), result
+            assert "pkg/calc.py:3: def evaluate(expr):" in result and "pkg/calc.py-2- " in result
+            assert "pkg/calc.py:1: import math" in search.search_files(wd, r"^import\s+\w+", regex=True)
+            assert search.search_files(wd, "EVALUATE", case_sensitive=False).startswith("1 matches")
+            assert search.search_files(wd, "def evaluate", include=["*.txt"]).startswith("No matches")
+            assert search.search_files(wd, "(", regex=True).startswith("Error:")
+
+            with open(os.path.join(wd, "notes.txt"), "a") as f:
+                f.write("def evaluate_later\n")
+            assert search.search_files(wd, "def evaluate").startswith("2 matches in 2 files")
+            assert os.listdir(index_dir)
+
+            # Symlinks are searched only when they point inside the working directory.
+            with open(os.path.join(index_dir, "secret.txt"), "w") as f:
+                f.write("API_KEY=hunter2\n")
+            os.symlink(os.path.join(index_dir, "secret.txt"), os.path.join(wd, "link.txt"))
+            os.symlink(os.path.join(wd, "notes.txt"), os.path.join(wd, "notes_link.txt"))
+            assert search.search_files(wd, "API_KEY").startswith("No matches")
+            assert "notes_link.txt:2: def evaluate_later" in search.search_files(wd, "evaluate_later")
+            os.remove(os.path.join(wd, "notes_link.txt"))
+            os.symlink(os.path.join(index_dir, "secret.txt"), os.path.join(wd, "notes_link.txt"))
+            assert search.search_files(wd, "hunter2").startswith("No matches")
+            assert search.scan(wd, ["link.txt", "notes_link.txt"], re.compile("hunter2")) == ([], 0)
+    finally:
+        search.SEARCH_INDEX_DIR = saved
+
+
+def test_edit_file():
+    import difflib
+    from functions.edit_file import edit_file
+    from functions.write_file import write_file
+
+    with tempfile.TemporaryDirectory() as wd:
+        original = "".join(f"value_{i} = {i}\n" for i in range(1, 1001))
+        assert write_file(wd, "big.py", original).startswith("Successfully")
+        assert os.listdir(wd) == ["big.py"]
+        umask = os.umask(0o022)
+        os.umask(umask)
+        assert os.stat(os.path.join(wd, "big.py")).st_mode & 0o777 == 0o666 & ~umask
+
+        target = original.replace("value_10 = 10\n", "value_10 = 'ten'\n").replace("value_900 = 900\n", "")
+        diff = "".join(difflib.unified_diff(original.splitlines(True), target.splitlines(True), "a/big.py", "b/big.py"))
+        result = edit_file(wd, "big.py", diff=diff)
+        print(f"edit_file: {result}")
+        assert result.startswith("Successfully edited big.py (2 hunks;"), result
+        with open(os.path.join(wd, "big.py")) as f:
+            assert f.read() == target
+
+        edits = [{"search": "value_1 = 1\n", "replace": "value_1 = 'one'\n"}]
+        assert edit_file(wd, "big.py", edits=edits).startswith("Successfully edited big.py (1 hunk;")
+        assert "search text matches" in edit_file(wd, "big.py", edits=[{"search": "value_2", "replace": "x"}])
+        assert "hunk 1 does not match" in edit_file(wd, "big.py", diff="@@ -5,1 +5,1 @@\n-nope\n+x\n")
+        with open(os.path.join(wd, "big.py")) as f:
+            assert f.read() == target.replace("value_1 = 1\n", "value_1 = 'one'\n")
+        assert os.listdir(wd) == ["big.py"]
+
+    # Removed lines that themselves start with "-- " are not file headers.
+    from functions.edit_file import apply_unified_diff, parse_unified_diff
+    assert apply_unified_diff("a\n-- comment\nb\n", "--- a/x.sql\n+++ b/x.sql\n@@ -1,3 +1,2 @@\n a\n--- comment\n b\n") == ("a\nb\n", 1)
+    assert apply_unified_diff("a\n-- old\nb\n", "@@ @@\n a\n--- old\n+++ new\n b\n") == ("a\n++ new\nb\n", 1)
+    two_files = "--- a/x\n+++ b/x\n@@ -1,2 +1,2 @@\n a\n-b\n+c\n--- a/y\n+++ b/y\n@@ -1 +1 @@\n-z\n+w\n"
+    assert parse_unified_diff(two_files) == [(0, ["a", "b"], ["a", "c"]), (0, ["z"], ["w"])]
+
+    # Only "\n" ends a line, and every line keeps its own ending.
+    assert apply_unified_diff("a\fb\nc\x85d\u2028e\n", "@@ -2 +2 @@\n-c\x85d\u2028e\n+C\n") == ("a\fb\nC\n", 1)
+    assert apply_unified_diff("a\r\nb\nc\r\n", "@@ -1,3 +1,4 @@\n a\n-b\n+B\n+B2\n c\n") == ("a\r\nB\nB2\nc\r\n", 1)
+    assert apply_unified_diff("a\nb", "@@ -2 +2,2 @@\n-b\n+c\n+d\n") == ("a\nc\nd", 1)
+
+
+def test_python_workers():
+    import shutil
+    import subprocess
+    import python_workers
+    from functions.edit_file import edit_file
+    from functions.run_python_file import run_python_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wd = os.path.join(tmp, "calculator")
+        shutil.copytree("calculator", wd)
+        with open(os.path.join(wd, "counter.py"), "w") as f:
+            f.write("import pkg.render as r\nr.RUNS = getattr(r, 'RUNS', 0) + 1\nprint(r.RUNS)\n")
+        cold = run_python_file(wd, "main.py", ["3 + 5"])
+
+        pool = python_workers.enable()
+        try:
+            assert run_python_file(wd, "main.py", ["3 + 5"]) == cold
+            assert "OK" in run_python_file(wd, "tests.py")
+            # Runs are forked, so module state never carries over.
+            assert run_python_file(wd, "counter.py") == run_python_file(wd, "counter.py") == "Process exited with code 0\nSTDOUT:\n1\n\n"
+
+            edits = [{"search": "def render(", "replace": "def render(*a):\n    return 'patched'\n\ndef _render("}]
+            assert edit_file(wd, "pkg/render.py", edits=edits).startswith("Successfully")
+            assert "STDOUT:\npatched" in run_python_file(wd, "main.py", ["3 + 5"])
+
+            with open(os.path.join(wd, "slow.py"), "w") as f:
+                f.write("import time\ntime.sleep(10)\n")
+            try:
+                pool.run(wd, os.path.join(wd, "slow.py"), [], timeout=0.5)
+                assert False, "expected a timeout"
+            except subprocess.TimeoutExpired:
+                pass
+            assert pool.stats()["cold_starts"] == 1
+
+            # Output printed while the server preloads a module goes nowhere,
+            # instead of filling a pipe nobody reads.
+            with open(os.path.join(wd, "noisy.py"), "w") as f:
+                f.write("print('x' * 100000)\n")
+            with open(os.path.join(wd, "loud.py"), "w") as f:
+                f.write("import noisy\nprint('done')\n")
+            for _ in range(3):
+                assert pool.run(wd, os.path.join(wd, "loud.py"), [], timeout=5).returncode == 0
+
+            # A module that hangs while preloading only holds the server up
+            # for PYTHON_WORKER_PRELOAD_SECONDS; a server stuck for longer
+            # than a run's timeout is replaced.
+            with open(os.path.join(wd, "stuck.py"), "w") as f:
+                f.write("import sys, time\nif sys.argv[0].endswith('python_worker_server.py'):\n    time.sleep(60)\n")
+            with open(os.path.join(wd, "uses_stuck.py"), "w") as f:
+                f.write("import stuck\n")
+            saved = python_workers.PYTHON_WORKER_PRELOAD_SECONDS
+            try:
+                # Modules a run imported are preloaded after the next run is forked.
+                python_workers.PYTHON_WORKER_PRELOAD_SECONDS = 0.5
+                for script in ("uses_stuck.py", "loud.py", "loud.py"):
+                    assert pool.run(wd, os.path.join(wd, script), [], timeout=5).returncode == 0
+                python_workers.PYTHON_WORKER_PRELOAD_SECONDS = 60
+                with open(os.path.join(wd, "hang.py"), "w") as f:
+                    f.write("import stuck\n")
+                with open(os.path.join(wd, "uses_hang.py"), "w") as f:
+                    f.write("import hang\n")
+                for script in ("uses_hang.py", "loud.py"):
+                    assert pool.run(wd, os.path.join(wd, script), [], timeout=5).returncode == 0
+                try:
+                    pool.run(wd, os.path.join(wd, "loud.py"), [], timeout=0.5)
+                    assert False, "expected a timeout"
+                except subprocess.TimeoutExpired:
+                    pass
+                assert pool.run(wd, os.path.join(wd, "loud.py"), [], timeout=5).returncode == 0
+                assert pool.stats()["cold_starts"] == 2
+            finally:
+                python_workers.PYTHON_WORKER_PRELOAD_SECONDS = saved
+        finally:
+            pool.close()
+            python_workers.worker_pool = None
+
+
+def test_bounded_run_output():
+    import functions.run_python_file as module
+    import process_capture
+
+    buffer = process_capture.HeadTailBuffer(10)
+    for chunk in (b"abc", b"defgh", b"ijklmnop", b"qr"):
+        buffer.write(chunk)
+    assert (bytes(buffer.head), bytes(buffer.tail), buffer.dropped) == (b"abcde", b"nopqr", 8)
+    assert buffer.getvalue() == "abcde\n[... 8 bytes dropped ...]\nnopqr"
+
+    saved = process_capture.RUN_OUTPUT_HARD_LIMIT, process_capture.RUN_CPU_SECONDS
+    for m in (module, process_capture):
+        m.RUN_OUTPUT_HARD_LIMIT, m.RUN_CPU_SECONDS = 1024 * 1024, 1
+    try:
+        with tempfile.TemporaryDirectory() as wd:
+            with open(os.path.join(wd, "rows.py"), "w") as f:
+                f.write("for i in range(5000):\n    print('row', i)\n")
+            with open(os.path.join(wd, "spam.py"), "w") as f:
+                f.write("while True:\n    print('spam' * 100)\n")
+            with open(os.path.join(wd, "spin.py"), "w") as f:
+                f.write("while True:\n    pass\n")
+
+            result = module.run_python_file(wd, "rows.py")
+            assert result.startswith("Process exited with code 0\nSTDOUT:\nrow 0\n") and "row 4999\n" in result
+            assert len(result) < 11000 and "bytes of stdout and 0 bytes of stderr dropped" in result
+
+            start = time.perf_counter()
+            result = module.run_python_file(wd, "spam.py")
+            assert result.startswith("Process exited with code -9\nKilled after writing more than 1048576 bytes"), result[:200]
+            assert time.perf_counter() - start < 10
+
+            result = module.run_python_file(wd, "spin.py")
+            assert "Killed (CPU time limit is" in result, result
+    finally:
+        for m in (module, process_capture):
+            m.RUN_OUTPUT_HARD_LIMIT, m.RUN_CPU_SECONDS = saved
+
+
+def test_run_tests():
+    import shutil
+    from functions.run_tests import run_tests
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wd = os.path.join(tmp, "calculator")
+        shutil.copytree("calculator", wd)
+        os.makedirs(os.path.join(wd, "extra"))
+        with open(os.path.join(wd, "extra", "test_render.py"), "w") as f:
+            f.write("from pkg.render import render\n\ndef test_render():\n    assert '8' in render('3 + 5', 8)\n")
+
+        summary = run_tests(wd)
+        assert (summary["selection"], summary["passed"], summary["failed"]) == ("all", 25, 0), summary
+        assert run_tests(wd)["result"] == "nothing to run"
+
+        path = os.path.join(wd, "pkg", "calculator.py")
+        with open(path) as f:
+            source = f.read()
+        with open(path, "w") as f:
+            f.write(source.replace('"+": lambda a, b: a + b', '"+": lambda a, b: a - b'))
+        summary = run_tests(wd)
+        assert summary["test_files"] == ["tests.py"] and summary["not_affected"] == ["extra/test_render.py"], summary
+        assert summary["failed"] > 0 and summary["passed"] + summary["failed"] == 24
+        failure = summary["failures"][0]
+        assert failure["file"] == "tests.py" and "AssertionError" in failure["traceback"]
+        assert tmp not in failure["traceback"]
+
+        one = run_tests(wd, paths=["tests.py::test_addition"])
+        assert (one["total"], one["failed"]) == (1, 1)
+
+        with open(path, "w") as f:
+            f.write(source)
+        summary = run_tests(wd)
+        assert summary["test_files"] == ["tests.py"] and summary["failed"] == 0 and summary["passed"] == 24
+
+        # A targeted run of other tests leaves the change pending for the next run.
+        with open(path, "w") as f:
+            f.write(source.replace('"+": lambda a, b: a + b', '"+": lambda a, b: a - b'))
+        assert run_tests(wd, paths=["extra/test_render.py"])["test_files"] == ["extra/test_render.py"]
+        summary = run_tests(wd)
+        assert summary["test_files"] == ["tests.py"] and summary["failed"] > 0, summary
+        with open(path, "w") as f:
+            f.write(source)
+        assert run_tests(wd)["failed"] == 0
+
+        # Edited and tested in one model turn: the tests run against the edit.
+        edit = types.FunctionCall(name="edit_file", args={
+            "file_path": "pkg/calculator.py",
+            "edits": [{"search": '"+": lambda a, b: a + b', "replace": '"+": lambda a, b: a - b'}],
+        })
+        results = func_calling.call_functions([edit, types.FunctionCall(name="run_tests", args={})], working_directory=wd)
+        edited, summary = (r.parts[0].function_response.response["result"] for r in results)
+        assert "Error" not in str(edited) and summary["test_files"] == ["tests.py"] and summary["failed"] > 0, summary
+
+
+def test_sandbox_containment():
+    import pathlib
+    import random
+    from functions import sandbox
+    from functions.get_file_content import get_file_content
+
+    # Randomized property check: resolve() accepts a path exactly when its
+    # fully resolved location is the root or below it, compared by path parts.
+    rng = random.Random(1234)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "calculator")
+        for d in ("calculator/pkg/sub", "calculator2", "outside"):
+            os.makedirs(os.path.join(tmp, d))
+        for f in ("calculator/main.py", "calculator/pkg/sub/x.py", "calculator2/secret.py", "outside/secret.py"):
+            with open(os.path.join(tmp, f), "w") as fh:
+                fh.write("x = 1\n")
+        os.symlink(os.path.join(tmp, "outside"), os.path.join(root, "escape"))
+        os.symlink(os.path.join(root, "pkg"), os.path.join(root, "alias"))
+        os.symlink("../calculator2/secret.py", os.path.join(root, "pkg", "link.py"))
+
+        parts = ["pkg", "sub", "x.py", "main.py", "..", ".", "escape", "alias", "link.py", "calculator2", "missing", "secret.py"]
+        real_root = pathlib.Path(root).resolve()
+        for _ in range(2000):
+            path = "/".join(rng.choice(parts) for _ in range(rng.randint(1, 5)))
+            if rng.random() < 0.1:
+                path = os.path.join(tmp, path)
+            expected = pathlib.Path(root, path).resolve().is_relative_to(real_root)
+            sandbox.begin_turn()
+            first = sandbox.resolve(root, path)
+            assert (first is not None) == expected, path
+            assert sandbox.resolve(root, path) == first
+            if first is not None:
+                assert pathlib.Path(first[1]).is_relative_to(real_root)
+
+        assert get_file_content(root, "../calculator2/secret.py").startswith("Error:")
+        assert get_file_content(root, "escape/secret.py").startswith("Error:")
+        assert get_file_content(root, "pkg/link.py").startswith("Error:")
+        assert get_file_content(root, "alias/sub/x.py") == "x = 1\n"
+
+
+def test_sandbox_turns():
+    import contextvars
+    import change_journal
+    from functions import sandbox
+
+    with tempfile.TemporaryDirectory() as wd:
+        real = os.path.join(os.path.realpath(wd), "a.py")
+        with open(real, "w") as f:
+            f.write("a = 1\n")
+        ours, theirs = sandbox.Timeline(), sandbox.Timeline()
+
+        def stat_in(turn):
+            context = contextvars.copy_context()
+            context.run(sandbox.enter, turn)
+            return context.run(sandbox.stat, real)
+
+        turn = sandbox.new_turn(ours)
+        assert stat_in(turn).st_size == 6 and real in turn.stats
+        # Another conversation starting turns neither clears nor shares our caches.
+        other = sandbox.new_turn(theirs)
+        assert (turn.number, other.number) == (1, 1) and real in turn.stats and real not in other.stats
+        # Outside any turn nothing is cached.
+        contextvars.Context().run(sandbox.stat, real)
+        assert contextvars.Context().run(sandbox.current).stats == {}
+
+        # Turn numbers shown to the model count per conversation.
+        def shown_turn(timeline):
+            call = types.FunctionCall(name="get_changes", args={})
+            return func_calling.call_functions([call], working_directory=wd, timeline=timeline)[0].parts[0].function_response.response["result"]["turn"]
+
+        assert [shown_turn(ours), shown_turn(ours), shown_turn(theirs), shown_turn(ours)] == [2, 3, 2, 4]
+    change_journal.drain_all()
+
+
+def test_tool_budget():
+    import tool_budget
+
+    with tempfile.TemporaryDirectory() as wd:
+        for i in range(8):
+            with open(os.path.join(wd, f"log{i}.txt"), "w") as f:
+                words = ["alpha", "beta", "gamma", "delta", "omega", "sigma"]
+                f.write("".join(f"{i} {' '.join(words[(n * k) % 6] for k in range(1, 8))} {n}\n" for n in range(2000)))
+        with open(os.path.join(wd, "big.py"), "w") as f:
+            f.write("import os\n\n" + "".join(f"def f{n}(x):\n    \"\"\"Doc {n}.\"\"\"\n    return x + {n}\n\n" for n in range(60)))
+
+        calls = [types.FunctionCall(name="get_file_content", args={"file_path": f"log{i}.txt"}) for i in range(8)]
+        results = func_calling.call_functions(calls, working_directory=wd)
+        texts = [r.parts[0].function_response.response["result"] for r in results]
+        used = sum(tool_budget.estimate_tokens(t) for t in texts)
+        print(f"tool budget: 8 reads of ~2500 tokens each came back as {used} tokens")
+        assert used <= tool_budget.TURN_TOOL_TOKEN_BUDGET + 8 * 100
+        assert all("to fit this turn's tool output budget" in t for t in texts)
+        assert all(t.startswith(f"{i} alpha alpha ") for i, t in enumerate(texts))
+
+        result = func_calling.call_function(types.FunctionCall(name="get_file_content", args={"file_path": "big.py"}), working_directory=wd,
+                                            budget=tool_budget.TurnBudget(max_tokens=400, min_tokens=0))
+        text = result.parts[0].function_response.response["result"]
+        assert "L1: import os" in text and "L3: def f0(x):" in text and '"""Doc 0."""' in text and "return x" not in text
+
+    assert tool_budget.collapse_repeats("a\n" + "row 1\nrow 2\nrow 3\nrow 4\nrow 5\n" + "b") == "a\nrow 1\n[... 3 similar lines collapsed ...]\nrow 5\nb"
+    value, steps = tool_budget.shrink_value({"entries": [f"file{i}.py 100" for i in range(1000)]}, 200)
+    assert value["entries_trimmed"] + len(value["entries"]) == 1000 and tool_budget.estimate_tokens(value) <= 200
+
+
+def test_session_resume():
+    import session as session_module
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wd = os.path.join(tmp, "work")
+        os.makedirs(wd)
+        for name in ("a.py", "b.py", "c.py"):
+            with open(os.path.join(wd, name), "w") as f:
+                f.write(f"# {name}\n" * 200)
+
+        def read_turn(path):
+            call = types.FunctionCall(name="get_file_content", args={"file_path": path})
+            return [
+                types.Content(role="model", parts=[types.Part(function_call=call)]),
+                func_calling.call_function(call, working_directory=wd),
+            ]
+
+        with session_module.Session.open("demo", working_directory=wd, session_dir=tmp) as saved:
+            assert not saved.resumed
+            saved.messages.append(types.Content(role="user", parts=[types.Part(text="read the files")]))
+            for path in ("a.py", "b.py", "c.py"):
+                for content in read_turn(path):
+                    saved.messages.append(content)
+            # Stopped before the calls of the last model message were answered.
+            saved.messages.append(read_turn("a.py")[0])
+            expected = [m.model_dump() for m in saved.messages[:-1]]
+        log_path = session_module.session_path("demo", tmp)
+        with open(log_path, "ab") as f:
+            f.write(session_module.RECORD.pack(1000, session_module.KIND_CONTENT) + b"{")  # torn write
+
+        with open(os.path.join(wd, "b.py"), "a") as f:
+            f.write("changed = True\n")
+        os.remove(os.path.join(wd, "c.py"))
+        os.utime(os.path.join(wd, "a.py"))  # newer mtime, same contents
+
+        with session_module.Session.open("demo", working_directory=wd, session_dir=tmp) as resumed:
+            assert resumed.resumed and len(resumed.messages) == 7 and resumed.messages.decoded == 0
+            assert resumed.changed_files == ["b.py"] and resumed.removed_files == ["c.py"]
+            notice = resumed.take_notice()[0].text
+            assert "b.py" in notice and "c.py" in notice and "a.py" not in notice and "unchanged" in notice
+            assert resumed.take_notice() == []
+            assert resumed.messages[2].parts[0].function_response.response == expected[2]["parts"][0]["function_response"]["response"]
+            assert resumed.messages.decoded == 1
+            assert [m.model_dump() for m in resumed.messages] == expected
+            resumed.messages.append(types.Content(role="user", parts=[types.Part(text="thanks")]))
+
+        with open(log_path, "rb") as f:
+            data = f.read()
+        assert data.startswith(session_module.MAGIC) and b"read the files" in data and b"# a.py" not in data  # big responses are compressed
+        with session_module.Session.open("demo", working_directory=wd, session_dir=tmp) as again:
+            assert len(again.messages) == 8 and again.messages[-1].parts[0].text == "thanks"
+            assert again.changed_files == [] and again.removed_files == []
+
+    # Compacting a long resumed session decodes only the turns it sends.
+    with tempfile.TemporaryDirectory() as tmp:
+        with session_module.Session.open("long", working_directory=tmp, session_dir=tmp) as saved:
+            for i in range(40):
+                call = types.FunctionCall(name="get_file_content", args={"file_path": f"f{i}.py"})
+                saved.messages.append(types.Content(role="user", parts=[types.Part(text=f"step {i}")]))
+                saved.messages.append(types.Content(role="model", parts=[types.Part(function_call=call)]))
+                saved.messages.append(types.Content(role="user", parts=[types.Part.from_function_response(name="get_file_content", response={"result": "x" * 2000})]))
+                saved.messages.append(types.Content(role="model", parts=[types.Part(text="ok")]))
+        with session_module.Session.open("long", working_directory=tmp, session_dir=tmp) as resumed:
+            history = HistoryManager(token_budget=1000, keep_recent=2)
+            compacted = history.compact(resumed.messages)
+            assert 0 < history.skipped < 150 and history.skipped % 4 == 0
+            assert resumed.messages.decoded < 160 - history.skipped + 4  # plus the part of a turn that overflowed
+            assert compacted[0].parts[0].text.startswith(f"[{history.skipped} older messages were skipped")
+            assert compacted[0].parts[1].text == f"step {history.skipped // 4}"
+            assert estimate_tokens(compacted) < 1200 and compacted[-1].parts[0].text == "ok"
+            history.token_budget = 10**6
+            assert len(history.compact(resumed.messages)) == 160 - history.skipped  # skipped turns stay skipped
+
+
+def test_diff_aware_rereads():
+    history = HistoryManager(token_budget=100000, keep_recent=0)
+    messages = []
+
+    def turn(name, **args):
+        call = types.FunctionCall(name=name, args=args)
+        messages.append(types.Content(role="model", parts=[types.Part(function_call=call)]))
+        messages.append(func_calling.call_functions([call], working_directory=wd, reads=history.reads)[0])
+        return messages[-1].parts[0].function_response.response["result"]
+
+    with tempfile.TemporaryDirectory() as wd:
+        lines = [f"def f{n}(x):\n    return x + {n}\n" for n in range(100)]
+        with open(os.path.join(wd, "mod.py"), "w") as f:
+            f.write("".join(lines))
+
+        first = turn("get_file_content", file_path="mod.py")
+        assert first == "".join(lines)
+        assert turn("get_file_content", file_path="./mod.py").startswith("[Unchanged since turn ")
+        lines[50] = "def f50(x):\n    return x * 50\n"
+        with open(os.path.join(wd, "mod.py"), "w") as f:
+            f.write("".join(lines))
+        diff = turn("get_file_content", file_path="mod.py")
+        assert diff.startswith("[Changes to mod.py") and "-    return x + 50" in diff and "+    return x * 50" in diff
+        assert len(diff) < len(first) // 10
+        assert turn("get_file_content", file_path="mod.py", full=True) == "".join(lines)
+        assert turn("get_file_content", file_path="mod.py", start_line=1, end_line=2).startswith("[Lines 1-2")
+
+        turn("write_file", file_path="new.py", content="print('hi')\n")
+        assert "the copy you wrote then" in turn("get_file_content", file_path="new.py")
+        with open(os.path.join(wd, "mod.py"), "w") as f:
+            f.write("rewritten\n")
+        assert turn("get_file_content", file_path="mod.py") == "rewritten\n"  # the diff would be larger than the file
+        # After an edit or a run the model gets the whole file again.
+        turn("edit_file", file_path="new.py", edits=[{"search": "hi", "replace": "bye"}])
+        assert turn("get_file_content", file_path="new.py") == "print('bye')\n"
+        assert turn("get_file_content", file_path="new.py").startswith("[Unchanged since turn ")
+        turn("run_python_file", file_path="new.py")
+        assert turn("get_file_content", file_path="new.py") == "print('bye')\n"
+
+    stats = history.reads.stats
+    print(f"re-reads: {stats}")
+    assert stats["unchanged_reads"] == 3 and stats["diff_reads"] == 1 and stats["tokens_saved"] > estimate_tokens(messages[1:2])
+
+    # Compaction keeps the full read the "unchanged" and diff reads refer to,
+    # but still drops the diff, which the later full read superseded.
+    compacted = history.compact(messages)
+    results = [c.parts[0].function_response.response["result"] for c in compacted[1::2]]
+    assert results[0] == first and results[1].startswith("[Unchanged since turn ")
+    assert "read again later" in results[2]
+
+
+def test_agent_daemon():
+    import threading
+    from agent_client import send
+    from agent_daemon import AgentDaemon
+
+    def reply(part, turn):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=10, candidates_token_count=turn),
+        )
+
+    listing = types.Part(function_call=types.FunctionCall(name="get_files_info", args={}))
+    responses = [reply(listing, 0), reply(types.Part(text="one file"), 1), reply(listing, 2), reply(types.Part(text="still one"), 3)]
+    client = ReplayClient(responses, latency=0.05, by_turn=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        wd = os.path.join(tmp, "work")
+        os.makedirs(wd)
+        with open(os.path.join(wd, "a.py"), "w") as f:
+            f.write("print(1)\n")
+        socket_path = os.path.join(tmp, "agent.sock")
+        daemon = AgentDaemon(client, "", socket_path, session_dir=tmp)
+        ready = threading.Event()
+        server = threading.Thread(target=daemon.serve_forever, args=(ready,))
+        server.start()
+        try:
+            ready.wait(5)
+            replies = [None] * 6
+            def ask(i):
+                replies[i] = send({"prompt": f"list {i}", "working_directory": wd}, socket_path)
+            start = time.perf_counter()
+            threads = [threading.Thread(target=ask, args=(i,)) for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            first = send({"prompt": "list", "working_directory": wd, "session": "s"}, socket_path)
+            second = send({"prompt": "and now?", "working_directory": wd, "session": "s"}, socket_path)
+            bad = send({"prompt": "list", "working_directory": os.path.join(tmp, "missing")}, socket_path)
+            not_an_object = send([], socket_path)
+            stats = send({"command": "stats"}, socket_path)
+        finally:
+            send({"command": "stop"}, socket_path)
+            server.join(5)
+        assert os.path.exists(os.path.join(tmp, "s.log")) and not os.path.exists(socket_path)
+
+    print(f"daemon: 6 concurrent sessions of 2 model calls in {elapsed:.2f}s")
+    assert all(r["status"] == "ok" and r["response"] == "one file" and r["model_calls"] == 2 for r in replies)
+    assert elapsed < 6 * 2 * 0.05  # served concurrently
+    assert first["response"] == "one file" and second["response"] == "still one"
+    assert len(client.requests[-1]["contents"]) == 7  # the second prompt saw the first exchange
+    assert bad["status"] == "error" and "does not exist" in bad["error"]
+    assert not_an_object == {"status": "error", "error": "invalid request: expected a JSON object"}
+    assert stats["sessions"] == 1 and stats["daemon"]["requests"] == 9 and stats["daemon"]["errors"] == 1
+
+
+def test_read_ahead():
+    import read_ahead
+
+    saved = read_ahead.buffer
+    read_ahead.buffer = buffer = read_ahead.ReadAhead(max_files=4, max_bytes=1000, file_max_bytes=200)
+    try:
+        with tempfile.TemporaryDirectory() as wd:
+            for name, content in (("a.py", "A = 1\r\n"), ("b.py", "B = 2\n"), ("c.py", "C = 3\n"), ("notes.txt", "hi\n"), ("d.py", "D = 4\n")):
+                with open(os.path.join(wd, name), "w", newline="") as f:
+                    f.write(content)
+            with open(os.path.join(wd, "big.py"), "w") as f:
+                f.write("x = 1\n" * 100)
+
+            def call(name, **args):
+                result = func_calling.call_functions([types.FunctionCall(name=name, args=args)], working_directory=wd)
+                return result[0].parts[0].function_response.response["result"]
+
+            listing = call("get_files_info")
+            assert listing["preloaded"] == ["a.py", "b.py", "c.py", "d.py"]  # .py first, big.py too large, capped at 4
+            assert call("get_file_content", file_path="a.py") == "A = 1\n"
+            assert call("get_file_content", file_path="b.py") == "B = 2\n"
+            call("write_file", file_path="c.py", content="C = 30\n")
+            assert call("get_file_content", file_path="c.py") == "C = 30\n"
+            assert call("get_file_content", file_path="notes.txt") == "hi\n"
+            while buffer._pending:
+                time.sleep(0.01)
+            stats = buffer.stats()
+    finally:
+        read_ahead.buffer = saved
+        buffer.close()
+    print(f"read-ahead: {stats}")
+    assert stats["scheduled"] == 4 and stats["hits"] == 2 and stats["misses"] == 2
+    assert stats["entries"] == 1 and stats["bytes"] == len("D = 4\n") and stats["wasted"] == 1
+
+
+def test_change_journal():
+    import change_journal
+    from functions import sandbox
+    from functions.write_file import write_file
+
+    for polling in (True, False):
+        with tempfile.TemporaryDirectory() as wd:
+            for name in ("a.py", "b.py", "c.py", os.path.join("pkg", "d.py")):
+                os.makedirs(os.path.dirname(os.path.join(wd, name)), exist_ok=True)
+                with open(os.path.join(wd, name), "w") as f:
+                    f.write("x = 1\n")
+            journal = change_journal.ChangeJournal(os.path.realpath(wd), polling=polling)
+            start = sandbox.begin_turn()
+
+            with open(os.path.join(wd, "a.py"), "a") as f:
+                f.write("y = 2\n")
+            write_file(wd, "pkg/d.py", "x = 10\n")  # atomic replace
+            os.remove(os.path.join(wd, "b.py"))
+            os.makedirs(os.path.join(wd, "new", "deep"))
+            with open(os.path.join(wd, "new", "deep", "e.py"), "w") as f:
+                f.write("e = 1\n")
+            with open(os.path.join(wd, "tmp.txt"), "w") as f:
+                f.write("gone soon\n")
+            journal.drain()
+            os.remove(os.path.join(wd, "tmp.txt"))
+            journal.drain()  # as ToolDispatcher does before starting a turn
+            second = sandbox.begin_turn()
+            with open(os.path.join(wd, "c.py"), "w") as f:
+                f.write("c = 3\n")
+
+            assert journal.backend == ("polling" if polling else "inotify")
+            _, changes, incomplete = journal.since(start)
+            assert changes == {
+                "created": [os.path.join("new", "deep", "e.py")],
+                "modified": ["a.py", "c.py", os.path.join("pkg", "d.py")],
+                "deleted": ["b.py"],
+            }, (polling, changes)
+            assert not incomplete
+            _, changes, _ = journal.since(second)
+            assert changes == {"created": [], "modified": ["c.py"], "deleted": []}, (polling, changes)
+
+            journal.max_events = 3
+            for i in range(4):
+                with open(os.path.join(wd, f"f{i}.py"), "w") as f:
+                    f.write("f\n")
+            journal.drain()
+            sandbox.begin_turn()
+            assert journal.since(start)[2]  # older events were dropped
+            journal.close()
+
+    with tempfile.TemporaryDirectory() as wd:
+        def get_changes(timeline=None, **args):
+            call = types.FunctionCall(name="get_changes", args=args)
+            return func_calling.call_functions([call], working_directory=wd, timeline=timeline)[0].parts[0].function_response.response["result"]
+
+        assert "Started watching" in get_changes()["note"]
+        write_file(wd, "main.py", "print(1)\n")
+        first = get_changes()
+        assert first["created"] == ["main.py"]
+        assert get_changes() == {"turn": first["turn"] + 1, "since_turn": first["turn"], "note": "No files changed."}
+        assert get_changes(since_turn=first["turn"] - 1)["created"] == ["main.py"]
+
+        # Two conversations on one directory each get changes since their own last call.
+        ours, theirs = sandbox.Timeline(), sandbox.Timeline()
+        get_changes(ours)
+        get_changes(theirs)
+        write_file(wd, "shared.py", "x = 1\n")
+        assert get_changes(theirs)["created"] == ["shared.py"]
+        assert get_changes(ours)["created"] == ["shared.py"]
+        assert "created" not in get_changes(ours)
+    change_journal.drain_all()
+    assert change_journal.journal_for(wd) is None
+
+
+def test_model_routing():
+    import main as agent
+    from model_router import ModelRouter, check_response, choose_tier
+
+    def reply(*parts, finish_reason=None):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=list(parts)), finish_reason=finish_reason)],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, candidates_token_count=5),
+        )
+
+    def call(name, **args):
+        return types.Part(function_call=types.FunctionCall(name=name, args=args))
+
+    def answered(name, response, text=None):
+        model_parts = [types.Part(text=text)] if text else []
+        return [
+            types.Content(role="user", parts=[types.Part(text="look around")]),
+            types.Content(role="model", parts=[*model_parts, call(name)]),
+            types.Content(role="tool", parts=[types.Part.from_function_response(name=name, response=response)]),
+        ]
+
+    prompt = [types.Content(role="user", parts=[types.Part(text="fix the bug")])]
+    assert choose_tier(prompt, 3) == 1
+    assert choose_tier(answered("get_files_info", {"result": {"entries": ["a.py 10"]}}), 3) == 0
+    assert choose_tier(answered("get_files_info", {"result": "Error: no such directory"}), 3) == 1
+    assert choose_tier(answered("get_files_info", {"error": "Unknown function"}), 3) == 1
+    assert choose_tier(answered("run_python_file", {"result": "STDOUT: 4"}), 3) == 1
+    assert choose_tier(answered("get_files_info", {"result": "ok"}, text="Let me look."), 3) == 1
+    assert choose_tier(answered("get_files_info", {"result": "x" * 4000}), 3, large_prompt_tokens=100) == 1
+    assert choose_tier(prompt, 1) == 0
+
+    config = types.GenerateContentConfig(tools=[func_calling.get_available_functions()])
+    assert check_response(reply(call("get_file_content", file_path="a.py")), config) is None
+    assert check_response(reply(types.Part(text="done")), config) is None
+    assert check_response(reply(call("delete_everything")), config) == "unknown_function"
+    assert check_response(reply(call("get_file_content")), config) == "missing_args"
+    assert check_response(reply(types.Part(text=" ")), config) == "empty"
+    assert check_response(reply(finish_reason=types.FinishReason.MALFORMED_FUNCTION_CALL), config) == "malformed_call"
+    assert check_response(None) == "empty"
+
+    # A whole run against a local backend with a latency per tier: the prompt
+    # goes to the middle tier, the follow-ups to plain listings and reads to
+    # the fast one.
+    latency = {"fast": 0.01, "mid": 0.03, "strong": 0.05}
+    responses = [reply(call("get_files_info")), reply(call("get_file_content", file_path="a.py")), reply(types.Part(text="a = 1"))]
+    backend = ReplayClient(responses, latency=latency, by_turn=True)
+    client = ModelRouter(backend, tiers=("fast", "mid", "strong"))
+    request = RequestConfig(client, "system")
+    with tempfile.TemporaryDirectory() as wd:
+        with open(os.path.join(wd, "a.py"), "w") as f:
+            f.write("a = 1\n")
+        messages = [types.Content(role="user", parts=[types.Part(text="what is a?")])]
+        while True:
+            response = agent.generate_content(client, messages, False, request, working_directory=wd)
+            if not response.function_calls:
+                break
+    assert [r["model"] for r in backend.requests] == ["mid", "fast", "fast"]
+    stats = client.stats()
+    assert stats["routed"] == 3 and stats["escalations"] == 0
+    assert stats["tiers"]["fast"]["calls"] == 2 and stats["tiers"]["fast"]["prompt_tokens"] == 200
+    assert stats["tiers"]["fast"]["p50_latency_s"] >= 0.01 and stats["tiers"]["mid"]["p50_latency_s"] >= 0.03
+    assert stats["tiers"]["strong"]["calls"] == 0
+
+    # Unusable answers and failures move the same request up a tier.
+    class ScriptedBackend:
+        def __init__(self, answers):
+            self.answers = answers
+            self.models = self
+            self.calls = []
+
+        def generate_content(self, *, model, contents, config=None):
+            self.calls.append(model)
+            answer = self.answers[model]
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+    contents = answered("get_files_info", {"result": {"entries": ["a.py 10"]}})
+    backend = ScriptedBackend({"fast": reply(call("delete_everything")), "mid": reply(call("get_file_content")), "strong": reply(types.Part(text="done"))})
+    client = ModelRouter(backend, tiers=("fast", "mid", "strong"))
+    response = client.models.generate_content(model="mid", contents=contents, config=config)
+    assert response.text == "done" and backend.calls == ["fast", "mid", "strong"]
+    stats = client.stats()
+    assert stats["escalations"] == 2 and stats["tiers"]["fast"]["rejected"] == 1 and stats["tiers"]["mid"]["rejected"] == 1
+
+    backend = ScriptedBackend({"fast": FakeModelError(404), "mid": reply(call("get_files_info")), "strong": FakeModelError(500)})
+    client = ModelRouter(backend, tiers=("fast", "mid", "strong"))
+    assert client.models.generate_content(model="mid", contents=contents, config=config).function_calls[0].name == "get_files_info"
+    assert backend.calls == ["fast", "mid"] and client.stats()["tiers"]["fast"]["errors"] == 1
+    backend.answers["mid"] = reply()
+    try:
+        client.models.generate_content(model="mid", contents=contents, config=config)
+        raise AssertionError("the top tier's error should propagate")
+    except FakeModelError:
+        pass
+
+    # A cached prefix belongs to one model, so the call keeps the model it named.
+    backend.calls.clear()
+    client.models.generate_content(model="mid", contents=contents, config=types.GenerateContentConfig(cached_content="cachedContents/1"))
+    assert backend.calls == ["mid"] and client.stats()["pinned"] == 1
+
+
+class FakeModelError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FlakyClient:
+    # Plays a script of (delay, error_code) steps, one per call; the response
+    # is just the call number.
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+        self.models = self
+        self.aio = self
+
+    def generate_content(self, **kwargs):
+        delay, error_code = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        call = self.calls
+        time.sleep(delay)
+        if error_code:
+            raise FakeModelError(error_code)
+        return call
+
+    async def generate_content_stream(self, **kwargs):
+        # Like the SDK, the request only fails once the stream is read.
+        delay, error_code = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        call = self.calls
+
+        async def chunks():
+            await asyncio.sleep(delay)
+            if error_code:
+                raise FakeModelError(error_code)
+            yield call
+            yield "end"
+        return chunks()
+
+
+def test_resilient_client():
+    from resilience import ResilientClient, DeadlineExceeded
+
+    client = ResilientClient(FlakyClient([(0, 503), (0, 429), (0, None)]), backoff_base=0.01)
+    assert client.generate_content(model="m", contents=[]) == 3
+    assert client.stats()["retries"] == 2
+
+    client = ResilientClient(FlakyClient([(0, 400), (0, None)]), backoff_base=0.01)
+    try:
+        client.generate_content(model="m", contents=[])
+        raise AssertionError("400 should not be retried")
+    except FakeModelError as e:
+        assert e.code == 400
+    assert client.stats()["retries"] == 0 and client.stats()["failures"] == 1
+
+    client = ResilientClient(FlakyClient([(1.0, None)]), deadline=0.2)
+    start = time.perf_counter()
+    try:
+        client.generate_content(model="m", contents=[])
+        raise AssertionError("deadline should be enforced")
+    except DeadlineExceeded:
+        pass
+    assert time.perf_counter() - start < 0.5
+
+    # Ten fast calls set the p95, then a slow primary is beaten by its hedge.
+    flaky = FlakyClient([(0.01, None)] * 10 + [(1.0, None), (0.01, None)])
+    client = ResilientClient(flaky, hedge=True)
+    for _ in range(10):
+        client.generate_content(model="m", contents=[])
+    start = time.perf_counter()
+    assert client.generate_content(model="m", contents=[]) == 12
+    elapsed = time.perf_counter() - start
+    stats = client.stats()
+    print(f"resilient client: hedged call took {elapsed:.3f}s, {stats}")
+    assert elapsed < 0.5
+    assert stats["hedges_sent"] == 1 and stats["hedge_wins"] == 1
+
+    # Streams are retried up to their first chunk, within the deadline.
+    async def read(client):
+        return [chunk async for chunk in await client.aio.models.generate_content_stream(model="m", contents=[])]
+
+    client = ResilientClient(FlakyClient([(0, 503), (0, 429), (0, None)]), backoff_base=0.01)
+    assert asyncio.run(read(client)) == [3, "end"]
+    assert client.stats()["retries"] == 2
+    client = ResilientClient(FlakyClient([(1.0, None)]), deadline=0.2)
+    start = time.perf_counter()
+    try:
+        asyncio.run(read(client))
+        raise AssertionError("deadline should be enforced")
+    except DeadlineExceeded:
+        pass
+    assert time.perf_counter() - start < 0.5 and client.stats()["deadline_exceeded"] == 1
+
+
+def test_recording_client():
+    from llm_client import RecordingClient, load_transcript
+
+    transcript = os.path.join("benchmarks", "transcripts", "calculator_session.jsonl")
+    replay = ReplayClient.from_file(transcript)
+    expected = load_transcript(transcript)[0]
+
+    async def read(client):
+        stream = await client.aio.models.generate_content_stream(model="m", contents=[])
+        return [chunk async for chunk in stream]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recorded.jsonl")
+        chunks = asyncio.run(read(RecordingClient(replay, path)))
+        recorded = load_transcript(path)
+    assert len(recorded) == 1
+
+    def summary(response):
+        parts = response.candidates[0].content.parts
+        return "".join(p.text or "" for p in parts), [p.function_call for p in parts if p.function_call]
+
+    assert summary(recorded[0]) == summary(expected)
+    assert recorded[0].usage_metadata == chunks[-1].usage_metadata
+
+
 if __name__ == "__main__":
     test()
+    test_call_functions()
+    test_dispatcher_barriers()
+    test_profiled_tool_threads()
+    test_generate_content_stream()
+    test_history_compaction()
+    test_tool_cache()
+    test_replay_session()
+    test_context_cache()
+    test_batch()
+    test_lazy_startup()
+    test_resilient_client()
+    test_recording_client()
+    test_ranged_reads()
+    test_files_listing()
+    test_search_files()
+    test_edit_file()
+    test_python_workers()
+    test_bounded_run_output()
+    test_run_tests()
+    test_sandbox_containment()
+    test_sandbox_turns()
+    test_tool_budget()
+    test_session_resume()
+    test_diff_aware_rereads()
+    test_agent_daemon()
+    test_read_ahead()
+    test_change_journal()
+    test_model_routing()
@@ -0,0 +1,200 @@
+import ast
+import json
+import re
+import threading
+from config import CHARS_PER_TOKEN, TOOL_RESULT_MIN_TOKENS, TURN_TOOL_TOKEN_BUDGET
+
+REPEAT_MIN_RUN = 4  # Runs of at least this many similar lines are collapsed.
+_DIGITS = re.compile(r"\d+")
+
+
+def estimate_tokens(result):
+    text = result if isinstance(result, str) else json.dumps(result, default=str)
+    return len(text) // CHARS_PER_TOKEN
+
+
+def collapse_repeats(text):
+    # Runs of lines that are equal once digits are ignored ("row 1", "row 2",
+    # ...) become their first and last line plus a count.
+    lines = text.split("\n")
+    out = []
+    i = 0
+    while i < len(lines):
+        key = _DIGITS.sub("#", lines[i])
+        j = i + 1
+        while j < len(lines) and _DIGITS.sub("#", lines[j]) == key:
+            j += 1
+        if j - i >= REPEAT_MIN_RUN and lines[i].strip():
+            out.append(lines[i])
+            out.append(f"[... {j - i - 2} similar lines collapsed ...]")
+            out.append(lines[j - 1])
+        else:
+            out.extend(lines[i:j])
+        i = j
+    return "\n".join(out)
+
+
+def outline_python(source):
+    # Imports, top-level assignments and class/def headers with the first
+    # docstring line, each prefixed with its line number. Returns None if the
+    # source does not parse (e.g. it was already truncated).
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    lines = source.splitlines()
+    out = []
+
+    def header(node, indent):
+        start = node.decorator_list[0].lineno if getattr(node, "decorator_list", None) else node.lineno
+        end = node.body[0].lineno - 1 if node.body else node.lineno
+        if end < node.lineno:  # body on the same line as the header
+            end = node.lineno
+        for number in range(start, end + 1):
+            out.append(f"L{number}: {lines[number - 1]}")
+        doc = ast.get_docstring(node)
+        if doc:
+            out.append(f"L{node.body[0].lineno}: {' ' * (indent + 4)}\"\"\"{doc.strip().splitlines()[0]}\"\"\"")
+        out.append(f"{' ' * (indent + 4)}... (lines {node.lineno}-{node.end_lineno})")
+
+    def visit(body, indent):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                header(node, indent)
+            elif isinstance(node, ast.ClassDef):
+                start = len(out)
+                header(node, indent)
+                out.pop()  # the class's own "..." line; its members follow instead
+                visit(node.body, indent + 4)
+                if len(out) == start + 1:
+                    out.append(f"{' ' * (indent + 4)}... (lines {node.lineno}-{node.end_lineno})")
+            elif indent == 0 and isinstance(node, (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)):
+                out.append(f"L{node.lineno}: {lines[node.lineno - 1]}")
+
+    visit(tree.body, 0)
+    return "\n".join(out)
+
+
+def head_tail(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    head = max_chars * 3 // 5
+    tail = max_chars - head
+    dropped = len(text) - head - tail
+    return text[:head] + f"\n[... {dropped} characters dropped ...]\n" + text[-tail:]
+
+
+def shrink_text(text, max_tokens, python_source=False):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    steps = []
+    outline = outline_python(text) if python_source else None
+    if outline is not None:
+        steps.append("outlined to signatures; read line ranges for bodies")
+        text = outline
+    else:
+        collapsed = collapse_repeats(text)
+        if collapsed != text:
+            steps.append("collapsed repeated lines")
+            text = collapsed
+    if len(text) > max_chars:
+        steps.append("kept head and tail")
+        text = head_tail(text, max_chars)
+    return text, steps
+
+
+def shrink_value(value, max_tokens):
+    # Dicts and lists (listings, test summaries): trim the longest list first,
+    # then shrink long strings.
+    if isinstance(value, str):
+        return shrink_text(value, max_tokens)
+    if not isinstance(value, dict):
+        text, steps = shrink_text(json.dumps(value, default=str), max_tokens)
+        return text, steps
+    value = dict(value)
+    steps = []
+    while estimate_tokens(value) > max_tokens:
+        lists = [(len(v), k) for k, v in value.items() if isinstance(v, list) and len(v) > 1]
+        if not lists:
+            break
+        _, key = max(lists)
+        items = value[key]
+        keep = max(1, len(items) // 2)
+        value[key] = items[:keep]
+        value[f"{key}_trimmed"] = value.get(f"{key}_trimmed", 0) + len(items) - keep
+        if f"trimmed {key}" not in steps:
+            steps.append(f"trimmed {key}")
+    if estimate_tokens(value) > max_tokens:
+        share = max(max_tokens // max(len(value), 1), 1)
+        for key, item in value.items():
+            if isinstance(item, str) and estimate_tokens(item) > share:
+                value[key], _ = shrink_text(item, share)
+        steps.append("shortened long fields")
+    return value, steps
+
+
+class TurnBudget:
+    """Token budget shared by the tool results of one model turn.
+
+    Each call reserves a share when it is submitted; when it finishes it may
+    use an equal split of what is left among the calls still outstanding (and
+    at least TOOL_RESULT_MIN_TOKENS). Larger results are shrunk.
+    """
+
+    def __init__(self, max_tokens=TURN_TOOL_TOKEN_BUDGET, min_tokens=TOOL_RESULT_MIN_TOKENS):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.remaining = max_tokens
+        self.outstanding = 0
+        self.stats = {"calls": 0, "tokens_in": 0, "tokens_out": 0, "trimmed_calls": 0, "trimmed_tokens": 0}
+        self._lock = threading.Lock()
+
+    def reserve(self, count=1):
+        with self._lock:
+            self.outstanding += count
+
+    def fit(self, function_name, args, result):
+        tokens = estimate_tokens(result)
+        with self._lock:
+            allowance = max(self.remaining // max(self.outstanding, 1), self.min_tokens)
+            self.outstanding = max(self.outstanding - 1, 0)
+        fitted, steps = result, []
+        if tokens > allowance:
+            is_source = (
+                function_name == "get_file_content"
+                and str(args.get("file_path", "")).endswith(".py")
+                and not any(args.get(k) is not None for k in ("offset", "length", "start_line", "end_line", "tail_lines"))
+            )
+            if isinstance(result, str):
+                fitted, steps = shrink_text(result, allowance, python_source=is_source)
+            else:
+                fitted, steps = shrink_value(result, allowance)
+            note = (
+                f"[Result trimmed from ~{tokens} to ~{estimate_tokens(fitted)} tokens to fit this turn's tool output "
+                f"budget ({', '.join(steps)}). Ask for less per call, e.g. a line range or a narrower listing.]"
+            )
+            if isinstance(fitted, str):
+                fitted = f"{fitted}\n{note}"
+            else:
+                fitted["budget_note"] = note
+        used = estimate_tokens(fitted)
+        with self._lock:
+            self.remaining = max(self.remaining - used, 0)
+            self.stats["calls"] += 1
+            self.stats["tokens_in"] += tokens
+            self.stats["tokens_out"] += used
+            if fitted is not result:
+                self.stats["trimmed_calls"] += 1
+                self.stats["trimmed_tokens"] += max(tokens - used, 0)
+        return fitted, max(tokens - used, 0)
+
+
+# Totals over every turn of the process, shown with --verbose.
+session_stats = {"turns": 0, "calls": 0, "tokens_in": 0, "tokens_out": 0, "trimmed_calls": 0, "trimmed_tokens": 0}
+_session_lock = threading.Lock()
+
+
+def record_turn(budget):
+    with _session_lock:
+        session_stats["turns"] += 1
+        for key, value in budget.stats.items():
+            session_stats[key] += value
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from config import TOOL_CACHE_MAX_BYTES
+from functions import sandbox
+from tracing import current_span
+
+# Listings are not cached: a recursive listing is only current if every
+# directory and entry it shows is unchanged, and checking that costs as much
+# as listing again.
+CACHEABLE_FUNCTIONS = {"get_file_content"}
+
+
+def _result_size(result):
+    return len(result) if isinstance(result, str) else len(json.dumps(result, default=str))
+
+
+class ToolCache:
+    """LRU cache of read-only tool results, bounded by total result size.
+
+    Keys include the target's mtime_ns and size, so a file changed outside the
+    agent simply misses. Writes done through the agent also invalidate
+    explicitly, in case a rewrite keeps both.
+    """
+
+    def __init__(self, max_bytes=TOOL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, function_name, args):
+        resolved = sandbox.resolve(args["working_directory"], args.get("file_path", "."))
+        st = sandbox.stat(resolved[1]) if resolved is not None else None
+        if st is None:
+            return None
+        abs_path = resolved[1]
+        other_args = {k: v for k, v in args.items() if k not in ("file_path", "directory", "working_directory")}
+        return (function_name, abs_path, json.dumps(other_args, sort_keys=True, default=str), st.st_mtime_ns, st.st_size)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, abs_path):
+        # Drops entries for the path itself, anything below it, and the
+        # listings of the directories above it.
+        abs_path = os.path.abspath(abs_path)
+        with self._lock:
+            for key in list(self._entries):
+                cached_path = key[1]
+                if (
+                    cached_path == abs_path
+                    or cached_path.startswith(abs_path + os.sep)
+                    or abs_path.startswith(cached_path + os.sep)
+                ):
+                    self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+            }
+
+
+tool_cache = ToolCache()
+
+
+def call_cached(function, function_name, args):
+    if function_name in CACHEABLE_FUNCTIONS:
+        key = tool_cache.make_key(function_name, args)
+        if key is not None:
+            result = tool_cache.get(key)
+            current_span().set(cache_hit=result is not None)
+            if result is None:
+                result = function(**args)
+                # Don't keep errors around; the next call should retry.
+                if not (isinstance(result, str) and result.startswith("Error")):
+                    tool_cache.put(key, result)
+            return result
+        return function(**args)
+
+    result = function(**args)
+    if function_name in ("write_file", "edit_file"):
+        resolved = sandbox.resolve(args["working_directory"], args.get("file_path", ""))
+        if resolved is not None:
+            tool_cache.invalidate(resolved[1])
+    elif function_name in ("run_python_file", "run_tests"):
+        # A script can write anywhere in the working directory.
+        tool_cache.invalidate(sandbox.resolve(args["working_directory"])[0])
+    return result
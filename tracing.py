@@ -0,0 +1,136 @@
+# Span tracing for agent sessions, written as one JSON object per line.
+#
+# Tracing is off unless `tracer.open(path)` is called (main.py --trace=FILE),
+# in which case `span()` costs a dict and a clock read per span.
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def record(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "start": round(self.start, 6),
+            "duration_ms": round((time.perf_counter() - self._start_perf) * 1000, 3),
+            **self.attrs,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, path):
+        self.close()
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+tracer = Tracer()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    if not tracer.enabled:
+        yield NOOP_SPAN
+        return
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.write(current.record())
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextlib.contextmanager
+def profiled(path):
+    if not path:
+        yield
+        return
+    import cProfile
+
+    # Since Python 3.12 cProfile hooks in through sys.monitoring, which covers
+    # every thread, so tool calls on ToolDispatcher's pool threads are in the
+    # profile along with the main loop.
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (view with: python -m pstats {path})")
+
+
+def percentiles(samples):
+    import statistics
+
+    samples = sorted(samples)
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"n": len(samples), "p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": samples[-1]}
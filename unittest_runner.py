@@ -0,0 +1,148 @@
+# Runs the tests of one test file for the run_tests tool and writes the
+# results as JSON, so the agent never has to parse unittest's text output.
+#
+#   python unittest_runner.py TEST_FILE RESULTS_JSON SHARD SHARDS [TEST_ID ...]
+#
+# Loads unittest.TestCase classes plus pytest-style test_* functions and
+# Test* classes, then runs every SHARDS-th test starting at SHARD. Only
+# imports the stdlib, like python_worker_server.
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import time
+import traceback
+import unittest
+
+TRACEBACK_LINES = 15
+
+
+def load_module(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _pytest_style(module):
+    tests = []
+    for name, obj in vars(module).items():
+        if name.startswith("test") and inspect.isfunction(obj) and obj.__module__ == module.__name__:
+            if not inspect.signature(obj).parameters:
+                tests.append(unittest.FunctionTestCase(obj, description=f"{module.__name__}.{name}"))
+        elif name.startswith("Test") and inspect.isclass(obj) and not issubclass(obj, unittest.TestCase):
+            for method in sorted(m for m in vars(obj) if m.startswith("test") and callable(getattr(obj, m))):
+                def run(cls=obj, method=method):
+                    getattr(cls(), method)()
+                tests.append(unittest.FunctionTestCase(run, description=f"{module.__name__}.{name}.{method}"))
+    return tests
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
+
+
+def _test_id(test):
+    return test.shortDescription() if isinstance(test, unittest.FunctionTestCase) else test.id()
+
+
+def _without_runner_frames(lines):
+    kept = []
+    skipping = False
+    for line in lines:
+        if line.startswith("  File "):
+            skipping = line.startswith(f'  File "{__file__}"')
+        elif not line.startswith("    "):
+            skipping = False
+        if not skipping:
+            kept.append(line)
+    return kept
+
+
+class JsonResult(unittest.TestResult):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.passed = 0
+        self._started = 0.0
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+
+    def _record(self, test, kind, err=None, reason=None):
+        record = {"test": _test_id(test), "kind": kind, "duration_s": round(time.perf_counter() - self._started, 4)}
+        if err is not None:
+            # unittest already strips its own frames; drop this runner's and
+            # keep the end, where the assertion and the failing line are.
+            lines = _without_runner_frames(self._exc_info_to_string(err, test).rstrip("\n").splitlines())
+            if len(lines) > TRACEBACK_LINES:
+                lines = [f"... {len(lines) - TRACEBACK_LINES} traceback lines trimmed"] + lines[-TRACEBACK_LINES:]
+            record["traceback"] = "\n".join(lines)
+        if reason:
+            record["reason"] = reason
+        self.records.append(record)
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self.passed += 1
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "fail", err)
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", err)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skip", reason=reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self.passed += 1
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "fail", reason="unexpected success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self._record(subtest, "fail" if issubclass(err[0], test.failureException) else "error", err)
+
+
+def main(path, results_path, shard, shards, selected):
+    started = time.perf_counter()
+    results = {"file": path, "passed": 0, "total": 0, "records": []}
+    try:
+        module = load_module(path)
+        tests = list(_flatten(unittest.defaultTestLoader.loadTestsFromModule(module))) + _pytest_style(module)
+        if selected:
+            tests = [t for t in tests if _test_id(t) in selected or _test_id(t).split(".")[-1] in selected]
+        tests = tests[shard::shards]
+        result = JsonResult()
+        unittest.TestSuite(tests).run(result)
+        results.update(passed=result.passed, total=result.testsRun, records=result.records)
+    except BaseException:
+        lines = traceback.format_exc().rstrip("\n").splitlines()[-TRACEBACK_LINES:]
+        results["records"].append({"test": os.path.basename(path), "kind": "error", "traceback": "\n".join(lines)})
+    results["duration_s"] = round(time.perf_counter() - started, 4)
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+
+
+if __name__ == "__main__":
+    test_file = os.path.abspath(sys.argv[1])
+    sys.path[0] = os.path.dirname(test_file)
+    if os.getcwd() not in sys.path:
+        sys.path.insert(1, os.getcwd())
+    main(test_file, sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), set(sys.argv[5:]))